@@ -437,7 +437,14 @@ def upgrade() -> None:
         ),
         sa.Column('size', sa.Integer(), nullable=False),
         sa.Column('file_id', sa.Unicode(length=64), nullable=False),
+        sa.Column('preview_line', sa.UnicodeText(), nullable=True),
         sa.Column('tags', sa.ARRAY(sa.Unicode(length=40), dimensions=1), server_default='{}', nullable=False),
+        sa.Column(
+            'status',
+            sa.Enum('pending', 'imported', 'failed', name='trace_status'),
+            server_default='pending',
+            nullable=False,
+        ),
         sa.Column('id', sa.BigInteger(), sa.Identity(always=False, minvalue=1), nullable=False),
         sa.Column(
             'created_at',
@@ -696,6 +703,10 @@ def upgrade() -> None:
         postgresql_using='gist',
     )
     op.create_index('element_version_idx', 'element', ['type', 'id', 'version'], unique=False)
+    op.execute('CREATE SEQUENCE element_sequence_id_seq MINVALUE 1;')
+    op.execute('CREATE SEQUENCE element_node_id_seq MINVALUE 1;')
+    op.execute('CREATE SEQUENCE element_way_id_seq MINVALUE 1;')
+    op.execute('CREATE SEQUENCE element_relation_id_seq MINVALUE 1;')
     op.create_table(
         'issue_comment',
         sa.Column('user_id', sa.BigInteger(), nullable=False),
@@ -820,19 +831,42 @@ def upgrade() -> None:
         sa.Column('trace_id', sa.BigInteger(), nullable=False),
         sa.Column('track_num', sa.SmallInteger(), nullable=False),
         sa.Column('segment_num', sa.SmallInteger(), nullable=False),
-        sa.Column('points', app.models.geometry.MultiPointType(), nullable=False),
+        sa.Column('bounds', app.models.geometry.PolygonType(), nullable=True),
+        sa.Column('data', sa.LargeBinary(), nullable=True),
+        sa.Column('points', app.models.geometry.MultiPointType(), nullable=True),
         sa.Column('capture_times', sa.ARRAY(postgresql.TIMESTAMP(timezone=True), dimensions=1), nullable=True),
         sa.Column('elevations', sa.ARRAY(sa.REAL(), dimensions=1), nullable=True),
         sa.ForeignKeyConstraint(['trace_id'], ['trace.id'], ondelete='CASCADE'),
         sa.PrimaryKeyConstraint('trace_id', 'track_num', 'segment_num'),
     )
+    op.create_index('trace_segment_bounds_idx', 'trace_segment', ['bounds'], unique=False, postgresql_using='gist')
     op.create_index('trace_segment_points_idx', 'trace_segment', ['points'], unique=False, postgresql_using='gist')
+    op.create_table(
+        'trace_job',
+        sa.Column('trace_id', sa.BigInteger(), nullable=False),
+        sa.Column('processing_counter', sa.SmallInteger(), server_default='0', nullable=False),
+        sa.Column('processing_at', postgresql.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('progress', sa.REAL(), server_default='0', nullable=False),
+        sa.Column('error', sa.UnicodeText(), nullable=True),
+        sa.Column(
+            'created_at',
+            postgresql.TIMESTAMP(timezone=True),
+            server_default=sa.text('statement_timestamp()'),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(['trace_id'], ['trace.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('trace_id'),
+    )
+    op.create_index('trace_job_processing_at_idx', 'trace_job', ['processing_at'], unique=False)
     # ### end Alembic commands ###
 
 
 def downgrade() -> None:
     # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_index('trace_job_processing_at_idx', table_name='trace_job')
+    op.drop_table('trace_job')
     op.drop_index('trace_segment_points_idx', table_name='trace_segment', postgresql_using='gist')
+    op.drop_index('trace_segment_bounds_idx', table_name='trace_segment', postgresql_using='gist')
     op.drop_table('trace_segment')
     op.drop_table('report')
     op.drop_index(
@@ -850,6 +884,10 @@ def downgrade() -> None:
     )
     op.drop_table('oauth2_token')
     op.drop_table('issue_comment')
+    op.execute('DROP SEQUENCE element_relation_id_seq;')
+    op.execute('DROP SEQUENCE element_way_id_seq;')
+    op.execute('DROP SEQUENCE element_node_id_seq;')
+    op.execute('DROP SEQUENCE element_sequence_id_seq;')
     op.drop_index('element_version_idx', table_name='element')
     op.drop_index(
         'element_node_point_idx',
@@ -88,6 +88,7 @@ OSM_REPLICATION_URL = os.getenv(
 )
 OSRM_URL = os.getenv('OSRM_URL', 'https://router.project-osrm.org')
 OVERPASS_INTERPRETER_URL = os.getenv('OVERPASS_INTERPRETER_URL', 'https://overpass-api.de/api/interpreter')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # None for AWS, or an S3-compatible server (e.g. MinIO)
 VALHALLA_URL = os.getenv('VALHALLA_URL', 'https://valhalla1.openstreetmap.de')
 
 # https://developers.facebook.com/docs/development/create-an-app/facebook-login-use-case
@@ -1,10 +1,10 @@
-from collections.abc import Sequence
 from typing import Annotated, Literal
 
 from fastapi import APIRouter, Query, Response, status
 from pydantic import PositiveInt
 from sqlalchemy.orm import joinedload, raiseload
 
+from app.exceptions.api_error import APIError
 from app.format import Format06
 from app.lib.auth_context import api_user
 from app.lib.date_utils import parse_date
@@ -13,6 +13,7 @@ from app.lib.geo_utils import parse_bbox
 from app.lib.options_context import options_context
 from app.lib.xml_body import xml_body
 from app.limits import CHANGESET_QUERY_DEFAULT_LIMIT, CHANGESET_QUERY_MAX_LIMIT, DISPLAY_NAME_MAX_LENGTH
+from app.middlewares.request_context_middleware import get_request
 from app.models.db.changeset import Changeset
 from app.models.db.changeset_comment import ChangesetComment
 from app.models.db.user import User
@@ -107,12 +108,12 @@ async def update_changeset(
 @router.post('/changeset/{changeset_id:int}/upload', response_class=DiffResultResponse)
 async def upload_diff(
     changeset_id: PositiveInt,
-    data: Annotated[Sequence, xml_body('osmChange')],
     _: Annotated[User, api_user(Scope.write_api)],
 ):
     try:
-        # implicitly assume stings are proper types
-        elements = Format06.decode_osmchange(data, changeset_id=changeset_id)
+        elements = Format06.decode_osmchange(get_request()._body, changeset_id=changeset_id)  # noqa: SLF001
+    except APIError:
+        raise
     except Exception as e:
         raise_for.bad_xml('osmChange', str(e))
 
@@ -1,9 +1,13 @@
 from asyncio import TaskGroup
-from collections.abc import Sequence
-from typing import Annotated
+from collections.abc import Iterator, Sequence
+from functools import lru_cache
+from time import time
+from typing import IO, Annotated
 
 from fastapi import APIRouter, File, Form, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
 from pydantic import NonNegativeInt, PositiveInt
+from shapely import MultiPolygon, Polygon
 from sqlalchemy.orm import joinedload
 
 from app.format import Format06
@@ -12,20 +16,30 @@ from app.lib.auth_context import api_user
 from app.lib.exceptions_context import raise_for
 from app.lib.geo_utils import parse_bbox
 from app.lib.options_context import options_context
+from app.lib.signed_cursor import decode_signed_cursor, encode_signed_cursor
+from app.lib.trace_file import TraceFile
 from app.lib.xml_body import xml_body
-from app.limits import TRACE_POINT_QUERY_AREA_MAX_SIZE, TRACE_POINT_QUERY_DEFAULT_LIMIT
+from app.limits import (
+    TRACE_POINT_QUERY_AREA_MAX_SIZE,
+    TRACE_POINT_QUERY_CURSOR_EXPIRE,
+    TRACE_POINT_QUERY_DEFAULT_LIMIT,
+)
+from app.middlewares.request_context_middleware import get_request
 from app.models.db.trace_ import Trace, TraceVisibility
 from app.models.db.trace_segment import TraceSegment
 from app.models.db.user import User
+from app.models.proto.server_pb2 import TracePointsCursor
 from app.models.scope import Scope
 from app.models.types import Str255
 from app.queries.trace_query import TraceQuery
-from app.queries.trace_segment_query import TraceSegmentQuery
+from app.queries.trace_segment_query import TraceSegmentPosition, TraceSegmentQuery
 from app.responses.osm_response import GPXResponse
 from app.services.trace_service import TraceService
 
 router = APIRouter(prefix='/api/0.6')
 
+_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
 
 @router.post('/gpx/create')
 async def upload_trace(
@@ -77,26 +91,29 @@ async def get_trace_gpx(
     # ensures that user has access to the trace
     trace = await TraceQuery.get_one_by_id(trace_id)
     segments = await TraceSegmentQuery.get_many_by_trace_id(trace_id)
-    data = FormatGPX.encode_track((segments,), trace)
-    resp = GPXResponse.serialize(data)
-    return Response(
-        content=resp.body,
-        status_code=resp.status_code,
-        headers={**resp.headers, 'Content-Disposition': f'attachment; filename="{trace_id}.gpx"'},
-        media_type=resp.media_type,
-    )
+    resp = GPXResponse.serialize_elements_stream({}, FormatGPX.encode_track_stream((segments,), trace))
+    resp.headers['Content-Disposition'] = f'attachment; filename="{trace_id}.gpx"'
+    return resp
 
 
 @router.get('/gpx/{trace_id:int}/data')
 async def download_trace(
     trace_id: PositiveInt,
 ):
-    content = await TraceQuery.get_one_data_by_id(trace_id)
-    return Response(
-        content=content,
-        # intentionally not using trace.name here, it's unsafe and difficult to make right, removing in API 0.7
-        headers={'Content-Disposition': f'attachment; filename="{trace_id}"'},
-    )
+    file_id, file = await TraceQuery.open_one_data_by_id(trace_id)
+    # intentionally not using trace.name here, it's unsafe and difficult to make right, removing in API 0.7
+    headers = {'Content-Disposition': f'attachment; filename="{trace_id}"', 'Vary': 'Accept-Encoding'}
+
+    # send the compressed file as-is if the client supports it, otherwise decompress it incrementally
+    encoding = TraceFile.content_encoding(file_id)
+    if encoding is not None:
+        accept_encoding = get_request().headers.get('Accept-Encoding')
+        if accept_encoding and _accepts_encoding(accept_encoding, encoding):
+            headers['Content-Encoding'] = encoding
+        else:
+            file = TraceFile.open_decompressed(file, file_id)
+
+    return StreamingResponse(_iter_file(file), headers=headers)
 
 
 @router.put('/gpx/{trace_id:int}')
@@ -134,11 +151,82 @@ async def delete_trace(
 async def trackpoints(
     bbox: Annotated[str, Query()],
     page_number: Annotated[NonNegativeInt, Query(alias='pageNumber')] = 0,
+    cursor: Annotated[str | None, Query()] = None,
 ):
     geometry = parse_bbox(bbox)
     if geometry.area > TRACE_POINT_QUERY_AREA_MAX_SIZE:
         raise_for.trace_points_query_area_too_big()
+    minx, miny, maxx, maxy = geometry.bounds
+
+    # backwards compatibility: offset pagination
+    if cursor is None and page_number:
+        return await _trackpoints_legacy(geometry, page_number)
+
+    if cursor is not None:
+        state = decode_signed_cursor(cursor, TracePointsCursor, expire=TRACE_POINT_QUERY_CURSOR_EXPIRE)
+        # cursor is only valid for the bbox it was created for
+        if (state.min_lon, state.min_lat, state.max_lon, state.max_lat) != (minx, miny, maxx, maxy):
+            raise_for.bad_cursor()
+        timestamp = state.timestamp
+        identifiable_after = _decode_position(state, 'identifiable_after')
+        anonymous_after = _decode_position(state, 'anonymous_after')
+    else:
+        timestamp = int(time())
+        identifiable_after = None
+        anonymous_after = None
+
+    async def identifiable_task():
+        # skip the exhausted query
+        if cursor is not None and identifiable_after is None:
+            return (), None
+        with options_context(joinedload(TraceSegment.trace).load_only(Trace.name, Trace.description, Trace.visibility)):
+            return await TraceSegmentQuery.find_many_by_geometry_page(
+                geometry,
+                identifiable_trackable=True,
+                after=identifiable_after,
+                limit=TRACE_POINT_QUERY_DEFAULT_LIMIT,
+            )
+
+    async def anonymous_task():
+        # skip the exhausted query
+        if cursor is not None and anonymous_after is None:
+            return (), None
+        return await TraceSegmentQuery.find_many_by_geometry_page(
+            geometry,
+            identifiable_trackable=False,
+            after=anonymous_after,
+            limit=TRACE_POINT_QUERY_DEFAULT_LIMIT,
+        )
+
+    async with TaskGroup() as tg:
+        identifiable_t = tg.create_task(identifiable_task())
+        anonymous_t = tg.create_task(anonymous_task())
+
+    identifiable_segments, next_identifiable_after = identifiable_t.result()
+    anonymous_segments, next_anonymous_after = anonymous_t.result()
+    resp = GPXResponse.serialize_elements_stream(
+        {}, FormatGPX.encode_track_stream((identifiable_segments, anonymous_segments))
+    )
+    if next_identifiable_after is None and next_anonymous_after is None:
+        return resp
+
+    next_cursor = encode_signed_cursor(
+        TracePointsCursor(
+            timestamp=timestamp,
+            identifiable_after=_encode_position(next_identifiable_after),
+            anonymous_after=_encode_position(next_anonymous_after),
+            min_lon=minx,
+            min_lat=miny,
+            max_lon=maxx,
+            max_lat=maxy,
+        )
+    )
+    next_url = get_request().url.remove_query_params('pageNumber').include_query_params(cursor=next_cursor)
+    resp.headers['Link'] = f'<{next_url}>; rel="next"'
+    return resp
+
 
+async def _trackpoints_legacy(geometry: Polygon | MultiPolygon, page_number: int) -> StreamingResponse:
     async def public_task():
         with options_context(joinedload(TraceSegment.trace).load_only(Trace.name, Trace.description, Trace.visibility)):
             return await TraceSegmentQuery.find_many_by_geometry(
@@ -162,4 +250,61 @@ async def trackpoints(
 
     public_segments = public_t.result()
     private_segments = private_t.result()
-    return FormatGPX.encode_track((public_segments, private_segments))
+    return GPXResponse.serialize_elements_stream({}, FormatGPX.encode_track_stream((public_segments, private_segments)))
+
+
+@lru_cache(maxsize=512)
+def _accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """
+    Check if the accept encoding header allows the given content encoding.
+
+    Codings with a zero q-factor are not acceptable.
+
+    >>> _accepts_encoding('gzip, zstd;q=0.5', 'zstd')
+    True
+    >>> _accepts_encoding('*, zstd;q=0', 'zstd')
+    False
+    """
+    wildcard = False
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if coding not in (encoding, '*'):
+            continue
+
+        accepted = True
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    accepted = float(value) > 0
+                except ValueError:
+                    accepted = False
+                break
+
+        # an explicit coding takes precedence over the wildcard
+        if coding == encoding:
+            return accepted
+        wildcard = accepted
+    return wildcard
+
+
+def _iter_file(file: IO[bytes]) -> Iterator[bytes]:
+    # blocking reads are offloaded to the thread pool by StreamingResponse
+    with file:
+        while chunk := file.read(_DOWNLOAD_CHUNK_SIZE):
+            yield chunk
+
+
+def _decode_position(state: TracePointsCursor, field: str) -> TraceSegmentPosition | None:
+    if not state.HasField(field):
+        return None
+    position: TracePointsCursor.Position = getattr(state, field)
+    return position.trace_id, position.track_num, position.segment_num
+
+
+def _encode_position(position: TraceSegmentPosition | None) -> TracePointsCursor.Position | None:
+    if position is None:
+        return None
+    trace_id, track_num, segment_num = position
+    return TracePointsCursor.Position(trace_id=trace_id, track_num=track_num, segment_num=segment_num)
@@ -16,8 +16,9 @@ router = APIRouter(prefix='/api/0.6')
 @router.get('/user/details.xml')
 @router.get('/user/details.json')
 async def get_current_user(
-    user: Annotated[User, api_user()],
+    _: Annotated[User, api_user()],
 ):
+    user = await UserQuery.find_one_auth_user(required=True)
     return await Format06.encode_user(user)
 
 
@@ -1,4 +1,5 @@
 from asyncio import TaskGroup
+from time import time
 from typing import Annotated
 
 from fastapi import APIRouter, Query
@@ -6,7 +7,9 @@ from fastapi import APIRouter, Query
 from app.format import Format07
 from app.lib.exceptions_context import raise_for
 from app.lib.geo_utils import parse_bbox
-from app.limits import MAP_QUERY_AREA_MAX_SIZE, MAP_QUERY_LEGACY_NODES_LIMIT
+from app.lib.signed_cursor import decode_signed_cursor, encode_signed_cursor
+from app.limits import MAP_QUERY_AREA_MAX_SIZE, MAP_QUERY_CURSOR_EXPIRE, MAP_QUERY_PAGE_NODES_LIMIT
+from app.models.proto.server_pb2 import MapCursor
 from app.queries.element_member_query import ElementMemberQuery
 from app.queries.element_query import ElementQuery
 from app.queries.user_query import UserQuery
@@ -14,21 +17,56 @@ from app.queries.user_query import UserQuery
 router = APIRouter(prefix='/api/0.7')
 
 
-# TODO: limits + cursor (1min expiration?)
 @router.get('/map')
-async def get_map(bbox: Annotated[str, Query()]):
+async def get_map(
+    bbox: Annotated[str, Query()],
+    cursor: Annotated[str | None, Query()] = None,
+):
     geometry = parse_bbox(bbox)
     if geometry.area > MAP_QUERY_AREA_MAX_SIZE:
         raise_for.map_query_area_too_big()
+    minx, miny, maxx, maxy = geometry.bounds
 
-    elements = await ElementQuery.find_many_by_geom(
+    if cursor is not None:
+        state = decode_signed_cursor(cursor, MapCursor, expire=MAP_QUERY_CURSOR_EXPIRE)
+        # cursor is only valid for the bbox it was created for
+        if (state.min_lon, state.min_lat, state.max_lon, state.max_lat) != (minx, miny, maxx, maxy):
+            raise_for.bad_cursor()
+        timestamp = state.timestamp
+        at_sequence_id = state.at_sequence_id
+        after_node_id = state.after_node_id
+    else:
+        timestamp = int(time())
+        at_sequence_id = None
+        after_node_id = None
+
+    elements, at_sequence_id, next_after_node_id = await ElementQuery.find_many_by_geom_page(
         geometry,
-        nodes_limit=MAP_QUERY_LEGACY_NODES_LIMIT,
-        legacy_nodes_limit=True,
+        at_sequence_id=at_sequence_id,
+        after_node_id=after_node_id,
+        nodes_limit=MAP_QUERY_PAGE_NODES_LIMIT,
     )
 
     async with TaskGroup() as tg:
         tg.create_task(UserQuery.resolve_elements_users(elements, display_name=False))
         tg.create_task(ElementMemberQuery.resolve_members(elements))
 
-    return Format07.encode_elements(elements)
+    next_cursor = (
+        encode_signed_cursor(
+            MapCursor(
+                timestamp=timestamp,
+                at_sequence_id=at_sequence_id,
+                after_node_id=next_after_node_id,
+                min_lon=minx,
+                min_lat=miny,
+                max_lon=maxx,
+                max_lat=maxy,
+            )
+        )
+        if next_after_node_id is not None
+        else None
+    )
+    return {
+        'elements': Format07.encode_elements(elements),
+        'cursor': next_cursor,
+    }
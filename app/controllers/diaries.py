@@ -9,6 +9,7 @@ from app.lib.auth_context import auth_user
 from app.lib.locale import INSTALLED_LOCALES_NAMES_MAP, LOCALES_NAMES_MAP, normalize_locale
 from app.lib.options_context import options_context
 from app.lib.render_response import render_response
+from app.lib.rich_text import resolve_rich_text_many
 from app.lib.translation import primary_translation_locale
 from app.limits import (
     DIARY_BODY_MAX_LENGTH,
@@ -92,8 +93,7 @@ async def get_diaries_data(
         async with TaskGroup() as tg:
             tg.create_task(DiaryQuery.resolve_location_name(diaries))
             tg.create_task(DiaryCommentQuery.resolve_num_comments(diaries))
-            for diary in diaries:
-                tg.create_task(diary.resolve_rich_text())
+            tg.create_task(resolve_rich_text_many(diaries))
             if with_navigation:
                 new_after_t = tg.create_task(new_after_task())
                 new_before_t = tg.create_task(new_before_task())
@@ -8,6 +8,7 @@ from starlette import status
 
 from app.lib.options_context import options_context
 from app.lib.render_response import render_response
+from app.lib.rich_text import resolve_rich_text_many
 from app.limits import DIARY_COMMENTS_PAGE_SIZE, DISPLAY_NAME_MAX_LENGTH
 from app.models.db.diary import Diary
 from app.models.db.diary_comment import DiaryComment
@@ -62,8 +63,7 @@ async def user_diary_comments(
     new_before_t = None
     if comments:
         async with TaskGroup() as tg:
-            for comment in comments:
-                tg.create_task(comment.resolve_rich_text())
+            tg.create_task(resolve_rich_text_many(comments))
             new_after_t = tg.create_task(new_after_task())
             new_before_t = tg.create_task(new_before_task())
     new_after = new_after_t.result() if (new_after_t is not None) else None
@@ -17,6 +17,7 @@ from app.limits import (
 from app.models.db.user import User
 from app.queries.connected_account_query import ConnectedAccountQuery
 from app.queries.oauth2_token_query import OAuth2TokenQuery
+from app.queries.user_query import UserQuery
 from app.services.auth_service import AuthService
 
 router = APIRouter()
@@ -27,6 +28,7 @@ async def settings(_: Annotated[User, web_user()]):
     return await render_response(
         'settings/index.jinja2',
         {
+            'user': await UserQuery.find_one_auth_user(required=True),
             'URLSAFE_BLACKLIST': URLSAFE_BLACKLIST,
             'INSTALLED_LOCALES_NAMES_MAP': INSTALLED_LOCALES_NAMES_MAP,
         },
@@ -38,6 +40,7 @@ async def settings_email(_: Annotated[User, web_user()]):
     return await render_response(
         'settings/email.jinja2',
         {
+            'user': await UserQuery.find_one_auth_user(required=True),
             'EMAIL_MIN_LENGTH': EMAIL_MIN_LENGTH,
             'EMAIL_MAX_LENGTH': EMAIL_MAX_LENGTH,
         },
@@ -2,7 +2,6 @@ from asyncio import TaskGroup
 from typing import Annotated
 
 from fastapi import APIRouter, Path, Query
-from polyline_rs import encode_lonlat
 from pydantic import PositiveInt
 from sqlalchemy.orm import joinedload
 from starlette import status
@@ -16,7 +15,6 @@ from app.models.db.trace_ import Trace
 from app.models.db.user import User
 from app.models.types import DisplayNameType
 from app.queries.trace_query import TraceQuery
-from app.queries.trace_segment_query import TraceSegmentQuery
 from app.queries.user_query import UserQuery
 
 router = APIRouter()
@@ -69,10 +67,9 @@ async def _get_traces_data(
 
     if traces:
         async with TaskGroup() as tg:
-            tg.create_task(TraceSegmentQuery.resolve_coords(traces, limit_per_trace=100, resolution=90))
             new_after_t = tg.create_task(new_after_task())
             new_before_t = tg.create_task(new_before_task())
-        traces_lines = ';'.join(encode_lonlat(trace.coords.tolist(), 0) for trace in traces)  # type: ignore
+        traces_lines = ';'.join(trace.preview_line or '' for trace in traces)
         new_after = new_after_t.result()
         new_before = new_before_t.result()
     else:
@@ -6,7 +6,6 @@ from typing import Annotated
 import numpy as np
 from email_validator.rfc_constants import EMAIL_MAX_LENGTH
 from fastapi import APIRouter, Cookie, Path, Query, Request
-from polyline_rs import encode_lonlat
 from pydantic import PositiveInt, SecretStr
 from sqlalchemy.orm import joinedload
 from starlette import status
@@ -39,7 +38,6 @@ from app.queries.diary_query import DiaryQuery
 from app.queries.note_comment_query import NoteCommentQuery
 from app.queries.note_query import NoteQuery
 from app.queries.trace_query import TraceQuery
-from app.queries.trace_segment_query import TraceSegmentQuery
 from app.queries.user_query import UserQuery
 from app.queries.user_token_query import UserTokenQuery
 from app.services.auth_provider_service import AuthProviderService
@@ -86,7 +84,7 @@ async def account_confirm_pending(user: Annotated[User, web_user()]):
 @router.get('/reset-password')
 async def reset_password(token: Annotated[SecretStr | None, Query(min_length=1)] = None):
     if token is None:
-        return await render_response('user/reset_password.jinja2')
+        return await render_response('user/reset_password.jinja2', {'user': await UserQuery.find_one_auth_user()})
     # TODO: check errors
     token_struct = UserTokenStructUtils.from_str(token)
     with options_context(
@@ -101,7 +99,7 @@ async def reset_password(token: Annotated[SecretStr | None, Query(min_length=1)]
             UserTokenResetPassword, token_struct, check_email_hash=False
         )
         if user_token is None:
-            return await render_response('user/reset_password.jinja2')
+            return await render_response('user/reset_password.jinja2', {'user': await UserQuery.find_one_auth_user()})
     return await render_response(
         'user/reset_password_token.jinja2',
         {
@@ -186,8 +184,7 @@ async def index(
 
     traces_count = await TraceQuery.count_by_user_id(user.id)
     traces = await TraceQuery.find_many_recent(user_id=user.id, limit=USER_RECENT_ACTIVITY_ENTRIES)
-    await TraceSegmentQuery.resolve_coords(traces, limit_per_trace=100, resolution=90)
-    traces_lines = ';'.join(encode_lonlat(trace.coords.tolist(), 0) for trace in traces)  # type: ignore
+    traces_lines = ';'.join(trace.preview_line or '' for trace in traces)
 
     diaries_count = await DiaryQuery.count_by_user_id(user.id)
     diary_comments_count = await DiaryCommentQuery.count_by_user_id(user.id)
@@ -1,4 +1,3 @@
-from asyncio import TaskGroup
 from collections.abc import Collection
 from typing import Annotated, Literal
 
@@ -11,6 +10,7 @@ from app.lib.auth_context import web_user
 from app.lib.geo_utils import parse_bbox
 from app.lib.options_context import options_context
 from app.lib.render_response import render_response
+from app.lib.rich_text import resolve_rich_text_many
 from app.limits import CHANGESET_COMMENT_BODY_MAX_LENGTH, CHANGESET_QUERY_WEB_LIMIT, DISPLAY_NAME_MAX_LENGTH
 from app.models.db.changeset import Changeset
 from app.models.db.changeset_comment import ChangesetComment
@@ -83,7 +83,5 @@ async def comments_page(
         )
     ):
         comments = await ChangesetCommentQuery.get_comments_page(changeset_id, page=page, num_items=num_items)
-    async with TaskGroup() as tg:
-        for comment in comments:
-            tg.create_task(comment.resolve_rich_text())
+    await resolve_rich_text_many(comments)
     return await render_response('changesets/comments_page.jinja2', {'comments': comments})
@@ -1,4 +1,3 @@
-from asyncio import TaskGroup
 from typing import Annotated
 
 from fastapi import APIRouter, Form, Query, Response
@@ -9,6 +8,7 @@ from sqlalchemy.orm import joinedload
 from app.lib.auth_context import web_user
 from app.lib.options_context import options_context
 from app.lib.render_response import render_response
+from app.lib.rich_text import resolve_rich_text_many
 from app.lib.standard_feedback import StandardFeedback
 from app.lib.translation import t
 from app.limits import (
@@ -85,9 +85,7 @@ async def comments_page(
         )
     ):
         comments = await DiaryCommentQuery.get_diary_page(diary_id, page=page, num_items=num_items)
-    async with TaskGroup() as tg:
-        for comment in comments:
-            tg.create_task(comment.resolve_rich_text())
+    await resolve_rich_text_many(comments)
     return await render_response('diaries/comments_page.jinja2', {'comments': comments})
 
 
@@ -1,16 +1,25 @@
 import logging
 from typing import Annotated, Literal
 
-from fastapi import APIRouter, Query, Response
-from pydantic import PositiveInt
+from fastapi import APIRouter, Path, Query, Response, status
+from pydantic import NonNegativeInt, PositiveInt
 
 from app.format import FormatLeaflet
 from app.lib.exceptions_context import raise_for
 from app.lib.geo_utils import parse_bbox
-from app.limits import MAP_QUERY_AREA_MAX_SIZE, MAP_QUERY_LEGACY_NODES_LIMIT
+from app.limits import (
+    MAP_QUERY_AREA_MAX_SIZE,
+    MAP_QUERY_LEGACY_NODES_LIMIT,
+    MAP_TILE_MVT_CACHE_MAX_AGE,
+    MAP_TILE_MVT_CACHE_STALE,
+    MAP_TILE_MVT_MAX_ZOOM,
+    MAP_TILE_MVT_MIN_ZOOM,
+    MAP_TILE_MVT_NODES_LIMIT,
+)
+from app.middlewares.cache_control_middleware import cache_control
 from app.models.proto.shared_pb2 import RenderElementsData
-from app.queries.element_member_query import ElementMemberQuery
 from app.queries.element_query import ElementQuery
+from app.services.element_tile_cache_service import ElementTileCacheService
 
 router = APIRouter(prefix='/api/web')
 
@@ -32,7 +41,7 @@ async def get_map(
         nodes_limit = limit + 1
         legacy_nodes_limit = False
 
-    elements = await ElementQuery.find_many_by_geom(
+    elements = await ElementTileCacheService.find_many_by_geom(
         geometry,
         partial_ways=True,
         include_relations=False,
@@ -46,8 +55,24 @@ async def get_map(
             media_type='application/x-protobuf',
         )
 
-    await ElementMemberQuery.resolve_members(elements)
     return Response(
         FormatLeaflet.encode_elements(elements, detailed=True, areas=False).SerializeToString(),
         media_type='application/x-protobuf',
     )
+
+
+@router.get('/map/tile/{z}/{x}/{y}')
+@cache_control(max_age=MAP_TILE_MVT_CACHE_MAX_AGE, stale=MAP_TILE_MVT_CACHE_STALE)
+async def get_map_tile(
+    z: Annotated[int, Path(ge=MAP_TILE_MVT_MIN_ZOOM, le=MAP_TILE_MVT_MAX_ZOOM)],
+    x: Annotated[NonNegativeInt, Path()],
+    y: Annotated[NonNegativeInt, Path()],
+):
+    """
+    Get the map elements within the web mercator tile, encoded as a Mapbox Vector Tile.
+    """
+    if x >= 1 << z or y >= 1 << z:
+        return Response(None, status.HTTP_404_NOT_FOUND)
+
+    tile = await ElementQuery.get_mvt_tile(z, x, y, nodes_limit=MAP_TILE_MVT_NODES_LIMIT)
+    return Response(tile, media_type='application/vnd.mapbox-vector-tile')
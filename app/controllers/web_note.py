@@ -11,6 +11,7 @@ from app.lib.exceptions_context import raise_for
 from app.lib.geo_utils import parse_bbox
 from app.lib.options_context import options_context
 from app.lib.render_response import render_response
+from app.lib.rich_text import resolve_rich_text_many
 from app.limits import (
     NOTE_QUERY_AREA_MAX_SIZE,
     NOTE_QUERY_DEFAULT_CLOSED,
@@ -89,9 +90,7 @@ async def comments_page(
         )
     ):
         comments = await NoteCommentQuery.get_comments_page(note_id, page=page, num_items=num_items)
-    async with TaskGroup() as tg:
-        for comment in comments:
-            tg.create_task(comment.resolve_rich_text())
+    await resolve_rich_text_many(comments)
     return await render_response('notes/comments_page.jinja2', {'comments': comments})
 
 
@@ -9,6 +9,8 @@ from app.lib.standard_feedback import StandardFeedback
 from app.models.db.trace_ import TraceVisibility
 from app.models.db.user import User
 from app.models.types import Str255
+from app.queries.trace_job_query import TraceJobQuery
+from app.queries.trace_query import TraceQuery
 from app.services.trace_service import TraceService
 
 router = APIRouter(prefix='/api/web/traces')
@@ -31,6 +33,17 @@ async def upload(
     return {'trace_id': trace.id}
 
 
+@router.get('/{trace_id:int}/status')
+async def get_status(trace_id: PositiveInt):
+    trace = await TraceQuery.get_one_by_id(trace_id)
+    job = await TraceJobQuery.find_one_by_trace_id(trace_id) if trace.status != 'imported' else None
+    return {
+        'status': trace.status,
+        'progress': job.progress if job is not None else 1,
+        'error': job.error if job is not None else None,
+    }
+
+
 @router.post('/{trace_id:int}/update')
 async def update(
     _: Annotated[User, web_user()],
@@ -16,6 +16,7 @@ from app.lib.user_token_struct_utils import UserTokenStructUtils
 from app.limits import COOKIE_AUTH_MAX_AGE, DISPLAY_NAME_MAX_LENGTH
 from app.models.db.user import User, UserStatus
 from app.models.types import DisplayNameType, EmailType, PasswordType, ValidatingDisplayNameType
+from app.queries.user_query import UserQuery
 from app.services.auth_provider_service import AuthProviderService
 from app.services.oauth2_token_service import OAuth2TokenService
 from app.services.user_service import UserService
@@ -116,6 +117,7 @@ async def account_confirm_resend(
     if user.status != UserStatus.pending_activation:
         return {'is_active': True}
     await UserTokenAccountConfirmService.send_email()
+    user = await UserQuery.find_one_auth_user(required=True)
     return StandardFeedback.success_result(
         None, t('confirmations.resend_success_flash.confirmation_sent', email=user.email)
     )
@@ -1,21 +1,55 @@
 import logging
-from collections.abc import Collection, Iterable, Sequence
+from collections.abc import Collection, Iterable, Iterator, Sequence
+from io import BytesIO
 from typing import Any
 
 import cython
+import lxml.etree as tree
 import numpy as np
+import orjson
 from shapely import Point, lib
+from sizestr import sizestr
 
 from app.lib.date_utils import legacy_date
 from app.lib.exceptions_context import raise_for
 from app.lib.format_style_context import format_is_json
-from app.limits import GEO_COORDINATE_PRECISION
+from app.limits import (
+    ELEMENT_RELATION_MEMBERS_LIMIT,
+    ELEMENT_TAGS_LIMIT,
+    ELEMENT_WAY_MEMBERS_LIMIT,
+    GEO_COORDINATE_PRECISION,
+    XML_PARSE_MAX_SIZE,
+)
 from app.models.db.element import Element
 from app.models.db.element_member import ElementMember
 from app.models.element import ElementType
 from app.models.validating.element import ElementValidating
 from app.services.optimistic_diff.prepare import OSMChangeAction
 
+_ITERPARSE_OPTIONS = {
+    'recover': True,
+    'remove_blank_text': True,
+    'remove_comments': True,
+    'remove_pis': True,
+    'collect_ids': False,
+    'resolve_entities': False,
+}
+
+# number of elements encoded per streamed chunk
+_STREAM_CHUNK_SIZE = 1000
+
+_XML_ATTR_ESCAPE = str.maketrans(
+    {
+        '&': '&amp;',
+        '<': '&lt;',
+        '>': '&gt;',
+        '"': '&quot;',
+        '\t': '&#9;',
+        '\n': '&#10;',
+        '\r': '&#13;',
+    }
+)
+
 
 class Element06Mixin:
     @staticmethod
@@ -47,6 +81,23 @@ class Element06Mixin:
                 result[element.type].append(_encode_element(element, is_json=False))
             return result  # pyright: ignore[reportReturnType]
 
+    @staticmethod
+    def encode_elements_stream(elements: Sequence[Element]) -> Iterator[bytes]:
+        """
+        Encode elements directly into serialized chunks, skipping the intermediate dict tree.
+
+        In JSON format, the chunks form the contents of the elements array.
+        In XML format, the chunks are the element tags, grouped by type.
+
+        >>> b''.join(encode_elements_stream([Element(type='node', id=1, version=1, ...)]))
+        b'<node id="1" version="1" ...'
+        """
+        # the format must be resolved eagerly, the stream may be consumed outside the request context
+        if format_is_json():
+            return _encode_elements_stream_json(elements)
+        else:
+            return _encode_elements_stream_xml(elements)
+
     @staticmethod
     def decode_element(element: tuple[ElementType, dict]) -> Element:
         """
@@ -86,73 +137,64 @@ class Element06Mixin:
         return result
 
     @staticmethod
-    def decode_osmchange(
-        changes: Iterable[tuple[OSMChangeAction, Iterable[tuple[ElementType, dict]]]],
-        *,
-        changeset_id: int | None,
-    ) -> list[Element]:
+    def decode_osmchange(xml_bytes: bytes, *, changeset_id: int | None) -> list[Element]:
         """
+        Decode osmChange XML directly into elements, streaming over the input.
+
+        The intermediate dict tree is never built and each element is validated
+        as soon as it is parsed, so invalid or oversized uploads fail early.
+
         If changeset_id is None, it will be extracted from the element data.
 
-        >>> decode_osmchange([
-        ...     ('create', [('node', {'@id': 1, '@version': 1, ...})]),
-        ...     ('modify', [('way', {'@id': 2, '@version': 2, ...})])
-        ... ])
-        [Element(type=ElementType, ...), Element(type=ElementType.way, ...)]
+        >>> decode_osmchange(b'<osmChange><create><node id="-1" lat="0" lon="0"/></create></osmChange>')
+        [Element(type='node', ...)]
         """
-        # skip attributes-only osmChange (empty)
-        if isinstance(changes, dict):
-            logging.debug('Skipped empty osmChange')
-            return []
+        if len(xml_bytes) > XML_PARSE_MAX_SIZE:
+            raise_for.input_too_big(len(xml_bytes))
+        logging.debug('Parsing %s osmChange XML string', sizestr(len(xml_bytes)))
 
         result: list[Element] = []
-        for action, elements_data in changes:
-            # skip osmChange attributes
-            if action.startswith('@'):
+        action: OSMChangeAction = 'create'
+        delete_if_unused: cython.char = False
+        depth: cython.int = 0
+
+        for event, data in tree.iterparse(BytesIO(xml_bytes), events=('start', 'end'), **_ITERPARSE_OPTIONS):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    if _strip_namespace(data.tag) != 'osmChange':
+                        raise ValueError("XML doesn't contain an osmChange element.")
+                elif depth == 2:
+                    action = _strip_namespace(data.tag)  # pyright: ignore[reportAssignmentType]
+                    if action not in {'create', 'modify', 'delete'}:
+                        raise_for.diff_unsupported_action(action)
+                    delete_if_unused = action == 'delete' and data.get('if-unused') is not None
                 continue
-            # skip attributes-only actions
-            if isinstance(elements_data, dict):
+
+            depth -= 1
+            if depth == 0:
+                # don't allow empty osmChange, same as the other XML bodies
+                if not len(data) and not data.attrib:
+                    raise ValueError("XML doesn't contain an osmChange element.")
+                continue
+            if depth != 2:
                 continue
 
+            element = _decode_element_xml(data, action=action, changeset_id=changeset_id)
             if action == 'create':
-                for key, data in elements_data:
-                    data['@version'] = 0
-                    element = _decode_element(key, data, changeset_id=changeset_id)
-
-                    if element.id > 0:
-                        raise_for.diff_create_bad_id(element)
-
-                    result.append(element)
-
-            elif action == 'modify':
-                for key, data in elements_data:
-                    element = _decode_element(key, data, changeset_id=changeset_id)
-
-                    if element.version <= 1:
-                        raise_for.diff_update_bad_version(element)
-
-                    result.append(element)
-
-            elif action == 'delete':
-                delete_if_unused: cython.char = False
-
-                for key, data in elements_data:
-                    if key == '@if-unused':  # pyright: ignore[reportUnnecessaryComparison]
-                        delete_if_unused = True
-                        continue
-
-                    data['@visible'] = False
-                    element = _decode_element(key, data, changeset_id=changeset_id)
-
-                    if element.version <= 1:
-                        raise_for.diff_update_bad_version(element)
-                    if delete_if_unused:
-                        element.delete_if_unused = True
-
-                    result.append(element)
-
+                if element.id > 0:
+                    raise_for.diff_create_bad_id(element)
             else:
-                raise_for.diff_unsupported_action(action)
+                if element.version <= 1:
+                    raise_for.diff_update_bad_version(element)
+                if delete_if_unused:
+                    element.delete_if_unused = True
+            result.append(element)
+
+            # free memory of the processed elements
+            data.clear()
+            while data.getprevious() is not None:
+                del data.getparent()[0]  # pyright: ignore[reportOptionalSubscript]
 
         return result
 
@@ -347,6 +389,146 @@ def _decode_element(type: ElementType, data: dict, *, changeset_id: int | None):
     )
 
 
+def _encode_elements_stream_json(elements: Sequence[Element]) -> Iterator[bytes]:
+    i: cython.Py_ssize_t
+    for i in range(0, len(elements), _STREAM_CHUNK_SIZE):
+        chunk = [_encode_element(element, is_json=True) for element in elements[i : i + _STREAM_CHUNK_SIZE]]
+        encoded = orjson.dumps(chunk, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z)[1:-1]
+        yield (b',' + encoded) if i else encoded
+
+
+def _encode_elements_stream_xml(elements: Sequence[Element]) -> Iterator[bytes]:
+    # merge elements of the same type together
+    for type in ('node', 'way', 'relation'):
+        typed = [element for element in elements if element.type == type]
+        i: cython.Py_ssize_t
+        for i in range(0, len(typed), _STREAM_CHUNK_SIZE):
+            yield _encode_elements_chunk_xml(typed[i : i + _STREAM_CHUNK_SIZE]).encode()
+
+
+@cython.cfunc
+def _encode_elements_chunk_xml(elements: list[Element]) -> str:
+    """
+    >>> _encode_elements_chunk_xml([Element(type='node', id=1, version=1, ...)])
+    '<node id="1" version="1" ...'
+    """
+    # resolve all node coordinates at once
+    points = [element.point for element in elements if element.point is not None]
+    coords: list[list[float]] = (
+        lib.get_coordinates(np.asarray(points, np.object_), False, False).tolist() if points else []
+    )
+    coords_iter = iter(coords)
+
+    escape = _XML_ATTR_ESCAPE  # read property once for performance
+    parts: list[str] = []
+    append = parts.append
+    for element in elements:
+        element_type = element.type
+        append(f'<{element_type} id="{element.id}" version="{element.version}"')
+        if (user_display_name := element.user_display_name) is not None:
+            append(f' uid="{element.user_id}" user="{user_display_name.translate(escape)}"')
+        timestamp = legacy_date(element.created_at).replace(tzinfo=None).isoformat()
+        append(
+            f' changeset="{element.changeset_id}" timestamp="{timestamp}Z"'
+            f' visible="{"true" if element.visible else "false"}"'
+        )
+        if element.point is not None:
+            x, y = next(coords_iter)
+            append(f' lon="{x}" lat="{y}"')
+
+        tags = element.tags
+        members = element.members
+        if not tags and not members:
+            append('/>')
+            continue
+
+        append('>')
+        for k, v in tags.items():
+            append(f'<tag k="{k.translate(escape)}" v="{v.translate(escape)}"/>')
+        if members:
+            if element_type == 'way':
+                for member in members:
+                    append(f'<nd ref="{member.id}"/>')
+            elif element_type == 'relation':
+                for member in members:
+                    append(f'<member type="{member.type}" ref="{member.id}" role="{member.role.translate(escape)}"/>')
+        append(f'</{element_type}>')
+
+    return ''.join(parts)
+
+
+@cython.cfunc
+def _decode_element_xml(data: tree._Element, *, action: OSMChangeAction, changeset_id: int | None):
+    """
+    Decode an osmChange element, enforcing the element limits while reading its children.
+
+    >>> _decode_element_xml(<node id="-1" lat="0" lon="0"/>, action='create', changeset_id=1)
+    Element(type='node', ...)
+    """
+    type = _strip_namespace(data.tag)
+    if type not in {'node', 'way', 'relation'}:
+        raise ValueError(f'Unsupported element type {type!r}')
+
+    tags: dict[str, str] = {}
+    members: list[ElementMember] = []
+    members_limit: cython.int = ELEMENT_WAY_MEMBERS_LIMIT if type == 'way' else ELEMENT_RELATION_MEMBERS_LIMIT
+    for child in data:
+        child_tag = _strip_namespace(child.tag)
+        if child_tag == 'tag':
+            key = child.get('k')
+            value = child.get('v')
+            if key is None or value is None:
+                raise ValueError('Tag must have k and v attributes')
+            if key in tags:
+                raise ValueError('Duplicate tag keys')
+            tags[key] = value
+            if len(tags) > ELEMENT_TAGS_LIMIT:
+                raise ValueError(f'Element cannot have more than {ELEMENT_TAGS_LIMIT} tags')
+
+        elif (child_tag == 'nd' and type == 'way') or (child_tag == 'member' and type == 'relation'):
+            if len(members) >= members_limit:
+                raise ValueError(f'{type.capitalize()} cannot have more than {members_limit} members')
+            members.append(
+                ElementMember(
+                    order=len(members),
+                    type=child.get('type', 'node') if child_tag == 'member' else 'node',  # pyright: ignore[reportArgumentType]
+                    id=int(child.get('ref')),  # pyright: ignore[reportArgumentType]
+                    role=child.get('role', ''),
+                )
+            )
+
+    if (lon := data.get('lon')) is not None and (lat := data.get('lat')) is not None:
+        # numpy automatically parses strings
+        point = lib.points(np.array((lon, lat), np.float64).round(GEO_COORDINATE_PRECISION))
+    else:
+        point = None
+
+    if action == 'create':
+        version = 1
+        visible = True
+    else:
+        version = int(v) + 1 if (v := data.get('version')) is not None else 1
+        visible = action == 'modify' and data.get('visible', 'true') == 'true'
+
+    return Element(
+        **ElementValidating(
+            changeset_id=changeset_id if (changeset_id is not None) else data.get('changeset'),
+            type=type,
+            id=data.get('id'),  # pyright: ignore[reportArgumentType]
+            version=version,
+            visible=visible,
+            tags=tags,
+            point=point,
+            members=members,
+        ).__dict__
+    )
+
+
+@cython.cfunc
+def _strip_namespace(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1] if tag[0] == '{' else tag
+
+
 @cython.cfunc
 def _encode_point_json(point: Point | None) -> dict[str, float]:
     """
@@ -47,17 +47,20 @@ def _encode_gpx_file(trace: Trace) -> dict:
     >>> _encode_gpx_file(Trace(...))
     {'@id': 1, '@uid': 1234, ...}
     """
-    x, y = trace.coords[0].tolist()
-    return {
+    result = {
         '@id': trace.id,
         '@uid': trace.user_id,
         '@user': trace.user.display_name,
         '@timestamp': trace.created_at,
         '@name': trace.name,
-        '@lon': x,
-        '@lat': y,
-        '@visibility': trace.visibility,
-        '@pending': False,
-        'description': trace.description,
-        'tag': trace.tags,
     }
+    # pending and failed traces have no points
+    if len(trace.coords):
+        x, y = trace.coords[0].tolist()
+        result['@lon'] = x
+        result['@lat'] = y
+    result['@visibility'] = trace.visibility
+    result['@pending'] = trace.status == 'pending'
+    result['description'] = trace.description
+    result['tag'] = trace.tags
+    return result
@@ -1,9 +1,13 @@
-from collections.abc import Iterable, Sequence, Sized
-from datetime import datetime
-from itertools import zip_longest
+from collections.abc import Iterable, Iterator, Sequence
+from datetime import UTC, datetime, timedelta
+from itertools import chain, repeat, zip_longest
+from math import nan
+from typing import IO
 
 import cython
 import numpy as np
+from lxml.etree import iterparse
+from numpy.typing import NDArray
 from shapely import Point, lib, multipoints
 
 from app.limits import (
@@ -18,6 +22,14 @@ from app.validators.geometry import validate_geometry
 
 _default = object()
 
+# number of track points encoded in bulk per streamed chunk
+_ENCODE_STREAM_CHUNK_SIZE = 5000
+
+_XML_TEXT_ESCAPE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '\r': '&#13;'})
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+_MICROSECOND = timedelta(microseconds=1)
+
 
 class FormatGPX:
     @staticmethod
@@ -99,123 +111,342 @@ class FormatGPX:
         return {'trk': trks}
 
     @staticmethod
-    def decode_tracks(tracks: Iterable[dict], *, track_num_start: cython.int = 0) -> list[TraceSegment]:
+    def encode_track_stream(
+        segments_groups: Iterable[Iterable[TraceSegment]],
+        trace_: Trace | None = _default,  # pyright: ignore[reportArgumentType]
+    ) -> Iterator[bytes]:
+        """
+        Encode the track segments directly into serialized GPX chunks, skipping the intermediate dict tree.
+
+        The track points are formatted in bulk, the output is equivalent to encode_track.
+        """
+        trace_is_default: cython.char = trace_ is _default
+
+        prefixes: list[str] = []
+        segments: list[TraceSegment] = []
+        num_points: cython.Py_ssize_t = 0
+        in_trk: cython.char = False
+        in_trkseg: cython.char = False
+        last_trace_id: cython.int = -1
+        last_track_num: cython.int = -1
+
+        for segment in (s for ss in segments_groups for s in ss):
+            trace = segment.trace if trace_is_default else trace_
+            prefix = ''
+
+            # if trace is available via api, encode full information
+            if (trace is not None) and trace.timestamps_via_api:
+                trace_id: cython.int = segment.trace_id
+                track_num: cython.int = segment.track_num
+
+                # handle trace change
+                if last_trace_id != trace_id:
+                    if in_trkseg:
+                        prefix += '</trkseg>'
+                    if in_trk:
+                        prefix += '</trk>'
+                    prefix += (
+                        f'<trk><name>{trace.name.translate(_XML_TEXT_ESCAPE)}</name>'
+                        f'<desc>{trace.description.translate(_XML_TEXT_ESCAPE)}</desc>'
+                        f'<url>/trace/{trace_id}</url>'
+                    )
+                    in_trk = True
+                    in_trkseg = False
+                    last_trace_id = trace_id
+                    last_track_num = -1
+
+                # handle track change
+                if last_track_num != track_num:
+                    if in_trkseg:
+                        prefix += '</trkseg>'
+                    prefix += '<trkseg>'
+                    in_trkseg = True
+                    last_track_num = track_num
+
+            # otherwise, encode only coordinates
+            # handle track and track segment change
+            elif (last_trace_id > -1 or not in_trk) or (last_track_num > -1 or not in_trkseg):
+                if in_trkseg:
+                    prefix += '</trkseg>'
+                if in_trk:
+                    prefix += '</trk>'
+                prefix += '<trk><trkseg>'
+                in_trk = True
+                in_trkseg = True
+                last_trace_id = -1
+                last_track_num = -1
+
+            prefixes.append(prefix)
+            segments.append(segment)
+            num_points += len(segment.points.geoms)
+            if num_points >= _ENCODE_STREAM_CHUNK_SIZE:
+                yield _encode_segments_chunk(prefixes, segments).encode()
+                prefixes.clear()
+                segments.clear()
+                num_points = 0
+
+        suffix = ''
+        if in_trkseg:
+            suffix += '</trkseg>'
+        if in_trk:
+            suffix += '</trk>'
+        if segments or suffix:
+            yield (_encode_segments_chunk(prefixes, segments) + suffix).encode()
+
+    @staticmethod
+    def decode_tracks(file: IO[bytes], *, track_num_start: cython.int = 0) -> Iterator[TraceSegment]:
         """
-        >>> decode_tracks([{'trkseg': [{'trkpt': [{'@lon': 1, '@lat': 2}]}]}])
+        Decode the track segments from the GPX file.
+
+        The file is parsed incrementally, the memory usage does not depend on the file size.
+
+        >>> list(decode_tracks(BytesIO(b'<gpx><trk><trkseg><trkpt lon="1" lat="2"/></trkseg></trk></gpx>')))
         [TraceSegment(...)]
         """
-        segment_max_area: cython.double = TRACE_SEGMENT_MAX_AREA
-        segment_max_area_length: cython.double = TRACE_SEGMENT_MAX_AREA_LENGTH
-        segment_max_size: cython.int = TRACE_SEGMENT_MAX_SIZE
-        result: list[TraceSegment] = []
-
-        track_num: cython.int
-        segment_num: cython.int
-        current_minx: cython.double
-        current_miny: cython.double
-        current_maxx: cython.double
-        current_maxy: cython.double
-        points: list[tuple[float, float]] = []
-        capture_times: list[datetime | None] = []
-        elevations: list[float | None] = []
-
-        trk: dict
-        trkseg: dict
-        trkpt: dict
-
-        for trk in tracks:
-            track_num = track_num_start
-            for track_num, trkseg in enumerate(trk.get('trkseg', ()), track_num_start):
-                segment_num = 0
-                current_minx = 180
-                current_miny = 90
-                current_maxx = -180
-                current_maxy = -90
-
-                for trkpt in trkseg.get('trkpt', ()):
-                    lon: float | None = trkpt.get('@lon')
-                    lat: float | None = trkpt.get('@lat')
-                    if lon is None or lat is None:
-                        continue
-
-                    lon_c: cython.double = lon
-                    lat_c: cython.double = lat
-                    time_str: str | None = trkpt.get('time')
-                    time = datetime.fromisoformat(time_str) if time_str is not None else None
-                    elevation_str: str | None = trkpt.get('ele')
-                    elevation = float(elevation_str) if elevation_str is not None else None
-
-                    current_minx = min(current_minx, lon_c)
-                    current_miny = min(current_miny, lat_c)
-                    current_maxx = max(current_maxx, lon_c)
-                    current_maxy = max(current_maxy, lat_c)
-
-                    if _should_finish_segment(
-                        segment_max_area=segment_max_area,
-                        segment_max_area_length=segment_max_area_length,
-                        segment_max_size=segment_max_size,
-                        minx=current_minx,
-                        miny=current_miny,
-                        maxx=current_maxx,
-                        maxy=current_maxy,
-                        points=points,
-                    ):
-                        _finish_segment(
-                            result=result,
-                            points=points,
-                            capture_times=capture_times,
-                            elevations=elevations,
-                            track_num=track_num,
-                            segment_num=segment_num,
-                        )
-                        current_minx = lon_c
-                        current_miny = lat_c
-                        current_maxx = lon_c
-                        current_maxy = lat_c
-                        segment_num += 1
-
-                    points.append((lon, lat))
-                    capture_times.append(time)
-                    elevations.append(elevation)
-
-                _finish_segment(
-                    result=result,
-                    track_num=track_num,
-                    segment_num=segment_num,
-                    points=points,
-                    capture_times=capture_times,
-                    elevations=elevations,
-                )
-
-            track_num_start = track_num + 1
-
-        return result
+        builder = _SegmentsBuilder(track_num_start)
+        result = builder.result
+
+        for _, element in iterparse(file, tag=_DECODE_TAGS, **_DECODE_PARSER_OPTIONS):
+            tag: str = element.tag
+            name = tag[tag.rfind('}') + 1 :]
+
+            if name == 'trkpt':
+                lon = element.get('lon')
+                lat = element.get('lat')
+                if lon is not None and lat is not None:
+                    time: datetime | None = None
+                    elevation: cython.double = nan
+                    for child in element:
+                        child_tag = child.tag
+                        if not isinstance(child_tag, str):
+                            continue
+                        child_name = child_tag[child_tag.rfind('}') + 1 :]
+                        text: str | None = child.text
+                        if text is None or not (text := text.strip()):
+                            continue
+                        if child_name == 'time':
+                            time = datetime.fromisoformat(text)
+                            # assume UTC when the timezone is missing
+                            if time.tzinfo is None:
+                                time = time.replace(tzinfo=UTC)
+                        elif child_name == 'ele':
+                            elevation = float(text)
+
+                    builder.append(float(lon), float(lat), time, elevation)
+
+            elif name == 'trkseg':
+                builder.finish_segment()
+            elif name == 'trk':
+                builder.finish_track()
+
+            # free the processed elements
+            element.clear(keep_tail=False)
+            while element.getprevious() is not None:
+                del element.getparent()[0]  # pyright: ignore[reportOptionalSubscript]
+
+            if result:
+                yield from result
+                result.clear()
 
 
 @cython.cfunc
-def _should_finish_segment(
-    *,
-    segment_max_area: cython.double,
-    segment_max_area_length: cython.double,
-    segment_max_size: cython.int,
-    minx: cython.double,
-    miny: cython.double,
-    maxx: cython.double,
-    maxy: cython.double,
-    points: Sized,
-) -> cython.char:
+def _encode_segments_chunk(prefixes: list[str], segments: list[TraceSegment]) -> str:
     """
-    Check if the segment should be finished before adding the point.
+    Encode the segments track points in bulk, each preceded by its structure prefix.
     """
-    width: cython.double = maxx - minx
-    height: cython.double = maxy - miny
-    return (
-        width * height > segment_max_area  # check area
-        or width > segment_max_area_length  # check width
-        or height > segment_max_area_length  # check height
-        or len(points) + 1 >= segment_max_size  # check length
+    if not segments:
+        return ''
+
+    geoms = np.asarray([segment.points for segment in segments], dtype=np.object_)
+    sizes: list[int] = lib.get_num_geometries(geoms).tolist()
+    coords: list[list[float]] = lib.get_coordinates(geoms, False, False).tolist()  # type: ignore
+    num_points: cython.Py_ssize_t = len(coords)
+
+    times: list[str | None] = _format_capture_times(
+        chain.from_iterable(
+            (capture_times if (capture_times := segment.capture_times) is not None else repeat(None, size))
+            for segment, size in zip(segments, sizes, strict=True)
+        ),
+        num_points,
+    )
+    elevations: list[float | None] = list(
+        chain.from_iterable(
+            (elevations if (elevations := segment.elevations) is not None else repeat(None, size))
+            for segment, size in zip(segments, sizes, strict=True)
+        )
     )
 
+    parts: list[str] = []
+    start: cython.Py_ssize_t = 0
+    for prefix, size in zip(prefixes, sizes, strict=True):
+        parts.append(prefix)
+        end: cython.Py_ssize_t = start + size
+        for (lon, lat), time, elevation in zip(coords[start:end], times[start:end], elevations[start:end], strict=True):
+            if time is None and elevation is None:
+                parts.append(f'<trkpt lon="{lon}" lat="{lat}"/>')
+                continue
+            part = f'<trkpt lon="{lon}" lat="{lat}">'
+            if time is not None:
+                part += f'<time>{time}</time>'
+            if elevation is not None:
+                part += f'<ele>{elevation}</ele>'
+            parts.append(part + '</trkpt>')
+        start = end
+
+    return ''.join(parts)
+
+
+@cython.cfunc
+def _format_capture_times(capture_times: Iterable[datetime | None], num_points: cython.Py_ssize_t) -> list[str | None]:
+    """
+    Format the capture times in bulk, matching the XMLToDict datetime format.
+    """
+    capture_times = list(capture_times)
+    mask = np.fromiter((t is not None for t in capture_times), np.bool_, num_points)
+    if not mask.any():
+        return capture_times  # pyright: ignore[reportReturnType]
+
+    values = np.fromiter(((t - _EPOCH) // _MICROSECOND for t in capture_times if t is not None), np.int64)
+    datetimes = values.view('datetime64[us]')
+    # fractional seconds are only included when present
+    whole_seconds = values % 1_000_000 == 0
+    if whole_seconds.all():
+        formatted = np.datetime_as_string(datetimes, unit='s', timezone='UTC')
+    else:
+        formatted = np.where(
+            whole_seconds,
+            np.datetime_as_string(datetimes, unit='s', timezone='UTC'),
+            np.datetime_as_string(datetimes, unit='us', timezone='UTC'),
+        )
+
+    if mask.all():
+        return formatted.tolist()
+    result = np.full(num_points, None, np.object_)
+    result[mask] = formatted
+    return result.tolist()
+
+
+# elements are cleared after processing, waypoints and route points only to limit the memory usage
+_DECODE_TAGS = ('{*}trk', '{*}trkseg', '{*}trkpt', '{*}wpt', '{*}rtept')
+_DECODE_PARSER_OPTIONS = {
+    'events': ('end',),
+    'recover': True,
+    'remove_blank_text': True,
+    'remove_comments': True,
+    'remove_pis': True,
+    'collect_ids': False,
+    'resolve_entities': False,
+}
+
+# number of points buffered before cutting them into segments
+_DECODE_BUFFER_SIZE = 4096
+
+
+class _SegmentsBuilder:
+    """
+    Buffer the track points and cut them into segments.
+    """
+
+    __slots__ = (
+        '_capture_times',
+        '_coords',
+        '_elevations',
+        '_segment_num',
+        '_size',
+        '_track_num',
+        '_track_segments',
+        'result',
+    )
+
+    def __init__(self, track_num_start: int):
+        self._coords = np.empty((_DECODE_BUFFER_SIZE, 2), np.float64)
+        self._elevations = np.empty(_DECODE_BUFFER_SIZE, np.float64)
+        self._capture_times: list[datetime | None] = []
+        self._size: int = 0
+        self._track_num: int = track_num_start
+        self._segment_num: int = 0
+        self._track_segments: int = 0
+        self.result: list[TraceSegment] = []
+
+    def append(self, lon: float, lat: float, time: datetime | None, elevation: float) -> None:
+        """
+        Append a point to the current track segment. Missing elevation is represented by NaN.
+        """
+        size: cython.Py_ssize_t = self._size
+        self._coords[size] = (lon, lat)
+        self._elevations[size] = elevation
+        self._capture_times.append(time)
+        size += 1
+        self._size = size
+        if size == _DECODE_BUFFER_SIZE:
+            self._cut(final=False)
+
+    def finish_segment(self) -> None:
+        """
+        Finish the current track segment.
+        """
+        self._cut(final=True)
+        self._track_num += 1
+        self._segment_num = 0
+        self._track_segments += 1
+
+    def finish_track(self) -> None:
+        """
+        Finish the current track. Tracks without segments still consume a track number.
+        """
+        if not self._track_segments:
+            self._track_num += 1
+        self._track_segments = 0
+
+    def _cut(self, *, final: cython.char) -> None:
+        """
+        Cut the buffered points into segments. Unless final, the last unfinished segment remains buffered.
+        """
+        segment_max_area: cython.double = TRACE_SEGMENT_MAX_AREA
+        segment_max_area_length: cython.double = TRACE_SEGMENT_MAX_AREA_LENGTH
+        window_size: cython.Py_ssize_t = TRACE_SEGMENT_MAX_SIZE - 1
+        size: cython.Py_ssize_t = self._size
+        coords = self._coords
+        start: cython.Py_ssize_t = 0
+        end: cython.Py_ssize_t
+
+        while start < size:
+            # bounds of the segment after adding each successive point
+            window = coords[start : min(start + window_size, size)]
+            bounds_size = np.maximum.accumulate(window) - np.minimum.accumulate(window)
+            width = bounds_size[:, 0]
+            height = bounds_size[:, 1]
+            split_indices = np.flatnonzero(
+                (width * height > segment_max_area)  # check area
+                | (width > segment_max_area_length)  # check width
+                | (height > segment_max_area_length)  # check height
+            )
+            if split_indices.size:
+                end = start + int(split_indices[0])
+            else:
+                end = start + len(window)
+                if end == size and not final:
+                    break
+
+            _finish_segment(
+                result=self.result,
+                track_num=self._track_num,
+                segment_num=self._segment_num,
+                points=coords[start:end],
+                capture_times=self._capture_times[start:end],
+                elevations=self._elevations[start:end],
+            )
+            self._segment_num += 1
+            start = end
+
+        # move the remaining points to the buffer start
+        remaining: cython.Py_ssize_t = size - start
+        if remaining:
+            coords[:remaining] = coords[start:size]
+            self._elevations[:remaining] = self._elevations[start:size]
+        del self._capture_times[:start]
+        self._size = remaining
+
 
 @cython.cfunc
 def _finish_segment(
@@ -223,20 +454,24 @@ def _finish_segment(
     result: list[TraceSegment],
     track_num: cython.int,
     segment_num: cython.int,
-    points: list[tuple[float, float]],
+    points: NDArray[np.float64],
     capture_times: list[datetime | None],
-    elevations: list[float | None],
+    elevations: NDArray[np.float64],
 ):
     """
     Finish the segment and add it to the result.
     """
-    if not points:
-        return
-
-    points_: Sequence[Point] = lib.points(np.array(points, np.float64).round(GEO_COORDINATE_PRECISION))
+    points_: Sequence[Point] = lib.points(points.round(GEO_COORDINATE_PRECISION))
     multipoint = validate_geometry(multipoints(points_))
-    capture_times_ = capture_times.copy() if any(v is not None for v in capture_times) else None
-    elevations_ = elevations.copy() if any(v is not None for v in elevations) else None
+    capture_times_ = capture_times if any(v is not None for v in capture_times) else None
+    elevations_mask = np.isnan(elevations)
+    elevations_: list[float | None] | None
+    if elevations_mask.all():
+        elevations_ = None
+    elif not elevations_mask.any():
+        elevations_ = elevations.tolist()
+    else:
+        elevations_ = np.where(elevations_mask, None, elevations).tolist()
     result.append(
         TraceSegment(
             track_num=track_num,
@@ -246,7 +481,3 @@ def _finish_segment(
             elevations=elevations_,
         )
     )
-
-    points.clear()
-    capture_times.clear()
-    elevations.clear()
@@ -1,30 +1,74 @@
+import asyncio
+import fcntl
 import logging
+import os
+import sqlite3
 import time
-from asyncio import get_running_loop
+from asyncio import TaskGroup, get_running_loop
+from collections.abc import AsyncIterable
+from contextlib import asynccontextmanager
 from datetime import timedelta
-from functools import lru_cache
+from functools import cache, lru_cache
+from io import BytesIO
+from math import inf
 from pathlib import Path
-from typing import NamedTuple
+from threading import Lock
+from typing import IO
 
+import cython
 from google.protobuf.message import DecodeError
 from sizestr import sizestr
 
 from app.config import FILE_CACHE_DIR, FILE_CACHE_SIZE_GB
 from app.lib.buffered_random import buffered_randbytes
 from app.lib.crypto import hash_hex
+from app.lib.retry import retry
+from app.limits import FILE_CACHE_CLEANUP_BATCH_SIZE, FILE_CACHE_CLEANUP_INTERVAL
 from app.models.proto.server_pb2 import FileCacheMeta
 
+# entries are identified by their file path components, expires_at is inf for entries without ttl
+_INDEX_SCHEMA = """
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS entry (
+    context TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (context, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entry_expires_at_idx ON entry (expires_at);
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    total_size INTEGER NOT NULL,
+    scanned INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO stats VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS entry_insert AFTER INSERT ON entry BEGIN
+    UPDATE stats SET total_size = total_size + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entry_update AFTER UPDATE OF size ON entry BEGIN
+    UPDATE stats SET total_size = total_size - old.size + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entry_delete AFTER DELETE ON entry BEGIN
+    UPDATE stats SET total_size = total_size - old.size;
+END;
+"""
 
-class _CleanupInfo(NamedTuple):
-    expires_at: int | float
-    size: int
-    path: Path
+# FileCacheMeta field tags, entries are written with the data last to allow reading it in place
+_EXPIRES_AT_TAG = 0x10
+_DATA_TAG = 0x0A
+_ENTRY_HEADER_MAX_SIZE = 32
+
+_INDEX_FILE_NAME = '.index.sqlite3'
+_LOCK_FILE_NAME = '.cleanup.lock'
 
 
 class FileCache:
-    __slots__ = ('_base_dir',)
+    __slots__ = ('_base_dir', '_cache_dir', '_context')
 
     def __init__(self, context: str, *, cache_dir: Path = FILE_CACHE_DIR):
+        self._cache_dir = cache_dir
+        self._context = context
         self._base_dir: Path = cache_dir.joinpath(context)
 
     async def get(self, key: str) -> bytes | None:
@@ -46,86 +90,335 @@ class FileCache:
         # if provided, check time-to-live
         if entry.HasField('expires_at') and entry.expires_at < time.time():
             logging.debug('Cache miss for %r', key)
-            path.unlink(missing_ok=True)
+            await loop.run_in_executor(None, self._delete_path, path)
             return None
 
         logging.debug('Cache hit for %r', key)
         return entry.data
 
+    async def open(self, key: str) -> IO[bytes] | None:
+        """
+        Open a value from the file cache by key string for reading, positioned at the start of the data.
+
+        Returns None if the cache is not found. The caller is responsible for closing the file.
+        """
+        path = _get_path(self._base_dir, key)
+
+        try:
+            loop = get_running_loop()
+            file, expires_at = await loop.run_in_executor(None, _open_entry, path)
+        except (OSError, DecodeError):
+            logging.debug('Cache read error for %r', key)
+            return None
+
+        # if provided, check time-to-live
+        if expires_at is not None and expires_at < time.time():
+            logging.debug('Cache miss for %r', key)
+            file.close()
+            await loop.run_in_executor(None, self._delete_path, path)
+            return None
+
+        logging.debug('Cache hit for %r', key)
+        return file
+
     async def set(self, key: str, data: bytes, *, ttl: timedelta | None) -> None:
         """
         Set a value in the file cache by key string.
         """
+        await self.set_stream(key, _iter_one(data), len(data), ttl=ttl)
+
+    async def set_stream(self, key: str, chunks: AsyncIterable[bytes], size: int, *, ttl: timedelta | None) -> None:
+        """
+        Set a value in the file cache by key string, writing the data chunks as they arrive.
+
+        The chunks must add up to the given size.
+        """
         path = _get_path(self._base_dir, key)
         path.parent.mkdir(parents=True, exist_ok=True)
 
         expires_at = int(time.time() + ttl.total_seconds()) if (ttl is not None) else None
-        entry = FileCacheMeta(data=data, expires_at=expires_at)
-        entry_bytes = entry.SerializeToString()
+        header = FileCacheMeta(expires_at=expires_at).SerializeToString()
+        header += bytes((_DATA_TAG,)) + _encode_varint(size)
 
         temp_name = f'.{buffered_randbytes(16).hex()}.tmp'
         temp_path = path.with_name(temp_name)
 
-        with temp_path.open('xb') as f:
-            loop = get_running_loop()
-            await loop.run_in_executor(None, f.write, entry_bytes)
+        loop = get_running_loop()
+        written: cython.Py_ssize_t = 0
+        try:
+            with temp_path.open('xb') as f:
+                await loop.run_in_executor(None, f.write, header)
+                async for chunk in chunks:
+                    written += len(chunk)
+                    await loop.run_in_executor(None, f.write, chunk)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+        if written != size:
+            temp_path.unlink(missing_ok=True)
+            raise ValueError(f'Cache entry size mismatch ({written} != {size})')
 
         temp_path.rename(path)
 
-    def delete(self, key: str) -> None:
+        await loop.run_in_executor(
+            None,
+            _get_index(self._cache_dir).add,
+            self._context,
+            path.name,
+            len(header) + size,
+            expires_at if (expires_at is not None) else inf,
+        )
+
+    async def delete(self, key: str) -> None:
         """
         Delete a key from the file cache.
         """
-        path = _get_path(self._base_dir, key)
+        loop = get_running_loop()
+        await loop.run_in_executor(None, self._delete_path, _get_path(self._base_dir, key))
+
+    def _delete_path(self, path: Path) -> None:
         path.unlink(missing_ok=True)
+        _get_index(self._cache_dir).remove(((self._context, path.name),))
 
-    # TODO: runner, with lock
-    async def cleanup(self):
+    @staticmethod
+    def get_total_size(*, cache_dir: Path = FILE_CACHE_DIR) -> int:
         """
-        Cleanup the file cache, removing stale entries.
+        Get the total size of the file cache entries, in bytes.
         """
-        infos: list[_CleanupInfo] = []
-        total_size: int = 0
-        limit_size: int = FILE_CACHE_SIZE_GB * 1024 * 1024 * 1024
-        now = time.time()
+        return _get_index(cache_dir).total_size()
 
-        for path in self._base_dir.rglob('*'):
-            key = path.name
+    @staticmethod
+    async def cleanup(
+        *,
+        cache_dir: Path = FILE_CACHE_DIR,
+        max_size: int = FILE_CACHE_SIZE_GB * 1024 * 1024 * 1024,
+    ) -> None:
+        """
+        Cleanup the file cache, removing expired entries and then the entries closest to expiration,
+        until the total size is within the limit.
 
+        Only one process performs the cleanup at a time, the others return immediately.
+        """
+        loop = get_running_loop()
+        with cache_dir.joinpath(_LOCK_FILE_NAME).open('a') as lock_file:
             try:
-                loop = get_running_loop()
-                entry_bytes = await loop.run_in_executor(None, path.read_bytes)
-                entry = FileCacheMeta.FromString(entry_bytes)
-            except (OSError, DecodeError):
-                logging.debug('Cache read error for %r', key)
-                continue
-
-            if entry.HasField('expires_at'):
-                if entry.expires_at < now:
-                    logging.debug('Cache cleanup for %r (reason: time)', key)
-                    path.unlink(missing_ok=True)
-                    continue
-                expires_at = entry.expires_at
-            else:
-                expires_at = float('inf')
-
-            size = path.stat().st_size
-            infos.append(_CleanupInfo(expires_at, size, path))
-            total_size += size
-
-        logging.debug('File cache usage is %s of %s', sizestr(total_size), sizestr(limit_size))
-        if total_size <= limit_size:
-            return
-
-        # prioritize cleanup of entries closer to expiration (iterating in reverse)
-        infos.sort(key=lambda info: info.expires_at, reverse=True)
-
-        while total_size > limit_size:
-            info = infos.pop()
-            key = info.path.name
-            logging.debug('Cache cleanup for %r (reason: size)', key)
-            info.path.unlink(missing_ok=True)
-            total_size -= info.size
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logging.debug('File cache cleanup is already running')
+                return
+
+            index = _get_index(cache_dir)
+            if not index.is_scanned():
+                await loop.run_in_executor(None, _scan_unindexed, cache_dir, index)
+
+            num_expired = 0
+            while evicted := await loop.run_in_executor(None, _evict_expired, cache_dir, index, time.time()):
+                num_expired += evicted
+
+            num_evicted = 0
+            while (total_size := index.total_size()) > max_size:
+                evicted = await loop.run_in_executor(None, _evict_size, cache_dir, index, total_size - max_size)
+                if not evicted:
+                    break
+                num_evicted += evicted
+
+            logging.debug(
+                'File cache usage is %s of %s (removed %d expired and %d entries)',
+                sizestr(total_size),
+                sizestr(max_size),
+                num_expired,
+                num_evicted,
+            )
+
+    @staticmethod
+    @asynccontextmanager
+    async def context():
+        """
+        Context manager for the periodic file cache cleanup.
+        """
+        async with TaskGroup() as tg:
+            task = tg.create_task(_cleanup_task())
+            yield
+            task.cancel()  # avoid "Task was destroyed" warning during tests
+
+
+@retry(None)
+async def _cleanup_task() -> None:
+    while True:
+        await FileCache.cleanup()
+        await asyncio.sleep(FILE_CACHE_CLEANUP_INTERVAL.total_seconds())
+
+
+class _Index:
+    """
+    On-disk index of the file cache entries, shared between processes.
+    """
+
+    __slots__ = ('_conn', '_lock')
+
+    def __init__(self, path: Path):
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(_INDEX_SCHEMA)
+        self._lock = Lock()
+
+    def add(self, context: str, key: str, size: int, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO entry VALUES (?, ?, ?, ?) '
+                'ON CONFLICT DO UPDATE SET size = excluded.size, expires_at = excluded.expires_at',
+                (context, key, size, expires_at),
+            )
+
+    def remove(self, entries: list[tuple[str, str]] | tuple[tuple[str, str], ...]) -> None:
+        with self._lock:
+            self._conn.executemany('DELETE FROM entry WHERE context = ? AND key = ?', entries)
+
+    def find_expired(self, now: float, limit: int) -> list[tuple[str, str, int]]:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT context, key, size FROM entry WHERE expires_at < ? ORDER BY expires_at LIMIT ?',
+                (now, limit),
+            ).fetchall()
+
+    def find_oldest(self, limit: int) -> list[tuple[str, str, int]]:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT context, key, size FROM entry ORDER BY expires_at LIMIT ?',
+                (limit,),
+            ).fetchall()
+
+    def total_size(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT total_size FROM stats').fetchone()[0]
+
+    def is_scanned(self) -> bool:
+        with self._lock:
+            return bool(self._conn.execute('SELECT scanned FROM stats').fetchone()[0])
+
+    def set_scanned(self) -> None:
+        with self._lock:
+            self._conn.execute('UPDATE stats SET scanned = 1')
+
+
+@cache
+def _get_index(cache_dir: Path) -> _Index:
+    return _Index(cache_dir.joinpath(_INDEX_FILE_NAME))
+
+
+def _evict_expired(cache_dir: Path, index: _Index, now: float) -> int:
+    """
+    Remove a batch of expired entries.
+
+    Returns the number of removed entries.
+    """
+    entries = index.find_expired(now, FILE_CACHE_CLEANUP_BATCH_SIZE)
+    for context, key, _ in entries:
+        logging.debug('Cache cleanup for %r (reason: time)', key)
+        _get_entry_path(cache_dir, context, key).unlink(missing_ok=True)
+    index.remove([(context, key) for context, key, _ in entries])
+    return len(entries)
+
+
+def _evict_size(cache_dir: Path, index: _Index, excess_size: int) -> int:
+    """
+    Remove a batch of entries closest to expiration, until the excess size is freed.
+
+    Returns the number of removed entries.
+    """
+    removed: list[tuple[str, str]] = []
+    for context, key, size in index.find_oldest(FILE_CACHE_CLEANUP_BATCH_SIZE):
+        if excess_size <= 0:
+            break
+        logging.debug('Cache cleanup for %r (reason: size)', key)
+        _get_entry_path(cache_dir, context, key).unlink(missing_ok=True)
+        removed.append((context, key))
+        excess_size -= size
+    index.remove(removed)
+    return len(removed)
+
+
+def _scan_unindexed(cache_dir: Path, index: _Index) -> None:
+    """
+    Index the entries created before the index existed. Runs once per cache directory.
+    """
+    num_files: cython.Py_ssize_t = 0
+    for path in cache_dir.glob('*/??/??/*'):
+        key = path.name
+        if key[0] == '.':
+            continue
+
+        try:
+            entry_bytes = path.read_bytes()
+            entry = FileCacheMeta.FromString(entry_bytes)
+        except (OSError, DecodeError):
+            logging.debug('Cache read error for %r', key)
+            continue
+
+        expires_at = entry.expires_at if entry.HasField('expires_at') else inf
+        index.add(path.parts[-4], key, len(entry_bytes), expires_at)
+        num_files += 1
+
+    index.set_scanned()
+    logging.info('Indexed %d existing file cache entries', num_files)
+
+
+async def _iter_one(data: bytes):
+    yield data
+
+
+def _open_entry(path: Path) -> tuple[IO[bytes], int | None]:
+    """
+    Open the cache entry file, returning the file positioned at the start of the data and the expiration time.
+
+    Entries with the data stored first (written by older versions) are loaded into memory.
+    """
+    file = path.open('rb')
+    try:
+        header = file.read(_ENTRY_HEADER_MAX_SIZE)
+        pos: cython.Py_ssize_t = 0
+        expires_at: int | None = None
+
+        if header[:1] == bytes((_EXPIRES_AT_TAG,)):
+            expires_at, pos = _decode_varint(header, 1)
+            if expires_at >= 1 << 63:  # negative int64
+                expires_at -= 1 << 64
+
+        if header[pos : pos + 1] == bytes((_DATA_TAG,)):
+            size, pos = _decode_varint(header, pos + 1)
+            if pos + size == os.fstat(file.fileno()).st_size:
+                file.seek(pos)
+                return file, expires_at
+
+        file.seek(0)
+        entry = FileCacheMeta.FromString(file.read())
+    except BaseException:
+        file.close()
+        raise
+
+    file.close()
+    return BytesIO(entry.data), (entry.expires_at if entry.HasField('expires_at') else None)
+
+
+def _encode_varint(value: int) -> bytes:
+    result = bytearray()
+    while value > 0x7F:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _decode_varint(buffer: bytes, pos: cython.Py_ssize_t) -> tuple[int, int]:
+    result = 0
+    shift: cython.int = 0
+    for i in range(pos, min(pos + 10, len(buffer))):
+        byte = buffer[i]
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, i + 1
+        shift += 7
+    raise DecodeError('Truncated varint')
 
 
 @lru_cache(maxsize=1024)
@@ -138,3 +431,7 @@ def _get_path(base_dir: Path, key_str: str) -> Path:
     """
     key: str = hash_hex(key_str)
     return base_dir.joinpath(key[:2], key[2:4], key)
+
+
+def _get_entry_path(cache_dir: Path, context: str, key: str) -> Path:
+    return cache_dir.joinpath(context, key[:2], key[2:4], key)
@@ -1,4 +1,6 @@
 import cython
+import numpy as np
+from numpy.typing import NDArray
 from shapely import MultiPolygon, Point, Polygon, box, get_coordinates
 
 from app.lib.exceptions_context import raise_for
@@ -6,9 +8,11 @@ from app.limits import GEO_COORDINATE_PRECISION
 from app.validators.geometry import validate_geometry
 
 if cython.compiled:
-    from cython.cimports.libc.math import atan2, cos, sin, sqrt
+    from cython.cimports.libc.math import atan, atan2, cos, pi, sin, sinh, sqrt
 else:
-    from math import atan2, cos, sin, sqrt
+    from math import atan, atan2, cos, pi, sin, sinh, sqrt
+
+_MERCATOR_MAX_LAT = 85.0511287798066
 
 
 @cython.cfunc
@@ -132,6 +136,35 @@ def parse_bbox(s: str) -> Polygon | MultiPolygon:
     )
 
 
+def tile_xy(coords: NDArray[np.floating], zoom: int) -> NDArray[np.int64]:
+    """
+    Convert an array of (lon, lat) coordinates to web mercator tile (x, y) indices.
+
+    >>> tile_xy(np.array([[0, 0], [-180, 90]]), 16)
+    array([[32768, 32768], [0, 0]])
+    """
+    n: cython.int = 1 << zoom
+    lat = np.radians(np.clip(coords[:, 1], -_MERCATOR_MAX_LAT, _MERCATOR_MAX_LAT))
+    xs = (coords[:, 0] + 180) / 360 * n
+    ys = (1 - np.arcsinh(np.tan(lat)) / pi) / 2 * n
+    return np.clip(np.floor(np.column_stack((xs, ys))), 0, n - 1).astype(np.int64)
+
+
+def tile_bounds(x: cython.int, y: cython.int, zoom: cython.int) -> tuple[float, float, float, float]:
+    """
+    Get the (minx, miny, maxx, maxy) bounds of a web mercator tile.
+
+    >>> tile_bounds(0, 0, 1)
+    (-180.0, 0.0, 0.0, 85.0511287798066)
+    """
+    n: cython.double = 1 << zoom
+    minx = x / n * 360 - 180
+    maxx = (x + 1) / n * 360 - 180
+    miny = atan(sinh(pi * (1 - 2 * (y + 1) / n))) * 57.29577951308232  # 180 / pi
+    maxy = atan(sinh(pi * (1 - 2 * y / n))) * 57.29577951308232
+    return minx, miny, maxx, maxy
+
+
 def try_parse_point(lat_lon: str) -> Point | None:
     """
     Try to parse a point string.
@@ -1,6 +1,9 @@
 import logging
 from asyncio import get_running_loop
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from functools import partial
 from pathlib import Path
 from typing import Literal, overload
 
@@ -19,6 +22,8 @@ from app.limits import (
     BACKGROUND_MAX_FILE_SIZE,
     BACKGROUND_MAX_MEGAPIXELS,
     BACKGROUND_MAX_RATIO,
+    IMAGE_ENCODE_WORKERS,
+    IMAGE_NORMALIZE_WORKERS,
 )
 from app.models.types import StorageKey
 
@@ -27,8 +32,6 @@ if cython.compiled:
 else:
     from math import sqrt
 
-# TODO: test 200MP file
-
 
 class AvatarType(str, Enum):
     default = 'default'
@@ -109,20 +112,50 @@ class Image:
 
 
 async def _normalize_image(
+    data: bytes,
+    *,
+    min_ratio: float,
+    max_ratio: float,
+    max_megapixels: int,
+    max_file_size: int,
+) -> bytes:
+    """
+    Normalize the image in the image worker pool, without blocking the event loop.
+    """
+    loop = get_running_loop()
+    result = await loop.run_in_executor(
+        _NORMALIZE_EXECUTOR,
+        partial(
+            _normalize_image_sync,
+            data,
+            min_ratio=min_ratio,
+            max_ratio=max_ratio,
+            max_megapixels=max_megapixels,
+            max_file_size=max_file_size,
+        ),
+    )
+    if result is None:
+        raise_for.image_too_big()
+    return result
+
+
+def _normalize_image_sync(
     data: bytes,
     *,
     min_ratio: cython.double,
     max_ratio: cython.double,
     max_megapixels: cython.int,
     max_file_size: cython.int,
-) -> bytes:
+) -> bytes | None:
     """
-    Normalize the avatar image.
+    Normalize the image.
 
     - Orientation: rotate
     - Shape ratio: crop
     - Megapixels: downscale
     - File size: reduce quality
+
+    Returns None if the image cannot fit the file size.
     """
     img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
 
@@ -160,22 +193,26 @@ async def _normalize_image(
             img = cv2.resize(img, (img_width, img_height), interpolation=cv2.INTER_AREA)
 
     # optimize file size
-    quality, buffer = await _optimize_quality(img, max_file_size)
-    logging.debug('Optimized avatar quality: Q%d', quality)
+    result = _optimize_quality(img, max_file_size)
+    if result is None:
+        return None
+    quality, buffer = result
+    logging.debug('Optimized image quality: Q%d', quality)
     return buffer
 
 
-async def _optimize_quality(img: MatLike, max_file_size: int | None) -> tuple[int, bytes]:
+@cython.cfunc
+def _optimize_quality(img: MatLike, max_file_size: int | None) -> tuple[int, bytes] | None:
     """
     Find the best image quality given the maximum file size.
 
-    Returns the quality and the image buffer.
-    """
-    loop = get_running_loop()
+    The quality candidates are encoded in parallel: first a quick scan, then all the steps between its results.
 
-    _, img_ = await loop.run_in_executor(None, cv2.imencode, '.webp', img, (cv2.IMWRITE_WEBP_QUALITY, 101))
+    Returns the quality and the image buffer, or None if no quality fits.
+    """
+    img_ = _encode_webp(img, 101)
     size = img_.size
-    logging.debug('Optimizing avatar quality (lossless): %s', sizestr(size))
+    logging.debug('Optimizing image quality (lossless): %s', sizestr(size))
 
     if max_file_size is None or size <= max_file_size:
         return -1, img_.tobytes()
@@ -186,12 +223,11 @@ async def _optimize_quality(img: MatLike, max_file_size: int | None) -> tuple[in
     best_quality: cython.int = -1
     best_img: NDArray[np.uint8] | None = None
 
-    # initial quick scan
+    # initial quick scan, the highest fitting quality bounds the fine-tune
     quality: cython.int
-    for quality in range(80, 20 - 1, -20):
-        _, img_ = await loop.run_in_executor(None, cv2.imencode, '.webp', img, (cv2.IMWRITE_WEBP_QUALITY, quality))
+    for quality, img_ in _encode_webp_many(img, range(80, low - 1, -20)):
         size = img_.size
-        logging.debug('Optimizing avatar quality (quick): Q%d -> %s', quality, sizestr(size))
+        logging.debug('Optimizing image quality (quick): Q%d -> %s', quality, sizestr(size))
 
         if size > max_file_size:
             high = quality - bs_step
@@ -201,22 +237,37 @@ async def _optimize_quality(img: MatLike, max_file_size: int | None) -> tuple[in
             best_img = img_
             break
     else:
-        raise_for.image_too_big()
+        return None
 
-    # fine-tune with binary search
-    while low <= high:
-        # round down to the nearest bs_step
-        quality = ((low + high) // 2) // bs_step * bs_step
-
-        _, img_ = await loop.run_in_executor(None, cv2.imencode, '.webp', img, (cv2.IMWRITE_WEBP_QUALITY, quality))
+    # fine-tune with all the remaining steps
+    for quality, img_ in _encode_webp_many(img, range(high, low - 1, -bs_step)):
         size = img_.size
-        logging.debug('Optimizing avatar quality (fine): Q%d -> %s', quality, sizestr(size))
+        logging.debug('Optimizing image quality (fine): Q%d -> %s', quality, sizestr(size))
 
-        if size > max_file_size:
-            high = quality - bs_step
-        else:
-            low = quality + bs_step
+        if size <= max_file_size:
             best_quality = quality
             best_img = img_
+            break
 
     return best_quality, best_img.tobytes()
+
+
+@cython.cfunc
+def _encode_webp(img: MatLike, quality: int) -> NDArray[np.uint8]:
+    _, buffer = cv2.imencode('.webp', img, (cv2.IMWRITE_WEBP_QUALITY, quality))
+    return buffer
+
+
+def _encode_webp_many(img: MatLike, qualities: Iterable[int]) -> Iterator[tuple[int, NDArray[np.uint8]]]:
+    """
+    Encode the image with the given qualities in parallel.
+
+    Yields the results in the order of qualities.
+    """
+    qualities = tuple(qualities)
+    yield from zip(qualities, _ENCODE_EXECUTOR.map(partial(_encode_webp, img), qualities), strict=True)
+
+
+# cv2 releases the GIL, allowing the threads to run in parallel
+_NORMALIZE_EXECUTOR = ThreadPoolExecutor(IMAGE_NORMALIZE_WORKERS, thread_name_prefix='ImageNormalize')
+_ENCODE_EXECUTOR = ThreadPoolExecutor(IMAGE_ENCODE_WORKERS, thread_name_prefix='ImageEncode')
@@ -1,12 +1,21 @@
+import logging
+from asyncio import get_running_loop, wrap_future
 from base64 import b64decode, b64encode
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
 from hashlib import md5, pbkdf2_hmac
 from hmac import compare_digest
-from typing import Literal, NamedTuple
+from multiprocessing import get_context
+from typing import Literal, NamedTuple, TypeVar
 
 from argon2 import PasswordHasher, Type
 from argon2.exceptions import VerifyMismatchError
 
 from app.config import TEST_ENV
+from app.lib.exceptions_context import raise_for
+from app.limits import PASSWORD_HASH_POOL_MAX_PENDING, PASSWORD_HASH_POOL_WORKERS
 from app.models.proto.server_pb2 import UserPassword
 from app.models.proto.shared_pb2 import TransmitUserPassword
 from app.models.types import PasswordType
@@ -15,6 +24,8 @@ PasswordSchema = Literal['legacy', 'v1']
 
 __all__ = ('PasswordSchema',)
 
+_T = TypeVar('_T')
+
 
 class VerifyResult(NamedTuple):
     success: bool
@@ -31,8 +42,64 @@ _hasher_v1 = PasswordHasher(
     type=Type.ID,
 )
 
+_pool: ProcessPoolExecutor | None = None
+_pool_pending: int = 0
+_pool_rejected: int = 0
+
 
 class PasswordHash:
+    @staticmethod
+    @asynccontextmanager
+    async def context():
+        """
+        Context manager for the password hashing process pool.
+        """
+        global _pool
+        previous = _pool
+        pool = _pool = ProcessPoolExecutor(PASSWORD_HASH_POOL_WORKERS, mp_context=get_context('spawn'))
+        try:
+            yield
+        finally:
+            _pool = previous
+            pool.shutdown(cancel_futures=True)
+
+    @staticmethod
+    async def verify_async(
+        *,
+        password_pb: bytes,
+        password: PasswordType,
+        is_test_user: bool,
+    ) -> VerifyResult:
+        """
+        Verify a password like verify, without blocking the event loop.
+
+        Raises too_many_requests if the password hashing pool is overloaded.
+        """
+        # skip the pool when no hashing is involved
+        if is_test_user or not password_pb:
+            return PasswordHash.verify(password_pb=password_pb, password=password, is_test_user=is_test_user)
+        return await _run_pooled(
+            partial(PasswordHash.verify, password_pb=password_pb, password=password, is_test_user=is_test_user)
+        )
+
+    @staticmethod
+    async def hash_async(password: PasswordType) -> bytes | None:
+        """
+        Hash a password like hash, without blocking the event loop.
+
+        Raises too_many_requests if the password hashing pool is overloaded.
+        """
+        return await _run_pooled(partial(PasswordHash.hash, password))
+
+    @staticmethod
+    def get_pool_stats() -> tuple[int, int]:
+        """
+        Get the password hashing pool statistics of this process.
+
+        Returns a tuple of (pending, rejected), where pending is the current queue depth.
+        """
+        return _pool_pending, _pool_rejected
+
     @staticmethod
     def verify(
         *,
@@ -127,3 +194,26 @@ class PasswordHash:
             return UserPassword(v1=UserPassword.V1(hash=hash, salt=salt)).SerializeToString()
 
         return None
+
+
+async def _run_pooled(func: Callable[[], _T]) -> _T:
+    """
+    Run the function in the password hashing pool, with admission control.
+    """
+    global _pool_pending, _pool_rejected
+
+    pool = _pool
+    if pool is None:
+        # outside the application lifespan, e.g., in scripts
+        return await get_running_loop().run_in_executor(None, func)
+
+    if _pool_pending >= PASSWORD_HASH_POOL_MAX_PENDING:
+        _pool_rejected += 1
+        logging.warning('Password hashing pool is overloaded (%d pending), rejecting request', _pool_pending)
+        raise_for.too_many_requests()
+
+    _pool_pending += 1
+    try:
+        return await wrap_future(pool.submit(func))
+    finally:
+        _pool_pending -= 1
@@ -1,6 +1,6 @@
 import logging
 import tomllib
-from asyncio import TaskGroup
+from collections import defaultdict
 from collections.abc import Iterable, Sequence
 from enum import Enum
 from html import escape
@@ -16,10 +16,11 @@ from markdown_it import MarkdownIt
 from markdown_it.renderer import RendererHTML
 from markdown_it.token import Token
 from markdown_it.utils import EnvType, OptionsDict
-from sqlalchemy import update
+from sqlalchemy import column, update, values
 
 from app.config import TRUSTED_HOSTS
 from app.db import db_commit
+from app.lib.crypto import hash_bytes
 from app.limits import RICH_TEXT_CACHE_EXPIRE
 from app.services.cache_service import CacheContext, CacheEntry, CacheService
 
@@ -64,27 +65,8 @@ async def rich_text(text: str, cache_id: bytes | None, text_format: TextFormat)
 
     If cache_id is provided, it will be used to accelerate cache lookup.
     """
-    cache_context = CacheContext(f'RichText:{text_format.value}')
-
-    async def factory() -> bytes:
-        return process_rich_text(text, text_format).encode()
-
-    # accelerate cache lookup by id if available
-    if cache_id is not None:
-        return await CacheService.get(
-            cache_id,
-            cache_context,
-            factory,
-            ttl=RICH_TEXT_CACHE_EXPIRE,
-        )
-    else:
-        return await CacheService.get(
-            text,
-            cache_context,
-            factory,
-            hash_key=True,
-            ttl=RICH_TEXT_CACHE_EXPIRE,
-        )
+    key, cache_context, factory = _rich_text_item(text, cache_id, text_format)
+    return await CacheService.get(key, cache_context, factory, ttl=RICH_TEXT_CACHE_EXPIRE)
 
 
 class RichTextMixin:
@@ -94,58 +76,97 @@ class RichTextMixin:
         """
         Resolve rich text fields.
         """
-        fields = self.__rich_text_fields__
-        num_fields: int = len(fields)
-        if num_fields == 0:
-            logging.warning('%s has not defined rich text fields', type(self).__qualname__)
-            return
+        await resolve_rich_text_many((self,))
 
-        logging.debug('Resolving %d rich text fields', num_fields)
-        async with TaskGroup() as tg:
-            for field_name, text_format in fields:
-                tg.create_task(_resolve_rich_text_task(self, field_name, text_format))
 
+async def resolve_rich_text_many(objects: Iterable[RichTextMixin]) -> None:
+    """
+    Resolve rich text fields of multiple objects at once.
 
-async def _resolve_rich_text_task(self, field_name: str, text_format: TextFormat) -> None:
-    rich_field_name = field_name + '_rich'
-    rich_hash_field_name = field_name + '_rich_hash'
-
-    # skip if already resolved
-    if getattr(self, rich_field_name) is not None:
+    The cache is queried in a single batch, and the changed hashes are updated with one statement per field.
+    """
+    fields: list[tuple[RichTextMixin, str, TextFormat]] = []
+    for obj in objects:
+        obj_fields = obj.__rich_text_fields__
+        if not obj_fields:
+            logging.warning('%s has not defined rich text fields', type(obj).__qualname__)
+            continue
+        for field_name, text_format in obj_fields:
+            # skip if already resolved
+            if getattr(obj, field_name + '_rich') is None:
+                fields.append((obj, field_name, text_format))
+
+    if not fields:
         return
 
-    text: str = getattr(self, field_name)
-    text_rich_hash: bytes | None = getattr(self, rich_hash_field_name)
-    cache_entry = await rich_text(text, text_rich_hash, text_format)
-    cache_entry_id: bytes = cache_entry.id
-
-    # assign new hash if changed
-    if text_rich_hash != cache_entry_id:
-        updated_at = getattr(self, 'updated_at', None)
+    logging.debug('Resolving %d rich text fields', len(fields))
+    items = []
+    for obj, field_name, text_format in fields:
+        text: str = getattr(obj, field_name)
+        text_rich_hash: bytes | None = getattr(obj, field_name + '_rich_hash')
+        items.append(_rich_text_item(text, text_rich_hash, text_format))
+    cache_entries = await CacheService.get_many(items, ttl=RICH_TEXT_CACHE_EXPIRE)
+
+    # group the changed hashes by statement: (class, field) -> [(id, old hash, new hash)]
+    changes: defaultdict[tuple[type, str], list[tuple[int, bytes | None, bytes]]] = defaultdict(list)
+    for (obj, field_name, _), cache_entry in zip(fields, cache_entries, strict=True):
+        rich_hash_field_name = field_name + '_rich_hash'
+        text_rich_hash = getattr(obj, rich_hash_field_name)
+        cache_entry_id = cache_entry.id
+        if text_rich_hash != cache_entry_id:
+            changes[type(obj), rich_hash_field_name].append((obj.id, text_rich_hash, cache_entry_id))  # pyright: ignore[reportAttributeAccessIssue]
+            setattr(obj, rich_hash_field_name, cache_entry_id)
+
+        # assign value to instance
+        setattr(obj, field_name + '_rich', cache_entry.value.decode())
+
+    if changes:
         async with db_commit() as session:
-            cls = type(self)
-            stmt = (
-                update(cls)
-                .where(
-                    cls.id == self.id,
-                    getattr(cls, rich_hash_field_name) == text_rich_hash,
-                )
-                .values(
-                    {
-                        rich_hash_field_name: cache_entry_id,
-                        # preserve updated_at if it exists
-                        **({'updated_at': updated_at} if (updated_at is not None) else {}),
-                    }
-                )
-                .inline()
-            )
-            await session.execute(stmt)
-
-        logging.debug('Rich text field %r hash was changed', field_name)
-        setattr(self, rich_hash_field_name, cache_entry_id)
-
-    # assign value to instance
-    setattr(self, rich_field_name, cache_entry.value.decode())
+            for (cls, rich_hash_field_name), rows in changes.items():
+                logging.debug('Updating %d %s.%s values', len(rows), cls.__qualname__, rich_hash_field_name)
+                await session.execute(_update_rich_hash_stmt(cls, rich_hash_field_name, rows))
+
+
+@cython.cfunc
+def _rich_text_item(text: str, cache_id: bytes | None, text_format: TextFormat):
+    cache_context = CacheContext(f'RichText:{text_format.value}')
+
+    async def factory() -> bytes:
+        return process_rich_text(text, text_format).encode()
+
+    # accelerate cache lookup by id if available
+    return (cache_id if cache_id is not None else hash_bytes(text)), cache_context, factory
+
+
+@cython.cfunc
+def _update_rich_hash_stmt(cls: type, rich_hash_field_name: str, rows: list[tuple[int, bytes | None, bytes]]):
+    """
+    Build a bulk statement updating the rich text hashes, unless they were changed concurrently.
+    """
+    id_column = cls.id  # pyright: ignore[reportAttributeAccessIssue]
+    hash_column = getattr(cls, rich_hash_field_name)
+    data = values(
+        column('id', id_column.type),
+        column('old_hash', hash_column.type),
+        column('new_hash', hash_column.type),
+        name='data',
+    ).data(rows)
+    return (
+        update(cls)
+        .where(
+            id_column == data.c.id,
+            # all-null values column would be inferred as text
+            hash_column.is_not_distinct_from(data.c.old_hash.cast(hash_column.type)),
+        )
+        .values(
+            {
+                hash_column: data.c.new_hash,
+                # preserve updated_at if it exists
+                **({'updated_at': cls.updated_at} if hasattr(cls, 'updated_at') else {}),  # pyright: ignore[reportAttributeAccessIssue]
+            }
+        )
+        .inline()
+    )
 
 
 @cython.cfunc
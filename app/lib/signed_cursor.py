@@ -0,0 +1,50 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import timedelta
+from time import time
+from typing import Protocol, TypeVar
+
+from google.protobuf.message import DecodeError
+
+from app.lib.crypto import hash_compare, hmac_bytes
+from app.lib.exceptions_context import raise_for
+
+
+class _CursorMessage(Protocol):
+    timestamp: int
+
+    def SerializeToString(self) -> bytes: ...  # noqa: N802
+
+
+_T = TypeVar('_T', bound=_CursorMessage)
+
+
+def encode_signed_cursor(message: _CursorMessage) -> str:
+    """
+    Encode and sign a cursor message.
+
+    Returns a string of 'cursor.hmac'.
+    """
+    buffer_b64 = urlsafe_b64encode(message.SerializeToString())
+    hmac_b64 = urlsafe_b64encode(hmac_bytes(buffer_b64))
+    return f'{buffer_b64.decode()}.{hmac_b64.decode()}'
+
+
+def decode_signed_cursor(cursor: str, message_type: type[_T], *, expire: timedelta) -> _T:
+    """
+    Verify and decode a signed cursor message.
+
+    Raises an exception if the cursor is invalid or expired.
+    """
+    parts = cursor.split('.', 1)
+    if len(parts) != 2:
+        raise_for.bad_cursor()
+    buffer_b64, hmac_b64 = parts
+    try:
+        if not hash_compare(buffer_b64, urlsafe_b64decode(hmac_b64), hash_func=hmac_bytes):
+            raise_for.bad_cursor()
+        message: _T = message_type.FromString(urlsafe_b64decode(buffer_b64))  # pyright: ignore[reportAttributeAccessIssue]
+    except (ValueError, DecodeError):
+        raise_for.bad_cursor()
+    if message.timestamp + expire.total_seconds() < time():
+        raise_for.cursor_expired()
+    return message
@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import IO
 
 from app.lib.buffered_random import buffered_rand_urlsafe
 from app.limits import STORAGE_KEY_MAX_LENGTH
@@ -30,6 +32,14 @@ class StorageBase(ABC):
         """
         ...
 
+    async def open(self, key: StorageKey) -> IO[bytes]:
+        """
+        Open a file from storage by key for reading.
+
+        The caller is responsible for closing the file.
+        """
+        return BytesIO(await self.load(key))
+
     async def save(self, data: bytes, suffix: str) -> StorageKey:
         """
         Save a file to storage and return its key.
@@ -1,4 +1,9 @@
+import logging
+import time
+from asyncio import Task, create_task, shield
+from functools import partial
 from hashlib import md5
+from struct import Struct
 from typing import override
 
 from starlette import status
@@ -6,9 +11,15 @@ from starlette import status
 from app.lib.file_cache import FileCache
 from app.lib.image import Image
 from app.lib.storage.base import StorageBase
-from app.limits import GRAVATAR_CACHE_EXPIRE
+from app.limits import GRAVATAR_CACHE_EXPIRE, GRAVATAR_CACHE_STALE, GRAVATAR_NOT_FOUND_CACHE_EXPIRE
 from app.utils import HTTP
 
+# fresh until (unix timestamp), not found
+_ENTRY_HEADER = Struct('<d?')
+_ENTRY_VERSION = 2
+
+_inflight: dict[str, Task[bytes]] = {}
+
 
 class GravatarStorage(StorageBase):
     """
@@ -27,18 +38,55 @@ class GravatarStorage(StorageBase):
     async def load(self, key: str) -> bytes:
         """
         Load an avatar from Gravatar by email.
+
+        Stale avatars are returned immediately and refreshed in the background.
+        Concurrent loads of the same avatar share a single request.
         """
         key_hashed = md5(key.lower().encode()).hexdigest()  # noqa: S324
-        data = await self._fc.get(key)
-        if data is not None:
-            return data
+        entry = await self._fc.get(_cache_key(key_hashed))
+        if entry is None:
+            return await shield(self._fetch(key_hashed))
+
+        fresh_until, not_found = _ENTRY_HEADER.unpack_from(entry)
+        if fresh_until < time.time():
+            logging.debug('Refreshing stale gravatar %r', key_hashed)
+            self._fetch(key_hashed)
+
+        return Image.default_avatar if not_found else entry[_ENTRY_HEADER.size :]
+
+    def _fetch(self, key_hashed: str) -> Task[bytes]:
+        """
+        Fetch an avatar from Gravatar, joining the in-flight request of the same avatar.
+        """
+        task = _inflight.get(key_hashed)
+        if task is None:
+            task = _inflight[key_hashed] = create_task(self._fetch_task(key_hashed))
+            task.add_done_callback(partial(_on_fetch_done, key_hashed))
+        return task
 
+    async def _fetch_task(self, key_hashed: str) -> bytes:
         r = await HTTP.get(f'https://www.gravatar.com/avatar/{key_hashed}?s=512&d=404')
         if r.status_code == status.HTTP_404_NOT_FOUND:
-            data = Image.default_avatar
+            # cache the miss without the data, most users have no gravatar
+            not_found = True
+            expire = GRAVATAR_NOT_FOUND_CACHE_EXPIRE
+            data = b''
         else:
             r.raise_for_status()
+            not_found = False
+            expire = GRAVATAR_CACHE_EXPIRE
             data = await Image.normalize_avatar(r.content)
 
-        await self._fc.set(key_hashed, data, ttl=GRAVATAR_CACHE_EXPIRE)
-        return data
+        entry = _ENTRY_HEADER.pack(time.time() + expire.total_seconds(), not_found) + data
+        await self._fc.set(_cache_key(key_hashed), entry, ttl=expire + GRAVATAR_CACHE_STALE)
+        return Image.default_avatar if not_found else data
+
+
+def _cache_key(key_hashed: str) -> str:
+    return f'{key_hashed}:{_ENTRY_VERSION}'
+
+
+def _on_fetch_done(key_hashed: str, task: Task[bytes]) -> None:
+    del _inflight[key_hashed]
+    if not task.cancelled() and (e := task.exception()) is not None:
+        logging.warning('Failed to fetch gravatar %r: %r', key_hashed, e)
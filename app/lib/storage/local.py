@@ -1,7 +1,7 @@
 from asyncio import get_running_loop
 from functools import lru_cache
 from pathlib import Path
-from typing import override
+from typing import IO, override
 
 from app.config import FILE_STORE_DIR
 from app.lib.buffered_random import buffered_randbytes
@@ -26,6 +26,12 @@ class LocalStorage(StorageBase):
         loop = get_running_loop()
         return await loop.run_in_executor(None, path.read_bytes)
 
+    @override
+    async def open(self, key: StorageKey) -> IO[bytes]:
+        path = _get_path(self._base_dir, key)
+        loop = get_running_loop()
+        return await loop.run_in_executor(None, path.open, 'rb')
+
     @override
     async def save(self, data: bytes, suffix: str) -> StorageKey:
         key = self._make_key(suffix)
@@ -1,13 +1,30 @@
-from typing import override
+from asyncio import TaskGroup, get_running_loop
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from io import BytesIO
+from os import SEEK_CUR
+from typing import IO, TYPE_CHECKING, override
 
 import aioboto3
+from aiobotocore.config import AioConfig
 
+from app.config import S3_ENDPOINT_URL
 from app.lib.file_cache import FileCache
 from app.lib.storage.base import StorageBase
-from app.limits import S3_CACHE_EXPIRE
+from app.limits import (
+    S3_CACHE_EXPIRE,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_MULTIPART_PART_SIZE,
+    S3_MULTIPART_THRESHOLD,
+    S3_READ_CHUNK_SIZE,
+)
 from app.models.types import StorageKey
 
+if TYPE_CHECKING:
+    from types_aiobotocore_s3 import S3Client
+
 _s3 = aioboto3.Session()
+_client: 'S3Client | None' = None
 
 
 class S3Storage(StorageBase):
@@ -25,27 +42,141 @@ class S3Storage(StorageBase):
 
     @override
     async def load(self, key: StorageKey) -> bytes:
-        if (data := await self._fc.get(key)) is not None:
-            return data
-
-        async with _s3.client('s3') as s3:
-            data = await (await s3.get_object(Bucket=self._context, Key=key))['Body'].read()
+        with await self.open(key) as file:
+            return await get_running_loop().run_in_executor(None, file.read)
 
-        await self._fc.set(key, data, ttl=S3_CACHE_EXPIRE)
-        return data
+    @override
+    async def open(self, key: StorageKey) -> IO[bytes]:
+        """
+        Open a file from storage by key for reading.
+
+        Uncached files are streamed from S3 into the cache first.
+        """
+        if (file := await self._fc.open(key)) is not None:
+            return file
+
+        async with _get_client() as s3:
+            r = await s3.get_object(Bucket=self._context, Key=key)
+            body = r['Body']
+            try:
+                await self._fc.set_stream(
+                    key, body.iter_chunks(S3_READ_CHUNK_SIZE), r['ContentLength'], ttl=S3_CACHE_EXPIRE
+                )
+            finally:
+                body.close()
+
+        if (file := await self._fc.open(key)) is not None:
+            return file
+
+        # evicted in the meantime
+        async with _get_client() as s3:
+            r = await s3.get_object(Bucket=self._context, Key=key)
+            return BytesIO(await r['Body'].read())
+
+    async def load_range(self, key: StorageKey, start: int, stop: int) -> bytes:
+        """
+        Load a byte range [start, stop) of a file from storage by key.
+
+        Uncached files are read with a range request, without caching.
+        """
+        if (file := await self._fc.open(key)) is not None:
+            with file:
+
+                def read() -> bytes:
+                    file.seek(start, SEEK_CUR)  # the file is positioned at the start of the data
+                    return file.read(stop - start)
+
+                return await get_running_loop().run_in_executor(None, read)
+
+        async with _get_client() as s3:
+            r = await s3.get_object(Bucket=self._context, Key=key, Range=f'bytes={start}-{stop - 1}')
+            return await r['Body'].read()
 
     @override
     async def save(self, data: bytes, suffix: str) -> StorageKey:
         key = self._make_key(suffix)
 
-        async with _s3.client('s3') as s3:
-            await s3.put_object(Bucket=self._context, Key=key, Body=data)
+        async with _get_client() as s3:
+            if len(data) > S3_MULTIPART_THRESHOLD:
+                await self._save_multipart(s3, key, data)
+            else:
+                await s3.put_object(Bucket=self._context, Key=key, Body=data)
 
         return key
 
+    async def _save_multipart(self, s3: 'S3Client', key: StorageKey, data: bytes) -> None:
+        """
+        Upload a large file in parts, concurrently.
+        """
+        upload_id = (await s3.create_multipart_upload(Bucket=self._context, Key=key))['UploadId']
+        try:
+            async with TaskGroup() as tg:
+                tasks = [
+                    tg.create_task(
+                        s3.upload_part(
+                            Bucket=self._context,
+                            Key=key,
+                            UploadId=upload_id,
+                            PartNumber=part_number,
+                            Body=data[offset : offset + S3_MULTIPART_PART_SIZE],
+                        )
+                    )
+                    for part_number, offset in enumerate(range(0, len(data), S3_MULTIPART_PART_SIZE), 1)
+                ]
+
+            await s3.complete_multipart_upload(
+                Bucket=self._context,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    'Parts': [
+                        {'ETag': task.result()['ETag'], 'PartNumber': part_number}
+                        for part_number, task in enumerate(tasks, 1)
+                    ]
+                },
+            )
+        except BaseException:
+            await s3.abort_multipart_upload(Bucket=self._context, Key=key, UploadId=upload_id)
+            raise
+
     @override
     async def delete(self, key: StorageKey) -> None:
-        async with _s3.client('s3') as s3:
+        async with _get_client() as s3:
             await s3.delete_object(Bucket=self._context, Key=key)
 
-        self._fc.delete(key)
+        await self._fc.delete(key)
+
+    @staticmethod
+    @asynccontextmanager
+    async def context():
+        """
+        Context manager for the pooled S3 client, shared by all storages.
+        """
+        global _client
+        async with _create_client() as client:
+            _client = client
+            try:
+                yield
+            finally:
+                _client = None
+
+
+@asynccontextmanager
+async def _get_client() -> AsyncIterator['S3Client']:
+    """
+    Get the pooled S3 client, or a temporary one outside the application lifespan (e.g. in scripts).
+    """
+    if _client is not None:
+        yield _client
+        return
+
+    async with _create_client() as client:
+        yield client
+
+
+def _create_client():
+    return _s3.client(
+        's3',
+        endpoint_url=S3_ENDPOINT_URL,
+        config=AioConfig(max_pool_connections=S3_MAX_POOL_CONNECTIONS),
+    )
@@ -3,10 +3,13 @@ import gzip
 import logging
 import tarfile
 import zipfile
+import zlib
 from abc import ABC, abstractmethod
-from collections.abc import Collection
-from io import BytesIO
-from typing import ClassVar, override
+from collections.abc import Iterable, Iterator
+from io import SEEK_END, BytesIO, RawIOBase
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile
+from typing import IO, ClassVar, override
 
 import cython
 import magic
@@ -19,22 +22,36 @@ from app.limits import (
     TRACE_FILE_COMPRESS_ZSTD_LEVEL,
     TRACE_FILE_COMPRESS_ZSTD_THREADS,
     TRACE_FILE_MAX_LAYERS,
+    TRACE_FILE_RECOMPRESS_ZSTD_LEVEL,
     TRACE_FILE_UNCOMPRESSED_MAX_SIZE,
 )
 
+# number of bytes used for the content type detection
+_MAGIC_SIZE = 2048
+
+# non-seekable archives are spooled to disk above this size
+_SPOOL_MAX_MEMORY_SIZE = 1024 * 1024
+
 
 class TraceFile:
     @staticmethod
-    def extract(buffer: bytes) -> Collection[bytes]:
+    def extract(file: IO[bytes]) -> Iterator[IO[bytes]]:
         """
-        Extract the trace files from the buffer.
+        Extract the trace files from the file object.
 
-        The buffer may be compressed, in which case it will be decompressed first.
+        The file may be compressed, in which case it will be decompressed incrementally.
+        Each extracted file must be fully read before advancing the iterator.
         """
+        limit = _SizeLimit(TRACE_FILE_UNCOMPRESSED_MAX_SIZE)
+        stream: IO[bytes] = file
+
         # multiple layers allow to handle nested archives such as .tar.gz
         # the use of range here is a cython optimization
         for layer in range(1, TRACE_FILE_MAX_LAYERS + 1):
-            content_type = magic.from_buffer(buffer[:2048], mime=True)
+            if not isinstance(stream, _StreamReader) and not stream.seekable():
+                stream = _StreamReader(stream)
+
+            content_type = magic.from_buffer(_peek(stream, _MAGIC_SIZE), mime=True)
             logging.debug('Trace file layer %d is %r', layer, content_type)
 
             # get the appropriate processor
@@ -42,27 +59,48 @@ class TraceFile:
             if processor is None:
                 raise_for.trace_file_unsupported_format(content_type)
 
-            result = processor.decompress(buffer)
+            result = processor.open(stream, limit)
 
             # list of files: finished
-            if not isinstance(result, bytes):
-                return result
+            if not isinstance(result, _StreamReader):
+                yield from result
+                return
 
-            # compressed blob: continue processing
-            buffer = result
+            # compressed stream: continue processing
+            stream = result
 
         # raise on too many layers
         raise_for.trace_file_archive_too_deep()
 
     @staticmethod
-    def compress(buffer: bytes) -> tuple[bytes, str]:
+    def compress(buffer: bytes | IO[bytes]) -> tuple[bytes, str]:
         """
-        Compress the trace file buffer.
+        Compress the trace file buffer or file object.
 
         Returns the compressed buffer and the file name suffix.
         """
         return _ZstdProcessor.compress(buffer), _ZstdProcessor.suffix
 
+    @staticmethod
+    def recompress(buffer: bytes, file_id: str) -> tuple[bytes, str]:
+        """
+        Recompress the stored trace file buffer at the archival compression level.
+
+        Returns the compressed buffer and the file name suffix.
+        """
+        data = TraceFile.decompress_if_needed(buffer, file_id)
+        result = _ZSTD_RECOMPRESSOR.compress(data)
+        if _ZstdProcessor.decompress(result) != data:
+            raise AssertionError('Recompressed trace file does not match the original')
+        return result, _ZstdProcessor.recompressed_suffix
+
+    @staticmethod
+    def is_recompressed(file_id: str) -> bool:
+        """
+        Check if the stored trace file is compressed at the archival compression level.
+        """
+        return file_id.endswith(_ZstdProcessor.recompressed_suffix)
+
     @staticmethod
     def decompress_if_needed(buffer: bytes, file_id: str) -> bytes:
         """
@@ -70,74 +108,174 @@ class TraceFile:
         """
         return _ZstdProcessor.decompress(buffer) if file_id.endswith(_ZstdProcessor.suffix) else buffer
 
+    @staticmethod
+    def content_encoding(file_id: str) -> str | None:
+        """
+        Get the HTTP content encoding of the stored trace file, if it is compressed.
+        """
+        return 'zstd' if file_id.endswith(_ZstdProcessor.suffix) else None
+
+    @staticmethod
+    def open_decompressed(file: IO[bytes], file_id: str) -> IO[bytes]:
+        """
+        Open the trace file for reading, decompressing it incrementally if needed.
+        """
+        if not file_id.endswith(_ZstdProcessor.suffix):
+            return file
+        return _ZSTD_DECOMPRESSOR.stream_reader(file, read_across_frames=True)  # pyright: ignore[reportReturnType]
+
+
+class _SizeLimit:
+    __slots__ = ('_remaining',)
+
+    def __init__(self, size: int):
+        self._remaining = size
+
+    def consume(self, size: int) -> None:
+        """
+        Consume the given number of bytes, raising if the limit is exceeded.
+        """
+        self._remaining -= size
+        if self._remaining < 0:
+            raise_for.input_too_big(TRACE_FILE_UNCOMPRESSED_MAX_SIZE)
+
+
+class _StreamReader(RawIOBase):
+    """
+    Read-only stream supporting peeking, size limiting, and archive errors handling.
+    """
+
+    def __init__(
+        self,
+        stream: IO[bytes],
+        *,
+        processor: type['_TraceProcessor'] | None = None,
+        limit: _SizeLimit | None = None,
+    ):
+        super().__init__()
+        self._stream = stream
+        self._processor = processor
+        self._limit = limit
+        self._head = b''
+
+    @override
+    def readable(self) -> bool:
+        return True
+
+    def peek(self, size: int) -> bytes:
+        """
+        Return up to size bytes from the stream without advancing it.
+        """
+        head = self._head
+        while len(head) < size and (chunk := self._read(size - len(head))):
+            head += chunk
+        self._head = head
+        return head[:size]
+
+    @override
+    def read(self, size: int | None = -1) -> bytes:
+        if size is None or size < 0:
+            return self.readall()
+        head = self._head
+        if head:
+            self._head = head[size:]
+            return head[:size]
+        return self._read(size)
+
+    @override
+    def readinto(self, buffer) -> int:
+        chunk = self.read(len(buffer))
+        size = len(chunk)
+        buffer[:size] = chunk
+        return size
+
+    def _read(self, size: int) -> bytes:
+        processor = self._processor
+        if processor is None:
+            chunk = self._stream.read(size)
+        else:
+            try:
+                chunk = self._stream.read(size)
+            except processor.errors:
+                raise_for.trace_file_archive_corrupted(processor.media_type)
+
+        limit = self._limit
+        if limit is not None:
+            limit.consume(len(chunk))
+        return chunk
+
+
+@cython.cfunc
+def _peek(stream: IO[bytes], size: int) -> bytes:
+    """
+    Return up to size bytes from the start of the stream without advancing it.
+    """
+    if isinstance(stream, _StreamReader):
+        return stream.peek(size)
+    position = stream.tell()
+    result = stream.read(size)
+    stream.seek(position)
+    return result
+
 
 class _TraceProcessor(ABC):
     media_type: ClassVar[str]
+    errors: ClassVar[tuple[type[Exception], ...]] = ()
 
     @classmethod
     @abstractmethod
-    def decompress(cls, buffer: bytes) -> Collection[bytes] | bytes:
+    def open(cls, stream: IO[bytes], limit: _SizeLimit) -> Iterable[IO[bytes]] | _StreamReader:
         """
-        Decompress the buffer and return files data or a subsequent buffer.
+        Open the stream and return files streams or a subsequent decompressed stream.
         """
         ...
 
 
 class _Bzip2Processor(_TraceProcessor):
     media_type = 'application/x-bzip2'
+    errors = (OSError, EOFError, ValueError)
 
     @classmethod
     @override
-    def decompress(cls, buffer: bytes) -> bytes:
-        try:
-            result = bz2.decompress(buffer)
-        except (OSError, ValueError):
-            raise_for.trace_file_archive_corrupted(cls.media_type)
-
-        if len(result) > TRACE_FILE_UNCOMPRESSED_MAX_SIZE:
-            raise_for.input_too_big(TRACE_FILE_UNCOMPRESSED_MAX_SIZE)
-
-        logging.debug('Trace %r archive uncompressed size is %s', cls.media_type, sizestr(len(result)))
-        return result
+    def open(cls, stream: IO[bytes], limit: _SizeLimit) -> _StreamReader:
+        return _StreamReader(bz2.BZ2File(stream), processor=cls, limit=limit)
 
 
 class _GzipProcessor(_TraceProcessor):
     media_type = 'application/gzip'
+    errors = (OSError, EOFError, zlib.error)
 
     @classmethod
     @override
-    def decompress(cls, buffer: bytes) -> bytes:
-        try:
-            result = gzip.decompress(buffer)
-        except (EOFError, gzip.BadGzipFile):
-            raise_for.trace_file_archive_corrupted(cls.media_type)
-
-        if len(result) > TRACE_FILE_UNCOMPRESSED_MAX_SIZE:
-            raise_for.input_too_big(TRACE_FILE_UNCOMPRESSED_MAX_SIZE)
-
-        logging.debug('Trace %r archive uncompressed size is %s', cls.media_type, sizestr(len(result)))
-        return result
+    def open(cls, stream: IO[bytes], limit: _SizeLimit) -> _StreamReader:
+        return _StreamReader(gzip.GzipFile(fileobj=stream, mode='rb'), processor=cls, limit=limit)
 
 
 class _TarProcessor(_TraceProcessor):
     media_type = 'application/x-tar'
+    errors = (tarfile.TarError, EOFError)
 
     @classmethod
     @override
-    def decompress(cls, buffer: bytes) -> tuple[bytes, ...]:
+    def open(cls, stream: IO[bytes], limit: _SizeLimit) -> Iterator[_StreamReader]:
         try:
-            # pure tar uses no compression, so it's efficient to read files from the memory buffer
-            # 'r:' opens for reading exclusively without compression (safety check)
-            with tarfile.open(fileobj=BytesIO(buffer), mode='r:') as archive:
-                infos = tuple(info for info in archive.getmembers() if info.isfile())
-                logging.debug('Trace %r archive contains %d files', cls.media_type, len(infos))
+            # pure tar uses no compression, so it's efficient to read files sequentially from the stream
+            # 'r|' opens for stream reading exclusively without compression (safety check)
+            with tarfile.open(fileobj=stream, mode='r|') as archive:
+                num_files: cython.int = 0
+                for info in archive:
+                    if not info.isfile():
+                        continue
 
-                if len(infos) > TRACE_FILE_ARCHIVE_MAX_FILES:
-                    raise_for.trace_file_archive_too_many_files()
+                    num_files += 1
+                    if num_files > TRACE_FILE_ARCHIVE_MAX_FILES:
+                        raise_for.trace_file_archive_too_many_files()
 
-                # not checking for the total size of the files - there is no compression
-                # the output size will not exceed the input size
-                return tuple(archive.extractfile(info).read() for info in infos)  # pyright: ignore[reportOptionalMemberAccess]
+                    # not checking for the total size of the files - there is no compression
+                    # the output size will not exceed the input size
+                    yield _StreamReader(archive.extractfile(info), processor=cls)  # pyright: ignore[reportArgumentType]
+
+                logging.debug('Trace %r archive contains %d files', cls.media_type, num_files)
 
         except tarfile.TarError:
             raise_for.trace_file_archive_corrupted(cls.media_type)
@@ -148,55 +286,62 @@ class _XmlProcessor(_TraceProcessor):
 
     @classmethod
     @override
-    def decompress(cls, buffer: bytes) -> tuple[bytes]:
-        logging.debug('Trace %r uncompressed size is %s', cls.media_type, sizestr(len(buffer)))
-        return (buffer,)
+    def open(cls, stream: IO[bytes], limit: _SizeLimit) -> tuple[IO[bytes]]:
+        return (stream,)
 
 
 class _ZipProcessor(_TraceProcessor):
     media_type = 'application/zip'
+    errors = (zipfile.BadZipFile, OSError, EOFError, zlib.error)
 
     @classmethod
     @override
-    def decompress(cls, buffer: bytes) -> list[bytes]:
+    def open(cls, stream: IO[bytes], limit: _SizeLimit) -> Iterator[_StreamReader]:
+        # zip stores its directory at the end of the file, it requires random access
+        if not stream.seekable():
+            spooled = SpooledTemporaryFile(_SPOOL_MAX_MEMORY_SIZE)  # noqa: SIM115
+            copyfileobj(stream, spooled)
+            spooled.seek(0)
+            stream = spooled  # pyright: ignore[reportAssignmentType]
+
         try:
-            with zipfile.ZipFile(BytesIO(buffer)) as archive:
+            with zipfile.ZipFile(stream) as archive:
                 infos = tuple(info for info in archive.infolist() if not info.is_dir())
                 logging.debug('Trace %r archive contains %d files', cls.media_type, len(infos))
 
                 if len(infos) > TRACE_FILE_ARCHIVE_MAX_FILES:
                     raise_for.trace_file_archive_too_many_files()
 
-                result: list[bytes] = [None] * len(infos)  # type: ignore
-                result_size: cython.int = 0
-                i: cython.int
-                for i, info in enumerate(infos):
-                    file = archive.read(info)
-                    result[i] = file
-                    result_size += len(file)
-                    if result_size > TRACE_FILE_UNCOMPRESSED_MAX_SIZE:
-                        raise_for.input_too_big(TRACE_FILE_UNCOMPRESSED_MAX_SIZE)
+                for info in infos:
+                    with archive.open(info) as file:
+                        yield _StreamReader(file, processor=cls, limit=limit)
 
         except zipfile.BadZipFile:
             raise_for.trace_file_archive_corrupted(cls.media_type)
 
-        logging.debug('Trace %r archive uncompressed size is %s', cls.media_type, sizestr(result_size))
-        return result
-
 
-_ZSTD_COMPRESS = ZstdCompressor(level=TRACE_FILE_COMPRESS_ZSTD_LEVEL, threads=TRACE_FILE_COMPRESS_ZSTD_THREADS).compress
-_ZSTD_DECOMPRESS = ZstdDecompressor().decompress
+_ZSTD_COMPRESSOR = ZstdCompressor(level=TRACE_FILE_COMPRESS_ZSTD_LEVEL, threads=TRACE_FILE_COMPRESS_ZSTD_THREADS)
+_ZSTD_RECOMPRESSOR = ZstdCompressor(level=TRACE_FILE_RECOMPRESS_ZSTD_LEVEL)
+_ZSTD_DECOMPRESSOR = ZstdDecompressor()
 
 
 class _ZstdProcessor(_TraceProcessor):
     media_type = 'application/zstd'
     suffix = '.zst'
+    # the compression level is part of the suffix, to recompress again when it changes
+    recompressed_suffix = f'.l{TRACE_FILE_RECOMPRESS_ZSTD_LEVEL}{suffix}'
+    errors = (ZstdError,)
 
     @classmethod
     @override
+    def open(cls, stream: IO[bytes], limit: _SizeLimit) -> _StreamReader:
+        reader = _ZSTD_DECOMPRESSOR.stream_reader(stream, read_across_frames=True)
+        return _StreamReader(reader, processor=cls, limit=limit)  # pyright: ignore[reportArgumentType]
+
+    @classmethod
     def decompress(cls, buffer: bytes) -> bytes:
         try:
-            result = _ZSTD_DECOMPRESS(buffer, allow_extra_data=False)
+            result = _ZSTD_DECOMPRESSOR.decompress(buffer, allow_extra_data=False)
         except ZstdError:
             raise_for.trace_file_archive_corrupted(cls.media_type)
 
@@ -207,8 +352,17 @@ class _ZstdProcessor(_TraceProcessor):
         return result
 
     @classmethod
-    def compress(cls, buffer: bytes) -> bytes:
-        result = _ZSTD_COMPRESS(buffer)
+    def compress(cls, buffer: bytes | IO[bytes]) -> bytes:
+        if isinstance(buffer, bytes):
+            result = _ZSTD_COMPRESSOR.compress(buffer)
+        else:
+            # pledge the source size, so that it is stored in the frame header
+            position = buffer.tell()
+            size = buffer.seek(0, SEEK_END) - position
+            buffer.seek(position)
+            output = BytesIO()
+            _ZSTD_COMPRESSOR.copy_stream(buffer, output, size=size)
+            result = output.getvalue()
         logging.debug('Trace %r archive compressed size is %s', cls.media_type, sizestr(len(result)))
         return result
 
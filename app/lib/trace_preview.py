@@ -0,0 +1,29 @@
+from collections.abc import Iterable
+
+import numpy as np
+from polyline_rs import encode_lonlat
+from shapely import lib
+
+from app.lib.mercator import mercator
+from app.limits import TRACE_PREVIEW_MAX_POINTS, TRACE_PREVIEW_RESOLUTION
+from app.models.db.trace_segment import TraceSegment
+
+
+def encode_trace_preview(segments: Iterable[TraceSegment]) -> str:
+    """
+    Encode the downsampled and Mercator-projected trace preview polyline.
+
+    The segments must be ordered by track and segment number.
+    """
+    points = np.asarray(tuple(segment.points for segment in segments), dtype=np.object_)
+    coords = lib.get_coordinates(points, False, False)
+    size = len(coords)
+    if size < 2:
+        return ''
+
+    if size > TRACE_PREVIEW_MAX_POINTS:
+        indices = np.round(np.linspace(1, size, TRACE_PREVIEW_MAX_POINTS)).astype(np.intp) - 1
+        coords = coords[indices]
+
+    coords = mercator(coords, TRACE_PREVIEW_RESOLUTION, TRACE_PREVIEW_RESOLUTION).astype(np.uint)
+    return encode_lonlat(coords.tolist(), 0)
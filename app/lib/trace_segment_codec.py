@@ -0,0 +1,250 @@
+from datetime import UTC, datetime, timedelta
+from math import isnan
+from struct import Struct
+
+import cython
+import numpy as np
+from numpy.typing import NDArray
+from shapely import MultiPoint, Polygon, box, lib, multipoints
+
+from app.limits import GEO_COORDINATE_PRECISION
+
+# version, flags, number of points
+_HEADER = Struct('<BBI')
+_VERSION = 2
+
+# version 1 stored the number of points as uint16
+_HEADER_V1 = Struct('<BBH')
+
+_FLAG_TIMES = 1 << 0
+_FLAG_TIMES_PARTIAL = 1 << 1
+_FLAG_TIMES_SECONDS = 1 << 2
+_FLAG_ELEVATIONS = 1 << 3
+_FLAG_ELEVATIONS_PARTIAL = 1 << 4
+_FLAG_ELEVATIONS_METERS = 1 << 5
+
+_COORD_SCALE = 10**GEO_COORDINATE_PRECISION
+_ELEVATION_SCALE = 10  # decimeters
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+_MILLISECOND = timedelta(milliseconds=1)
+
+_INT16_MIN = np.iinfo(np.int16).min
+_INT16_MAX = np.iinfo(np.int16).max
+_INT32_MIN = np.iinfo(np.int32).min
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+class TraceSegmentCodec:
+    @staticmethod
+    def encode(
+        points: MultiPoint,
+        capture_times: list[datetime | None] | None,
+        elevations: list[float | None] | None,
+    ) -> bytes:
+        """
+        Encode the segment points payload in the compact columnar format.
+
+        Coordinates are stored as delta-encoded int32 fixed-point numbers.
+        Capture times are stored as int32 millisecond deltas, falling back to seconds on large gaps.
+        Elevations are stored as int16 decimeter deltas, falling back to meters on large jumps.
+        Missing values are tracked with a bitmask.
+        """
+        coords = lib.get_coordinates(np.asarray(points, dtype=np.object_), False, False)
+        num_points: cython.Py_ssize_t = len(coords)
+        flags: cython.int = 0
+        parts: list[bytes] = []
+
+        # wrapping arithmetic makes the deltas lossless for any int32 values
+        fixed = np.round(coords * _COORD_SCALE).astype(np.int32)
+        parts.append(_deltas(fixed[:, 0]).tobytes())
+        parts.append(_deltas(fixed[:, 1]).tobytes())
+
+        if capture_times is not None:
+            mask = np.fromiter((t is not None for t in capture_times), np.bool_, num_points)
+            values = np.fromiter(
+                ((t - _EPOCH) // _MILLISECOND for t in capture_times if t is not None),
+                np.int64,
+            )
+            if values.size:
+                flags |= _FLAG_TIMES
+                if values.size < num_points:
+                    flags |= _FLAG_TIMES_PARTIAL
+                    parts.append(np.packbits(mask).tobytes())
+                time_deltas = np.diff(values)
+                if time_deltas.size and (time_deltas.min() < _INT32_MIN or time_deltas.max() > _INT32_MAX):
+                    flags |= _FLAG_TIMES_SECONDS
+                    values //= 1000
+                    time_deltas = np.diff(values)
+                parts.append(values[:1].tobytes())
+                # clamp the deltas of garbage timestamps (over 68 years apart)
+                parts.append(np.clip(time_deltas, _INT32_MIN, _INT32_MAX).astype(np.int32).tobytes())
+
+        if elevations is not None:
+            mask = np.fromiter((e is not None for e in elevations), np.bool_, num_points)
+            values = np.round(
+                np.fromiter((e for e in elevations if e is not None), np.float64) * _ELEVATION_SCALE
+            ).astype(np.int64)
+            if values.size:
+                flags |= _FLAG_ELEVATIONS
+                if values.size < num_points:
+                    flags |= _FLAG_ELEVATIONS_PARTIAL
+                    parts.append(np.packbits(mask).tobytes())
+                elevation_deltas = np.diff(values)
+                if elevation_deltas.size and (
+                    elevation_deltas.min() < _INT16_MIN or elevation_deltas.max() > _INT16_MAX
+                ):
+                    flags |= _FLAG_ELEVATIONS_METERS
+                    values = np.round(values / _ELEVATION_SCALE).astype(np.int64)
+                    elevation_deltas = np.diff(values)
+                parts.append(np.clip(values[:1], _INT32_MIN, _INT32_MAX).astype(np.int32).tobytes())
+                # clamp the deltas of garbage elevations (over 32 km apart)
+                parts.append(np.clip(elevation_deltas, _INT16_MIN, _INT16_MAX).astype(np.int16).tobytes())
+
+        return _HEADER.pack(_VERSION, flags, num_points) + b''.join(parts)
+
+    @staticmethod
+    def decode(
+        data: bytes,
+    ) -> tuple[NDArray[np.float64], NDArray[np.float64] | None, NDArray[np.float64] | None]:
+        """
+        Decode the compact segment points payload.
+
+        Returns a tuple of (coordinates, capture times in epoch milliseconds, elevations).
+        Missing capture times and elevations are NaN.
+        """
+        flags, num_points, offset = _read_header(data)
+        coords = _read_coords(data, num_points, offset)
+        offset += num_points * 8
+
+        capture_times = None
+        if flags & _FLAG_TIMES:
+            mask, offset = _read_mask(data, offset, num_points, flags & _FLAG_TIMES_PARTIAL)
+            num_values = int(mask.sum()) if mask is not None else num_points
+            base = np.frombuffer(data, np.int64, 1, offset)
+            offset += base.nbytes
+            deltas = np.frombuffer(data, np.int32, num_values - 1, offset)
+            offset += deltas.nbytes
+            values = np.empty(num_values, np.float64)
+            values[0] = base[0]
+            values[1:] = base[0] + np.cumsum(deltas, dtype=np.int64)
+            if flags & _FLAG_TIMES_SECONDS:
+                values *= 1000
+            capture_times = _unmask(values, mask)
+
+        elevations = None
+        if flags & _FLAG_ELEVATIONS:
+            mask, offset = _read_mask(data, offset, num_points, flags & _FLAG_ELEVATIONS_PARTIAL)
+            num_values = int(mask.sum()) if mask is not None else num_points
+            base = np.frombuffer(data, np.int32, 1, offset)
+            offset += base.nbytes
+            deltas = np.frombuffer(data, np.int16, num_values - 1, offset)
+            offset += deltas.nbytes
+            values = np.empty(num_values, np.float64)
+            values[0] = base[0]
+            values[1:] = base[0] + np.cumsum(deltas, dtype=np.int64)
+            if not flags & _FLAG_ELEVATIONS_METERS:
+                values /= _ELEVATION_SCALE
+            elevations = _unmask(values, mask)
+
+        return coords, capture_times, elevations
+
+    @staticmethod
+    def decode_coords(data: bytes) -> NDArray[np.float64]:
+        """
+        Decode only the coordinates of the compact segment points payload.
+        """
+        _, num_points, offset = _read_header(data)
+        return _read_coords(data, num_points, offset)
+
+    @staticmethod
+    def decode_objects(
+        data: bytes,
+    ) -> tuple[MultiPoint, list[datetime | None] | None, list[float | None] | None]:
+        """
+        Decode the compact segment points payload into the TraceSegment attributes.
+        """
+        coords, capture_times, elevations = TraceSegmentCodec.decode(data)
+        points: MultiPoint = multipoints(coords)  # pyright: ignore[reportAssignmentType]
+
+        capture_times_: list[datetime | None] | None = None
+        if capture_times is not None:
+            capture_times_ = [
+                None if isnan(t) else (_EPOCH + timedelta(milliseconds=t))  #
+                for t in capture_times.tolist()
+            ]
+
+        elevations_: list[float | None] | None = None
+        if elevations is not None:
+            mask = np.isnan(elevations)
+            elevations_ = np.where(mask, None, elevations).tolist() if mask.any() else elevations.tolist()
+
+        return points, capture_times_, elevations_
+
+    @staticmethod
+    def bounds(points: MultiPoint) -> Polygon:
+        """
+        Get the bounding box of the segment points, for the spatial index.
+
+        Degenerate boxes are padded to keep the polygon valid.
+        """
+        minx, miny, maxx, maxy = points.bounds
+        pad = 1 / _COORD_SCALE
+        return box(minx, miny, max(maxx, minx + pad), max(maxy, miny + pad))
+
+
+@cython.cfunc
+def _read_header(data: bytes) -> tuple[int, int, int]:
+    """
+    Read the payload header.
+
+    Returns a tuple of (flags, number of points, header size).
+    """
+    version = data[0]
+    if version == _VERSION:
+        header = _HEADER
+    elif version == 1:
+        header = _HEADER_V1
+    else:
+        raise NotImplementedError(f'Unsupported trace segment data version {version}')
+    _, flags, num_points = header.unpack_from(data)
+    return flags, num_points, header.size
+
+
+@cython.cfunc
+def _read_coords(data: bytes, num_points: cython.Py_ssize_t, offset: cython.Py_ssize_t) -> NDArray[np.float64]:
+    deltas = np.frombuffer(data, np.int32, num_points * 2, offset).reshape(2, num_points)
+    coords = np.cumsum(deltas, axis=1, dtype=np.int32).T / _COORD_SCALE
+    return coords
+
+
+@cython.cfunc
+def _deltas(values: NDArray[np.int32]) -> NDArray[np.int32]:
+    result = np.empty_like(values)
+    if values.size:
+        result[0] = values[0]
+        np.subtract(values[1:], values[:-1], out=result[1:])
+    return result
+
+
+@cython.cfunc
+def _read_mask(
+    data: bytes,
+    offset: cython.Py_ssize_t,
+    num_points: cython.Py_ssize_t,
+    partial: cython.bint,
+) -> tuple[NDArray[np.bool_] | None, int]:
+    if not partial:
+        return None, offset
+    size = (num_points + 7) // 8
+    mask = np.unpackbits(np.frombuffer(data, np.uint8, size, offset), count=num_points).view(np.bool_)
+    return mask, offset + size
+
+
+@cython.cfunc
+def _unmask(values: NDArray[np.float64], mask: NDArray[np.bool_] | None) -> NDArray[np.float64]:
+    if mask is None:
+        return values
+    result = np.full(len(mask), np.nan, np.float64)
+    result[mask] = values
+    return result
@@ -20,6 +20,9 @@ CACHE_DEFAULT_EXPIRE = timedelta(days=3)
 CACHE_COMPRESS_MIN_SIZE = 512
 CACHE_COMPRESS_ZSTD_LEVEL = 1
 CACHE_COMPRESS_ZSTD_THREADS = 0  # disabled
+CACHE_LOCAL_EXPIRE = timedelta(minutes=1)
+CACHE_LOCAL_MAX_SIZE = 1024  # per process
+CACHE_LOCAL_MAX_VALUE_SIZE = 4 * _kb
 
 CHANGESET_IDLE_TIMEOUT = timedelta(hours=1)
 CHANGESET_OPEN_TIMEOUT = timedelta(days=1)
@@ -65,11 +68,19 @@ ELEMENT_RELATION_MEMBERS_LIMIT = 32_000
 
 FEATURE_PREFIX_TAGS_LIMIT = 100
 
+FILE_CACHE_CLEANUP_BATCH_SIZE = 1000
+FILE_CACHE_CLEANUP_INTERVAL = timedelta(minutes=5)
+
 FIND_LIMIT = 100
 
 GEO_COORDINATE_PRECISION = 7
 
 GRAVATAR_CACHE_EXPIRE = timedelta(days=1)
+GRAVATAR_CACHE_STALE = timedelta(days=30)  # served while refreshing in the background
+GRAVATAR_NOT_FOUND_CACHE_EXPIRE = timedelta(days=3)
+
+IMAGE_NORMALIZE_WORKERS = 2  # per process
+IMAGE_ENCODE_WORKERS = 4  # per process
 
 ISSUE_COMMENT_BODY_MAX_LENGTH = 5_000  # NOTE: value TBD
 
@@ -81,6 +92,21 @@ MAIL_UNPROCESSED_EXPIRE = timedelta(days=3)
 
 MAP_QUERY_AREA_MAX_SIZE = 0.25  # in square degrees
 MAP_QUERY_LEGACY_NODES_LIMIT = 50_000
+MAP_QUERY_PAGE_NODES_LIMIT = 10_000
+MAP_QUERY_CURSOR_EXPIRE = timedelta(minutes=10)
+MAP_TILE_CACHE_ZOOM = 16
+MAP_TILE_CACHE_EXPIRE = timedelta(minutes=10)
+MAP_TILE_CACHE_MAX_TILES = 4096  # per process
+MAP_TILE_CACHE_MAX_QUERY_TILES = 64
+MAP_TILE_CACHE_INVALIDATE_MAX_ELEMENTS = 10_000  # above, all tiles are invalidated
+MAP_TILE_CACHE_INVALIDATE_MAX_TILES = 1024  # above, all tiles are invalidated
+MAP_TILE_MVT_MIN_ZOOM = 14
+MAP_TILE_MVT_MAX_ZOOM = 19
+MAP_TILE_MVT_EXTENT = 4096
+MAP_TILE_MVT_BUFFER = 64
+MAP_TILE_MVT_NODES_LIMIT = 50_000
+MAP_TILE_MVT_CACHE_MAX_AGE = timedelta(minutes=1)
+MAP_TILE_MVT_CACHE_STALE = timedelta(minutes=5)
 
 MESSAGE_SUBJECT_MAX_LENGTH = 100
 MESSAGE_BODY_MAX_LENGTH = 50_000  # NOTE: value TBD
@@ -116,6 +142,9 @@ OAUTH_PAT_NAME_MAX_LENGTH = 50
 OAUTH_PAT_LIMIT = 100
 OAUTH_SECRET_PREVIEW_LENGTH = 7
 OAUTH_SILENT_AUTH_QUERY_SESSION_LIMIT = 10
+OAUTH_TOKEN_CACHE_EXPIRE = timedelta(minutes=10)
+OAUTH_TOKEN_CACHE_LOCAL_EXPIRE = timedelta(seconds=5)  # other processes' invalidations apply after this delay
+OAUTH_TOKEN_CACHE_LOCAL_MAX_SIZE = 10_000  # per process
 
 OPENID_DISCOVERY_CACHE_EXPIRE = timedelta(hours=8)
 OPENID_DISCOVERY_HTTP_TIMEOUT = timedelta(seconds=10)
@@ -129,6 +158,8 @@ QUERY_FEATURES_RESULTS_LIMIT = 50
 # TODO: check pwned passwords
 EMAIL_MIN_LENGTH = 5
 PASSWORD_MIN_LENGTH = 6
+PASSWORD_HASH_POOL_WORKERS = 2
+PASSWORD_HASH_POOL_MAX_PENDING = 32  # per process, additional requests are rejected
 ACTIVE_SESSIONS_DISPLAY_LIMIT = 100
 
 REPORT_BODY_MAX_LENGTH = 50_000  # NOTE: value TBD
@@ -136,6 +167,10 @@ REPORT_BODY_MAX_LENGTH = 50_000  # NOTE: value TBD
 RICH_TEXT_CACHE_EXPIRE = timedelta(hours=8)
 
 S3_CACHE_EXPIRE = timedelta(days=1)
+S3_MAX_POOL_CONNECTIONS = 32  # per process
+S3_MULTIPART_THRESHOLD = 16 * _mb
+S3_MULTIPART_PART_SIZE = 8 * _mb  # S3 requires at least 5 MiB
+S3_READ_CHUNK_SIZE = 64 * _kb
 
 SEARCH_LOCAL_AREA_LIMIT = 100  # in square degrees
 SEARCH_LOCAL_MAX_ITERATIONS = 7
@@ -153,8 +188,17 @@ TRACE_FILE_UNCOMPRESSED_MAX_SIZE = 80 * _mb
 TRACE_FILE_ARCHIVE_MAX_FILES = 10
 TRACE_FILE_MAX_LAYERS = 2
 TRACE_FILE_COMPRESS_ZSTD_THREADS = 0  # disabled
-# TODO: background task to recompress files on disk
-TRACE_FILE_COMPRESS_ZSTD_LEVEL = 1
+TRACE_FILE_COMPRESS_ZSTD_LEVEL = 1  # recompressed in the background, see TraceService.recompress_files
+TRACE_FILE_RECOMPRESS_ZSTD_LEVEL = 19
+
+TRACE_PREVIEW_MAX_POINTS = 100
+TRACE_PREVIEW_RESOLUTION = 90  # in pixels
+
+TRACE_PROCESSING_LEASE = timedelta(minutes=5)
+TRACE_PROCESSING_POLL_INTERVAL = timedelta(seconds=10)
+TRACE_PROCESSING_PROGRESS_INTERVAL = timedelta(seconds=2)
+TRACE_PROCESSING_MAX_ATTEMPTS = 5
+TRACE_PROCESSING_RETRY_EXPONENT = 2  # 1 min, 4 mins, 9 mins, etc.
 
 TRACE_POINT_QUERY_AREA_MAX_SIZE = 0.25  # in square degrees
 TRACE_POINT_QUERY_DEFAULT_LIMIT = 5_000
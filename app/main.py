@@ -21,7 +21,10 @@ from app.config import (
     TEST_ENV,
 )
 from app.lib.bun_packages import ID_VERSION, RAPID_VERSION
+from app.lib.file_cache import FileCache
+from app.lib.password_hash import PasswordHash
 from app.lib.starlette_convertor import ElementTypeConvertor
+from app.lib.storage.s3 import S3Storage
 from app.lib.user_name_blacklist import user_name_blacklist_routes
 from app.limits import (
     COMPRESS_HTTP_BROTLI_QUALITY,
@@ -50,6 +53,7 @@ from app.services.changeset_service import ChangesetService
 from app.services.email_service import EmailService
 from app.services.system_app_service import SystemAppService
 from app.services.test_service import TestService
+from app.services.trace_service import TraceService
 
 # set the timezone to UTC
 # note that "export TZ=UTC" from shell.nix is unreliable for some users
@@ -85,7 +89,14 @@ async def lifespan(_):
         await TestService.on_startup()
 
     await SystemAppService.on_startup()
-    async with EmailService.context(), ChangesetService.context():
+    async with (
+        EmailService.context(),
+        ChangesetService.context(),
+        TraceService.context(),
+        PasswordHash.context(),
+        FileCache.context(),
+        S3Storage.context(),
+    ):
         yield
 
 
@@ -3,7 +3,7 @@ from typing import Literal, get_args
 
 import numpy as np
 from numpy.typing import NDArray
-from sqlalchemy import ARRAY, ColumnElement, Enum, ForeignKey, Index, Integer, Unicode, true
+from sqlalchemy import ARRAY, ColumnElement, Enum, ForeignKey, Index, Integer, Unicode, UnicodeText, true
 from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
 from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
 
@@ -16,6 +16,7 @@ from app.models.scope import Scope
 from app.models.types import StorageKey
 
 TraceVisibility = Literal['identifiable', 'public', 'trackable', 'private']
+TraceStatus = Literal['pending', 'imported', 'failed']
 
 
 class Trace(Base.Sequential, CreatedAtMixin, UpdatedAtMixin):
@@ -32,6 +33,7 @@ class Trace(Base.Sequential, CreatedAtMixin, UpdatedAtMixin):
 
     size: Mapped[int] = mapped_column(Integer, nullable=False)
     file_id: Mapped[StorageKey] = mapped_column(Unicode(STORAGE_KEY_MAX_LENGTH), init=False, nullable=False)
+    preview_line: Mapped[str | None] = mapped_column(UnicodeText, init=False, nullable=True)
 
     # defaults
     tags: Mapped[list[str]] = mapped_column(
@@ -39,6 +41,12 @@ class Trace(Base.Sequential, CreatedAtMixin, UpdatedAtMixin):
         nullable=False,
         server_default='{}',
     )
+    status: Mapped[TraceStatus] = mapped_column(
+        Enum(*get_args(TraceStatus), name='trace_status'),
+        init=False,
+        nullable=False,
+        server_default='pending',
+    )
 
     # runtime
     coords: NDArray[np.number] = None  # pyright: ignore[reportAssignmentType]
@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from sqlalchemy import REAL, ForeignKey, Index, SmallInteger, UnicodeText
+from sqlalchemy.dialects.postgresql import TIMESTAMP
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+from app.models.db.base import Base
+from app.models.db.created_at_mixin import CreatedAtMixin
+from app.models.db.trace_ import Trace
+
+
+class TraceJob(Base.NoID, CreatedAtMixin):
+    __tablename__ = 'trace_job'
+
+    trace_id: Mapped[int] = mapped_column(
+        ForeignKey(Trace.id, ondelete='CASCADE'),
+        nullable=False,
+        primary_key=True,
+    )
+    trace: Mapped[Trace] = relationship(init=False, lazy='raise', innerjoin=True)
+
+    # defaults
+    processing_counter: Mapped[int] = mapped_column(
+        SmallInteger,
+        init=False,
+        nullable=False,
+        server_default='0',
+    )
+    processing_at: Mapped[datetime | None] = mapped_column(
+        TIMESTAMP(True),
+        init=False,
+        nullable=True,
+        server_default=None,
+    )
+    progress: Mapped[float] = mapped_column(
+        REAL,
+        init=False,
+        nullable=False,
+        server_default='0',
+    )
+    error: Mapped[str | None] = mapped_column(
+        UnicodeText,
+        init=False,
+        nullable=True,
+        server_default=None,
+    )
+
+    __table_args__ = (Index('trace_job_processing_at_idx', processing_at),)
@@ -1,13 +1,14 @@
 from datetime import datetime
 
-from shapely import MultiPoint
-from sqlalchemy import ARRAY, REAL, ForeignKey, Index, PrimaryKeyConstraint, SmallInteger
+from shapely import MultiPoint, Polygon
+from sqlalchemy import ARRAY, REAL, ForeignKey, Index, LargeBinary, PrimaryKeyConstraint, SmallInteger
 from sqlalchemy.dialects.postgresql import TIMESTAMP
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, mapped_column, reconstructor, relationship
 
+from app.lib.trace_segment_codec import TraceSegmentCodec
 from app.models.db.base import Base
 from app.models.db.trace_ import Trace
-from app.models.geometry import MultiPointType
+from app.models.geometry import MultiPointType, PolygonType
 
 
 class TraceSegment(Base.NoID):
@@ -18,17 +19,53 @@ class TraceSegment(Base.NoID):
     track_num: Mapped[int] = mapped_column(SmallInteger, nullable=False)
     segment_num: Mapped[int] = mapped_column(SmallInteger, nullable=False)
 
-    points: Mapped[MultiPoint] = mapped_column(MultiPointType, nullable=False)
-    capture_times: Mapped[list[datetime | None] | None] = mapped_column(
-        ARRAY(TIMESTAMP(True), dimensions=1), nullable=True
+    bounds: Mapped[Polygon | None] = mapped_column(PolygonType, init=False, nullable=True)
+    data: Mapped[bytes | None] = mapped_column(LargeBinary, init=False, nullable=True)
+    """Points payload in the compact columnar format, see TraceSegmentCodec."""
+
+    # legacy points payload, converted by MigrationService.migrate_trace_segments
+    legacy_points: Mapped[MultiPoint | None] = mapped_column('points', MultiPointType, init=False, nullable=True)
+    legacy_capture_times: Mapped[list[datetime | None] | None] = mapped_column(
+        'capture_times', ARRAY(TIMESTAMP(True), dimensions=1), init=False, nullable=True
+    )
+    legacy_elevations: Mapped[list[float | None] | None] = mapped_column(
+        'elevations', ARRAY(REAL, dimensions=1), init=False, nullable=True
     )
-    elevations: Mapped[list[float | None] | None] = mapped_column(ARRAY(REAL, dimensions=1), nullable=True)
+
+    # runtime
+    points: MultiPoint
+    capture_times: list[datetime | None] | None
+    elevations: list[float | None] | None
 
     __table_args__ = (
         PrimaryKeyConstraint(trace_id, track_num, segment_num),
+        Index(
+            'trace_segment_bounds_idx',
+            bounds,
+            postgresql_using='gist',
+        ),
         Index(
             'trace_segment_points_idx',
-            points,
+            legacy_points,
             postgresql_using='gist',
         ),
     )
+
+    def encode_data(self) -> None:
+        """
+        Encode the runtime points attributes into the stored columns.
+
+        Must be called before persisting a new segment.
+        """
+        self.bounds = TraceSegmentCodec.bounds(self.points)
+        self.data = TraceSegmentCodec.encode(self.points, self.capture_times, self.elevations)
+
+    @reconstructor
+    def _init_on_load(self) -> None:
+        data = self.data
+        if data is not None:
+            self.points, self.capture_times, self.elevations = TraceSegmentCodec.decode_objects(data)
+        else:
+            self.points = self.legacy_points  # pyright: ignore[reportAttributeAccessIssue]
+            self.capture_times = self.legacy_capture_times
+            self.elevations = self.legacy_elevations
@@ -150,6 +150,9 @@ class User(Base.Sequential, CreatedAtMixin, RichTextMixin):
         init=False,
     )
 
+    # runtime
+    cached_is_test_user: bool | None = None
+
     __table_args__ = (
         Index('user_email_idx', email, unique=True),
         Index('user_display_name_idx', display_name, unique=True),
@@ -171,6 +174,9 @@ class User(Base.Sequential, CreatedAtMixin, RichTextMixin):
         """
         Check if the user is a test user.
         """
+        # cached snapshots don't include the email, see OAuth2TokenCacheService
+        if self.cached_is_test_user is not None:
+            return self.cached_is_test_user
         return self.email.endswith('@' + TEST_USER_DOMAIN)
 
     @property
@@ -1,7 +1,7 @@
 from collections.abc import Sequence
 from typing import Annotated
 
-from pydantic import PositiveInt
+from pydantic import NonNegativeInt, PositiveInt
 
 from app.models.db.base import Base
 from app.models.db.trace_ import TraceVisibility
@@ -16,7 +16,7 @@ class TraceValidating(Base.Validating):
     description: Str255
     visibility: TraceVisibility
 
-    size: PositiveInt
+    size: NonNegativeInt
 
     # defaults
     tags: Sequence[Annotated[Str255, UrlSafeValidator]] = ()
@@ -1,4 +1,3 @@
-from asyncio import TaskGroup
 from collections.abc import Collection, Iterable, Sequence
 
 import cython
@@ -6,6 +5,7 @@ from sqlalchemy import Select, func, select, text, union_all
 
 from app.db import db
 from app.lib.options_context import apply_options_context
+from app.lib.rich_text import resolve_rich_text_many
 from app.lib.standard_pagination import standard_pagination_range
 from app.limits import CHANGESET_COMMENTS_PAGE_SIZE
 from app.models.db.changeset import Changeset
@@ -114,6 +114,4 @@ class ChangesetCommentQuery:
             changeset.num_comments = len(changeset.comments)  # pyright: ignore[reportArgumentType]
 
         if resolve_rich_text:
-            async with TaskGroup() as tg:
-                for comment in comments:
-                    tg.create_task(comment.resolve_rich_text())
+            await resolve_rich_text_many(comments)
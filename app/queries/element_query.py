@@ -5,14 +5,19 @@ from itertools import chain
 from typing import Literal
 
 import cython
+import numpy as np
+from shapely import lib
 from shapely.geometry.base import BaseGeometry
-from sqlalchemy import Select, and_, func, null, or_, select, text, true, union_all
+from sqlalchemy import Select, Subquery, and_, func, null, or_, select, text, true, union
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import aliased
 
 from app.config import LEGACY_SEQUENCE_ID_MARGIN
 from app.db import db
 from app.lib.bundle import NamespaceBundle
 from app.lib.exceptions_context import raise_for
-from app.limits import MAP_QUERY_LEGACY_NODES_LIMIT
+from app.lib.geo_utils import tile_bounds
+from app.limits import MAP_QUERY_LEGACY_NODES_LIMIT, MAP_TILE_MVT_BUFFER, MAP_TILE_MVT_EXTENT
 from app.models.db.element import Element
 from app.models.db.element_member import ElementMember
 from app.models.element import ElementId, ElementRef, ElementType, VersionedElementRef
@@ -25,6 +30,10 @@ class ElementQuery:
         """
         Get the current sequence id.
 
+        Concurrent diffs may commit out of the sequence order, so the snapshots at this sequence id
+        are best-effort: a smaller sequence id may still be committed shortly after.
+        Writes never rely on them, the optimistic diff re-checks the element state under locks.
+
         Returns 0 if no elements exist.
         """
         async with db() as session:
@@ -32,31 +41,6 @@ class ElementQuery:
             sequence_id = await session.scalar(stmt)
             return sequence_id if (sequence_id is not None) else 0
 
-    @staticmethod
-    async def get_current_ids() -> dict[ElementType, ElementId]:
-        """
-        Get the last id for each element type.
-
-        Returns 0 if no elements exist with the given type.
-        """
-        async with db() as session:
-            stmts = tuple(
-                select(Element.type, Element.id)  #
-                .where(Element.type == type)
-                .order_by(Element.id.desc())
-                .limit(1)
-                for type in ('node', 'way', 'relation')
-            )
-            rows: Iterable[tuple[ElementType, ElementId]] = (await session.execute(union_all(*stmts))).all()  # pyright: ignore[reportAssignmentType]
-            return dict(
-                (
-                    ('node', ElementId(0)),
-                    ('way', ElementId(0)),
-                    ('relation', ElementId(0)),
-                    *rows,
-                )
-            )
-
     @staticmethod
     async def check_is_latest(versioned_refs: Collection[VersionedElementRef]) -> bool:
         """
@@ -86,20 +70,24 @@ class ElementQuery:
             return await session.scalar(stmt) is None
 
     @staticmethod
-    async def check_is_unreferenced(member_refs: Collection[ElementRef], after_sequence_id: int) -> bool:
+    async def check_is_unreferenced(
+        member_refs: Collection[ElementRef],
+        exclude_parent_refs: Collection[ElementRef],
+    ) -> bool:
         """
         Check if the given elements are currently unreferenced.
 
-        after_sequence_id is used as an optimization.
+        References from exclude_parent_refs are ignored, as they are resolved locally.
         """
         if not member_refs:
             return True
 
         async with db() as session:
             stmt = (
-                select(text('1'))
+                select(Element.type, Element.id)
+                .join_from(ElementMember, Element, ElementMember.sequence_id == Element.sequence_id)
                 .where(
-                    ElementMember.sequence_id > after_sequence_id,
+                    Element.next_sequence_id == null(),
                     or_(
                         *(
                             and_(
@@ -110,9 +98,10 @@ class ElementQuery:
                         ),
                     ),
                 )
-                .limit(1)
+                .distinct()
             )
-            return await session.scalar(stmt) is None
+            rows: Iterable[tuple[ElementType, ElementId]] = (await session.execute(stmt)).all()  # pyright: ignore[reportAssignmentType]
+            return all(ElementRef(type, id) in exclude_parent_refs for type, id in rows)
 
     @staticmethod
     async def filter_visible_refs(
@@ -566,6 +555,7 @@ class ElementQuery:
         nodes_limit: int | None,
         legacy_nodes_limit: bool = False,
         resolve_all_members: bool = False,
+        single_query: bool = False,
     ) -> list[Element]:
         """
         Find elements within the given geometry.
@@ -577,6 +567,8 @@ class ElementQuery:
         - nodes' ways' relations -- if include_relations
         - nodes' relations -- if include_relations
 
+        If single_query is True, the elements are found with a single CTE-based statement.
+
         Results are deduplicated.
         """
         if legacy_nodes_limit:
@@ -584,6 +576,22 @@ class ElementQuery:
                 raise ValueError('nodes_limit must be ==MAP_QUERY_NODES_LEGACY_LIMIT when legacy_nodes_limit is True')
             nodes_limit += 1  # to detect limit exceeded
 
+        if single_query:
+            elements = await _find_many_by_geom_single_query(
+                geometry,
+                partial_ways=partial_ways,
+                include_relations=include_relations,
+                nodes_limit=nodes_limit,
+            )
+            if legacy_nodes_limit and elements:
+                # way nodes outside the geometry are not counted
+                points = np.asarray([element.point for element in elements if element.type == 'node'], np.object_)
+                if np.count_nonzero(lib.intersects(geometry, points)) > MAP_QUERY_LEGACY_NODES_LIMIT:
+                    raise_for.map_query_nodes_limit_exceeded()
+            if resolve_all_members:
+                await ElementMemberQuery.resolve_members([element for element in elements if element.type != 'node'])
+            return elements
+
         # find all the matching nodes
         async with db() as session:
             await session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
@@ -611,64 +619,207 @@ class ElementQuery:
         if legacy_nodes_limit and len(nodes) > MAP_QUERY_LEGACY_NODES_LIMIT:
             raise_for.map_query_nodes_limit_exceeded()
 
-        nodes_refs = tuple(ElementRef('node', node.id) for node in nodes)
-        result_sequences: list[Iterable[Element]] = [nodes]
+        return await _find_related_by_nodes(
+            nodes,
+            at_sequence_id=at_sequence_id,
+            partial_ways=partial_ways,
+            include_relations=include_relations,
+            resolve_all_members=resolve_all_members,
+        )
 
-        async with TaskGroup() as tg:
+    @staticmethod
+    async def find_many_by_geom_page(
+        geometry: BaseGeometry,
+        *,
+        at_sequence_id: int | None,
+        after_node_id: int | None,
+        nodes_limit: int,
+    ) -> tuple[list[Element], int, int | None]:
+        """
+        Find a page of elements within the given geometry, as of the given sequence id.
 
-            async def fetch_parents(
-                element_refs: Collection[ElementRef],
-                parent_type: ElementType,
-            ) -> tuple[Sequence[Element], Awaitable[None] | None]:
-                parents = await ElementQuery.get_parents_by_refs(
-                    element_refs,
-                    at_sequence_id=at_sequence_id,
-                    parent_type=parent_type,
-                    limit=None,
+        The nodes are paginated by id and the related elements are returned like in find_many_by_geom.
+        Related elements may repeat between pages.
+
+        If at_sequence_id is None, the current sequence id is used.
+
+        Returns a tuple of (elements, at_sequence_id, after_node_id of the next page or None).
+        """
+        async with db() as session:
+            if at_sequence_id is None:
+                await session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+                stmt = select(func.max(Element.sequence_id))
+                at_sequence_id = await session.scalar(stmt)
+                if at_sequence_id is None:
+                    return [], 0, None
+
+            where_geom = (
+                Element.type == 'node',
+                Element.visible == true(),
+                func.ST_Intersects(Element.point, func.ST_GeomFromText(geometry.wkt, 4326)),
+                *((Element.id > after_node_id,) if (after_node_id is not None) else ()),
+            )
+
+            # index stores only the current nodes
+            stmt = (
+                _select()
+                .where(
+                    Element.next_sequence_id == null(),
+                    Element.sequence_id <= at_sequence_id,
+                    *where_geom,
                 )
-                result_sequences.append(parents)
-                if resolve_all_members:
-                    return parents, tg.create_task(ElementMemberQuery.resolve_members(parents))
-                else:
-                    return parents, None
-
-            async def way_task() -> None:
-                # fetch parent ways
-                ways, resolve_t = await fetch_parents(nodes_refs, 'way')
-
-                # fetch ways' parent relations
-                if include_relations:
-                    ways_refs = tuple(ElementRef('way', way.id) for way in ways)
-                    tg.create_task(fetch_parents(ways_refs, 'relation'))
-
-                # fetch ways' nodes
-                if not partial_ways:
-                    if resolve_t is None:
-                        resolve_t = ElementMemberQuery.resolve_members(ways)
-                    await resolve_t
-                    members_refs = {ElementRef('node', node.id) for way in ways for node in way.members}  # pyright: ignore[reportOptionalIterable]
-                    members_refs.difference_update(nodes_refs)
-                    ways_nodes = await ElementQuery.get_by_refs(
-                        members_refs,
-                        at_sequence_id=at_sequence_id,
-                        limit=len(members_refs),
-                    )
-                    result_sequences.append(ways_nodes)
+                .order_by(Element.id)
+                .limit(nodes_limit + 1)
+            )
+            nodes = list((await session.scalars(stmt)).all())
+
+            # nodes modified after the snapshot are found through their newer versions
+            newer = aliased(Element)
+            stmt_prev = (
+                select(Element.sequence_id)
+                .join(
+                    newer,
+                    and_(
+                        newer.type == Element.type,
+                        newer.id == Element.id,
+                        newer.sequence_id == Element.next_sequence_id,
+                    ),
+                )
+                .where(
+                    newer.sequence_id > at_sequence_id,
+                    newer.type == 'node',
+                    Element.sequence_id <= at_sequence_id,
+                )
+            )
+            stmt = (
+                _select()
+                .where(Element.sequence_id.in_(stmt_prev), *where_geom)
+                .order_by(Element.id)
+                .limit(nodes_limit + 1)
+            )
+            if prev_nodes := (await session.scalars(stmt)).all():
+                nodes.extend(prev_nodes)
+                nodes.sort(key=lambda node: node.id)
+
+        next_after_node_id: int | None = None
+        if len(nodes) > nodes_limit:
+            del nodes[nodes_limit:]
+            next_after_node_id = nodes[-1].id
+        if not nodes:
+            return [], at_sequence_id, None
+
+        elements = await _find_related_by_nodes(
+            nodes,
+            at_sequence_id=at_sequence_id,
+            partial_ways=False,
+            include_relations=True,
+            resolve_all_members=False,
+        )
+        return elements, at_sequence_id, next_after_node_id
 
-            tg.create_task(way_task())
-            if include_relations:
-                tg.create_task(fetch_parents(nodes_refs, 'relation'))
+    @staticmethod
+    async def get_mvt_tile(z: int, x: int, y: int, *, nodes_limit: int) -> bytes:
+        """
+        Render the current elements within the given web mercator tile as a Mapbox Vector Tile.
 
-        # remove duplicates and preserve order
-        result_set: set[int] = set()
-        result: list[Element] = []
-        for elements in result_sequences:
-            for element in elements:
-                element_sequence_id = element.sequence_id
-                if element_sequence_id not in result_set:
-                    result_set.add(element_sequence_id)
-                    result.append(element)
-        return result
+        The tile contains the "nodes" and "ways" layers, with the element ids as the feature ids.
+        Like the web map rendering, only the interesting nodes are included and relations are skipped.
+        """
+        # match the nodes within the tile buffer, so that the ways crossing the tile edges connect
+        minx, miny, maxx, maxy = tile_bounds(x, y, z)
+        buffer_ratio: cython.double = MAP_TILE_MVT_BUFFER / MAP_TILE_MVT_EXTENT
+        buffer_x: cython.double = (maxx - minx) * buffer_ratio
+        buffer_y: cython.double = (maxy - miny) * buffer_ratio
+        envelope = func.ST_TileEnvelope(z, x, y)
+
+        # index stores only the current nodes
+        nodes_cte = (
+            select(Element.id, Element.tags, Element.point)
+            .where(
+                Element.next_sequence_id == null(),
+                Element.visible == true(),
+                Element.type == 'node',
+                Element.point.op('&&')(
+                    func.ST_MakeEnvelope(minx - buffer_x, miny - buffer_y, maxx + buffer_x, maxy + buffer_y, 4326)
+                ),
+            )
+            .limit(nodes_limit + 1)
+            .cte('nodes')
+            .prefix_with('MATERIALIZED')
+        )
+        nodes_count = select(func.count()).select_from(nodes_cte).scalar_subquery()
+        ways_cte = (
+            select(Element.sequence_id, Element.id)
+            .where(
+                Element.sequence_id.in_(
+                    select(ElementMember.sequence_id)
+                    .where(ElementMember.type == 'node', ElementMember.id.in_(select(nodes_cte.c.id)))
+                    .distinct()
+                ),
+                Element.type == 'way',
+                Element.next_sequence_id == null(),
+            )
+            .cte('ways')
+            .prefix_with('MATERIALIZED')
+        )
+
+        member_nodes_ids = select(ElementMember.id).where(
+            ElementMember.sequence_id.in_(select(ways_cte.c.sequence_id)),
+            ElementMember.type == 'node',
+        )
+        nodes_geom = func.ST_AsMVTGeom(
+            func.ST_Transform(nodes_cte.c.point, 3857),
+            envelope,
+            MAP_TILE_MVT_EXTENT,
+            MAP_TILE_MVT_BUFFER,
+        )
+        nodes_layer = (
+            select(nodes_cte.c.id, nodes_geom.label('geom'))
+            .where(
+                nodes_count <= nodes_limit,
+                or_(nodes_cte.c.tags != text("'{}'::jsonb"), nodes_cte.c.id.not_in(member_nodes_ids)),
+            )
+            .subquery('nodes_layer')
+        )
+
+        # the ways' nodes are not limited to the tile, their lines are clipped by ST_AsMVTGeom
+        way_node = aliased(Element)
+        ways_lines = (
+            select(
+                ways_cte.c.id,
+                func.ST_MakeLine(aggregate_order_by(way_node.point, ElementMember.order)).label('line'),
+            )
+            .select_from(ways_cte)
+            .join(ElementMember, ElementMember.sequence_id == ways_cte.c.sequence_id)
+            .join(
+                way_node,
+                and_(
+                    way_node.type == 'node',
+                    way_node.id == ElementMember.id,
+                    way_node.next_sequence_id == null(),
+                    way_node.visible == true(),
+                ),
+            )
+            .where(nodes_count <= nodes_limit, ElementMember.type == 'node')
+            .group_by(ways_cte.c.id)
+            .subquery('ways_lines')
+        )
+        ways_geom = func.ST_AsMVTGeom(
+            func.ST_Transform(ways_lines.c.line, 3857),
+            envelope,
+            MAP_TILE_MVT_EXTENT,
+            MAP_TILE_MVT_BUFFER,
+        )
+        ways_layer = select(ways_lines.c.id, ways_geom.label('geom')).subquery('ways_layer')
+
+        # layers are concatenated into a single tile
+        stmt = select(nodes_count, _mvt_layer(nodes_layer, 'nodes').op('||')(_mvt_layer(ways_layer, 'ways')))
+        async with db() as session:
+            count, tile = (await session.execute(stmt)).one()
+
+        if count > nodes_limit:
+            raise_for.map_query_nodes_limit_exceeded()
+        return tile
 
     @staticmethod
     async def get_last_visible_sequence_id(element: Element) -> int | None:
@@ -692,6 +843,169 @@ class ElementQuery:
             return await session.scalar(stmt)
 
 
+async def _find_many_by_geom_single_query(
+    geometry: BaseGeometry,
+    *,
+    partial_ways: bool,
+    include_relations: bool,
+    nodes_limit: int | None,
+) -> list[Element]:
+    """
+    Find the current elements within the given geometry and their related elements in a single statement.
+    """
+    # index stores only the current nodes
+    nodes_stmt = select(Element.sequence_id, Element.id).where(
+        Element.next_sequence_id == null(),
+        Element.visible == true(),
+        Element.type == 'node',
+        func.ST_Intersects(Element.point, func.ST_GeomFromText(geometry.wkt, 4326)),
+    )
+    if nodes_limit is not None:
+        nodes_stmt = nodes_stmt.limit(nodes_limit)
+    nodes_cte = nodes_stmt.cte('nodes').prefix_with('MATERIALIZED')
+    nodes_ids = select(nodes_cte.c.id).scalar_subquery()
+
+    ways_cte = (
+        select(Element.sequence_id, Element.id)
+        .where(
+            Element.sequence_id.in_(
+                select(ElementMember.sequence_id)
+                .where(ElementMember.type == 'node', ElementMember.id.in_(nodes_ids))
+                .distinct()
+            ),
+            Element.type == 'way',
+            Element.next_sequence_id == null(),
+        )
+        .cte('ways')
+        .prefix_with('MATERIALIZED')
+    )
+
+    parts: list[Select] = [select(nodes_cte.c.sequence_id), select(ways_cte.c.sequence_id)]
+
+    if not partial_ways:
+        parts.append(
+            select(Element.sequence_id).where(
+                Element.id.in_(
+                    select(ElementMember.id)
+                    .where(
+                        ElementMember.sequence_id.in_(select(ways_cte.c.sequence_id)),
+                        ElementMember.type == 'node',
+                    )
+                    .distinct()
+                ),
+                Element.type == 'node',
+                Element.next_sequence_id == null(),
+            )
+        )
+
+    if include_relations:
+        parts.append(
+            select(Element.sequence_id).where(
+                Element.sequence_id.in_(
+                    select(ElementMember.sequence_id)
+                    .where(
+                        or_(
+                            and_(ElementMember.type == 'node', ElementMember.id.in_(nodes_ids)),
+                            and_(ElementMember.type == 'way', ElementMember.id.in_(select(ways_cte.c.id))),
+                        )
+                    )
+                    .distinct()
+                ),
+                Element.type == 'relation',
+                Element.next_sequence_id == null(),
+            )
+        )
+
+    # union removes duplicates, such as the matched nodes referenced by the ways
+    stmt = _select().where(Element.sequence_id.in_(union(*parts)))
+    async with db() as session:
+        return list((await session.scalars(stmt)).all())
+
+
+async def _find_related_by_nodes(
+    nodes: Sequence[Element],
+    *,
+    at_sequence_id: int,
+    partial_ways: bool,
+    include_relations: bool,
+    resolve_all_members: bool,
+) -> list[Element]:
+    """
+    Find the nodes' related elements as of the given sequence id.
+
+    Results include the nodes and are deduplicated.
+    """
+    nodes_refs = tuple(ElementRef('node', node.id) for node in nodes)
+    result_sequences: list[Iterable[Element]] = [nodes]
+
+    async with TaskGroup() as tg:
+
+        async def fetch_parents(
+            element_refs: Collection[ElementRef],
+            parent_type: ElementType,
+        ) -> tuple[Sequence[Element], Awaitable[None] | None]:
+            parents = await ElementQuery.get_parents_by_refs(
+                element_refs,
+                at_sequence_id=at_sequence_id,
+                parent_type=parent_type,
+                limit=None,
+            )
+            result_sequences.append(parents)
+            if resolve_all_members:
+                return parents, tg.create_task(ElementMemberQuery.resolve_members(parents))
+            else:
+                return parents, None
+
+        async def way_task() -> None:
+            # fetch parent ways
+            ways, resolve_t = await fetch_parents(nodes_refs, 'way')
+
+            # fetch ways' parent relations
+            if include_relations:
+                ways_refs = tuple(ElementRef('way', way.id) for way in ways)
+                tg.create_task(fetch_parents(ways_refs, 'relation'))
+
+            # fetch ways' nodes
+            if not partial_ways:
+                if resolve_t is None:
+                    resolve_t = ElementMemberQuery.resolve_members(ways)
+                await resolve_t
+                members_refs = {ElementRef('node', node.id) for way in ways for node in way.members}  # pyright: ignore[reportOptionalIterable]
+                members_refs.difference_update(nodes_refs)
+                ways_nodes = await ElementQuery.get_by_refs(
+                    members_refs,
+                    at_sequence_id=at_sequence_id,
+                    limit=len(members_refs),
+                )
+                result_sequences.append(ways_nodes)
+
+        tg.create_task(way_task())
+        if include_relations:
+            tg.create_task(fetch_parents(nodes_refs, 'relation'))
+
+    # remove duplicates and preserve order
+    result_set: set[int] = set()
+    result: list[Element] = []
+    for elements in result_sequences:
+        for element in elements:
+            element_sequence_id = element.sequence_id
+            if element_sequence_id not in result_set:
+                result_set.add(element_sequence_id)
+                result.append(element)
+    return result
+
+
+@cython.cfunc
+def _mvt_layer(layer: Subquery, name: str):
+    # empty layers must not nullify the concatenated tile
+    return func.coalesce(
+        select(func.ST_AsMVT(layer.table_valued(), name, MAP_TILE_MVT_EXTENT, 'geom', 'id'))
+        .where(layer.c.geom != null())
+        .scalar_subquery(),
+        text("''::bytea"),
+    )
+
+
 @cython.cfunc
 def _select():
     bundle = NamespaceBundle(
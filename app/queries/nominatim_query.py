@@ -79,6 +79,7 @@ class NominatimQuery:
             context=_cache_context,
             factory=factory,
             ttl=NOMINATIM_CACHE_LONG_EXPIRE,
+            lock_lease=NOMINATIM_HTTP_SHORT_TIMEOUT,
         )
         response_entries = (orjson.loads(cache.value),)
         result = await _get_search_result(at_sequence_id=None, response_entries=response_entries)
@@ -156,6 +157,7 @@ async def _search(
             factory=factory,
             hash_key=True,
             ttl=NOMINATIM_CACHE_SHORT_EXPIRE,
+            lock_lease=NOMINATIM_HTTP_LONG_TIMEOUT,
         )
         response = cache.value
     else:
@@ -1,4 +1,3 @@
-from asyncio import TaskGroup
 from collections.abc import Collection, Iterable, Sequence
 from typing import Literal
 
@@ -9,6 +8,7 @@ from sqlalchemy import Select, func, select, text, union_all
 from app.db import db
 from app.lib.auth_context import auth_user
 from app.lib.options_context import apply_options_context
+from app.lib.rich_text import resolve_rich_text_many
 from app.lib.standard_pagination import standard_pagination_range
 from app.limits import NOTE_COMMENTS_PAGE_SIZE
 from app.models.db.note import Note
@@ -148,8 +148,6 @@ class NoteCommentQuery:
                 note.num_comments = len(note.comments)
 
         if resolve_rich_text:
-            async with TaskGroup() as tg:
-                for comment in comments:
-                    tg.create_task(comment.resolve_rich_text())
+            await resolve_rich_text_many(comments)
 
         return comments
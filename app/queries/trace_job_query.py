@@ -0,0 +1,15 @@
+from sqlalchemy import select
+
+from app.db import db
+from app.models.db.trace_job import TraceJob
+
+
+class TraceJobQuery:
+    @staticmethod
+    async def find_one_by_trace_id(trace_id: int) -> TraceJob | None:
+        """
+        Find a trace processing job by trace id.
+        """
+        async with db() as session:
+            stmt = select(TraceJob).where(TraceJob.trace_id == trace_id)
+            return await session.scalar(stmt)
@@ -1,4 +1,5 @@
 from collections.abc import Sequence
+from typing import IO
 
 from sqlalchemy import func, select, text
 
@@ -6,8 +7,8 @@ from app.db import db
 from app.lib.auth_context import auth_scopes, auth_user_scopes
 from app.lib.exceptions_context import raise_for
 from app.lib.options_context import apply_options_context
-from app.lib.trace_file import TraceFile
 from app.models.db.trace_ import Trace
+from app.models.types import StorageKey
 from app.storage import TRACES_STORAGE
 
 
@@ -32,18 +33,17 @@ class TraceQuery:
         return trace
 
     @staticmethod
-    async def get_one_data_by_id(trace_id: int) -> bytes:
+    async def open_one_data_by_id(trace_id: int) -> tuple[StorageKey, IO[bytes]]:
         """
-        Get a trace data file by id.
+        Open a trace data file by id, as stored.
 
         Raises if the trace is not visible to the current user.
 
-        Returns a tuple of (filename, file).
+        Returns a tuple of (file_id, file). The caller is responsible for closing the file.
         """
         trace = await TraceQuery.get_one_by_id(trace_id)
-        file_buffer = await TRACES_STORAGE.load(trace.file_id)
-        file_bytes = TraceFile.decompress_if_needed(file_buffer, trace.file_id)
-        return file_bytes
+        file_id = trace.file_id
+        return file_id, await TRACES_STORAGE.open(file_id)
 
     @staticmethod
     async def count_by_user_id(user_id: int) -> int:
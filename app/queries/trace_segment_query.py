@@ -2,17 +2,21 @@ from collections.abc import Collection, Sequence
 
 import cython
 import numpy as np
-from shapely import MultiPoint, STRtree, from_wkb, get_parts, lib, multipoints
+from numpy.typing import NDArray
+from shapely import MultiPoint, STRtree, get_parts, lib, multipoints
 from shapely.geometry.base import BaseGeometry
-from sqlalchemy import func, literal_column, select, text, union_all
-from sqlalchemy.sql.selectable import Select
+from sqlalchemy import and_, func, or_, select, tuple_
 
 from app.db import db
 from app.lib.mercator import mercator
 from app.lib.options_context import apply_options_context
+from app.lib.trace_segment_codec import TraceSegmentCodec
 from app.models.db.trace_ import Trace
 from app.models.db.trace_segment import TraceSegment
 
+# (trace_id, track_num, segment_num)
+TraceSegmentPosition = tuple[int, int, int]
+
 
 # TODO: limit offset for safety
 class TraceSegmentQuery:
@@ -46,98 +50,43 @@ class TraceSegmentQuery:
 
         Returns modified segments, containing only points within the geometry.
         """
-        visibility = ('identifiable', 'trackable') if identifiable_trackable else ('public', 'private')
+        segments = await _find_many_by_geometry(
+            geometry,
+            identifiable_trackable=identifiable_trackable,
+            after=None,
+            limit=limit,
+            legacy_offset=legacy_offset,
+        )
+        return _filter_segments(segments, geometry, identifiable_trackable=identifiable_trackable)
 
-        async with db() as session:
-            stmt = (
-                select(TraceSegment)
-                .join(TraceSegment.trace)
-                .where(
-                    func.ST_Intersects(TraceSegment.points, func.ST_GeomFromText(geometry.wkt, 4326)),
-                    Trace.visibility.in_(visibility),
-                )
-                .order_by(
-                    TraceSegment.trace_id.desc(),
-                    TraceSegment.track_num.asc(),
-                    TraceSegment.segment_num.asc(),
-                )
-            )
-            stmt = apply_options_context(stmt)
-            if legacy_offset is not None:
-                stmt = stmt.offset(legacy_offset)
-            if limit is not None:
-                stmt = stmt.limit(limit)
-            segments = (await session.scalars(stmt)).all()
-
-        if not segments:
-            return ()
-
-        # extract points and check for intersections
-        segments_points = tuple(segment.points for segment in segments)
-        segments_parts_ = get_parts(segments_points, return_index=True)
-        segments_parts = segments_parts_[0]
-        segments_indices = segments_parts_[1]
-        tree = STRtree((geometry,))
-        intersect_indices = tree.query(segments_parts, predicate='intersects')[0]
-        if not intersect_indices.size:
-            return ()
-
-        # filter non-intersecting points
-        segments_parts = segments_parts[intersect_indices]
-        segments_indices = segments_indices[intersect_indices]
-        split_indices = np.unique(segments_indices, return_index=True)[1][1:]
-        new_parts = np.split(segments_parts, split_indices)
-        new_parts_flat = np.concatenate(new_parts)
-
-        if identifiable_trackable:
-            # reconstruct multipoints
-            split_indices_ex = np.empty(len(split_indices) + 2, dtype=split_indices.dtype)
-            split_indices_ex[0] = 0
-            split_indices_ex[1:-1] = split_indices
-            split_indices_ex[-1] = len(segments_parts)
-            new_parts_sizes = split_indices_ex[1:] - split_indices_ex[:-1]
-            new_parts_max_size: np.signedinteger = new_parts_sizes.max()
-            new_parts_fixed = np.empty((len(new_parts), new_parts_max_size), dtype=np.object_)
-            mask = np.arange(new_parts_max_size) < new_parts_sizes[:, None]
-            new_parts_fixed[mask] = new_parts_flat
-            new_points_list: Sequence[MultiPoint] = multipoints(new_parts_fixed)  # pyright: ignore[reportAssignmentType]
-
-            # assign filtered multipoints and return
-            for segment, points in zip(segments, new_points_list, strict=True):
-                segment.points = points
-
-            # filter extra attributes
-            data_flat = np.empty_like(segments_parts_[0], dtype=np.object_)
-            data_lens = np.unique_counts(segments_parts_[1]).counts
-            data_i_stop = data_lens.cumsum()
-            data_i_start = data_i_stop - data_lens
-            dirty: cython.char = False
-            for attr_name in ('capture_times', 'elevations'):
-                if dirty:
-                    data_flat.fill(None)
-                    dirty = False
-                for segment, i_start, i_stop in zip(segments, data_i_start, data_i_stop, strict=True):
-                    if data := getattr(segment, attr_name):
-                        data_flat[i_start:i_stop] = data
-                        dirty = True
-                if dirty:
-                    new_data = np.split(data_flat[intersect_indices], split_indices)
-                    for segment, data in zip(segments, new_data, strict=True):
-                        setattr(segment, attr_name, data.tolist())
-
-            return segments
+    @staticmethod
+    async def find_many_by_geometry_page(
+        geometry: BaseGeometry,
+        *,
+        identifiable_trackable: bool,
+        after: TraceSegmentPosition | None,
+        limit: int,
+    ) -> tuple[Sequence[TraceSegment], TraceSegmentPosition | None]:
+        """
+        Find a page of trace segments by geometry, continuing after the given segment position.
+
+        Pages are resumed from the last position instead of an offset, so that the deep pages are as cheap as the first one.
+
+        Returns a tuple of (modified segments, position of the next page or None).
+        """
+        segments = await _find_many_by_geometry(
+            geometry,
+            identifiable_trackable=identifiable_trackable,
+            after=after,
+            limit=limit,
+            legacy_offset=None,
+        )
+        if len(segments) < limit:
+            next_after = None
         else:
-            # reconstruct dummy multipoint
-            new_points: MultiPoint = multipoints(new_parts_flat)  # pyright: ignore[reportAssignmentType]
-            return (
-                TraceSegment(
-                    track_num=0,
-                    segment_num=0,
-                    points=new_points,
-                    capture_times=None,
-                    elevations=None,
-                ),
-            )
+            last = segments[-1]
+            next_after = (last.trace_id, last.track_num, last.segment_num)
+        return _filter_segments(segments, geometry, identifiable_trackable=identifiable_trackable), next_after
 
     @staticmethod
     async def resolve_coords(
@@ -154,60 +103,178 @@ class TraceSegmentQuery:
             return
 
         async with db() as session:
-            stmts: list[Select] = [None] * len(traces)  # type: ignore
-            i: cython.int
-            for i, trace in enumerate(traces):
-                subq = (
-                    select(TraceSegment.points)
-                    .where(TraceSegment.trace_id == trace.id)
-                    .order_by(TraceSegment.track_num.asc(), TraceSegment.segment_num.asc())
-                    .subquery()
-                )
-                subq = (
-                    select(func.ST_Collect(subq.c.points).label('geom'))  #
-                    .select_from(subq)
-                    .subquery()
-                )
+            stmt = select(
+                TraceSegment.trace_id,
+                TraceSegment.data,
+                TraceSegment.legacy_points,
+            ).where(TraceSegment.trace_id.in_(trace_id_map))
+            if limit_per_trace == 1:
+                # only the first point is needed
+                stmt = stmt.distinct(TraceSegment.trace_id)
+            stmt = stmt.order_by(
+                TraceSegment.trace_id.asc(),
+                TraceSegment.track_num.asc(),
+                TraceSegment.segment_num.asc(),
+            )
+            rows = (await session.execute(stmt)).all()
+
+        trace_coords: dict[int, list[NDArray[np.float64]]] = {trace_id: [] for trace_id in trace_id_map}
+        for trace_id, data, legacy_points in rows:
+            trace_coords[trace_id].append(
+                TraceSegmentCodec.decode_coords(data)
+                if data is not None
+                else lib.get_coordinates(np.asarray(legacy_points, dtype=np.object_), False, False)
+            )
 
-                if trace.size > limit_per_trace:
-                    indices = np.round(np.linspace(1, trace.size, limit_per_trace)).astype(int)
-                    subq = (
-                        select(func.ST_DumpPoints(subq.c.geom).label('dp'))  #
-                        .select_from(subq)
-                        .subquery()
-                    )
-                    subq = (
-                        select(literal_column('(dp).geom').label('geom'))  #
-                        .select_from(subq)
-                        .subquery()
-                    )
-                    subq = (
-                        select(
-                            subq.c.geom,
-                            func.row_number().over().label('row_number'),
-                        )
-                        .select_from(subq)
-                        .subquery()
-                    )
-                    subq = (
-                        select(func.ST_Collect(subq.c.geom).label('geom'))  #
-                        .select_from(subq)
-                        .where(subq.c.row_number.in_(text(','.join(map(str, indices)))))
-                        .subquery()
-                    )
-
-                stmt_ = select(text(str(trace.id)), subq.c.geom).select_from(subq)
-                stmts[i] = stmt_
-
-            rows = (await session.execute(union_all(*stmts))).all()
-
-        for trace_id, wkb in rows:
-            trace = trace_id_map[trace_id]
-            geom = from_wkb(wkb)
-            coords = lib.get_coordinates(np.asarray(geom, dtype=np.object_), False, False)
+        for trace_id, trace in trace_id_map.items():
+            parts = trace_coords[trace_id]
+            coords = np.concatenate(parts) if parts else np.empty((0, 2), np.float64)
+            if len(coords) > limit_per_trace:
+                indices = np.round(np.linspace(1, len(coords), limit_per_trace)).astype(np.intp) - 1
+                coords = coords[indices]
             if resolution is not None:
                 if len(coords) < 2:
                     trace.coords = np.empty((0,), dtype=np.uint)
                     continue
                 coords = mercator(coords, resolution, resolution).astype(np.uint)
             trace.coords = coords
+
+
+async def _find_many_by_geometry(
+    geometry: BaseGeometry,
+    *,
+    identifiable_trackable: bool,
+    after: TraceSegmentPosition | None,
+    limit: int | None,
+    legacy_offset: int | None,
+) -> Sequence[TraceSegment]:
+    """
+    Find trace segments intersecting the geometry, ordered by trace id descending.
+    """
+    visibility = ('identifiable', 'trackable') if identifiable_trackable else ('public', 'private')
+    geometry_wkt = func.ST_GeomFromText(geometry.wkt, 4326)
+
+    async with db() as session:
+        stmt = (
+            select(TraceSegment)
+            .join(TraceSegment.trace)
+            .where(
+                or_(
+                    func.ST_Intersects(TraceSegment.bounds, geometry_wkt),
+                    func.ST_Intersects(TraceSegment.legacy_points, geometry_wkt),
+                ),
+                Trace.visibility.in_(visibility),
+            )
+            .order_by(
+                TraceSegment.trace_id.desc(),
+                TraceSegment.track_num.asc(),
+                TraceSegment.segment_num.asc(),
+            )
+        )
+        if after is not None:
+            after_trace_id, after_track_num, after_segment_num = after
+            stmt = stmt.where(
+                or_(
+                    TraceSegment.trace_id < after_trace_id,
+                    and_(
+                        TraceSegment.trace_id == after_trace_id,
+                        tuple_(TraceSegment.track_num, TraceSegment.segment_num)
+                        > tuple_(after_track_num, after_segment_num),
+                    ),
+                )
+            )
+        stmt = apply_options_context(stmt)
+        if legacy_offset is not None:
+            stmt = stmt.offset(legacy_offset)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return (await session.scalars(stmt)).all()
+
+
+@cython.cfunc
+def _filter_segments(
+    segments: Sequence[TraceSegment],
+    geometry: BaseGeometry,
+    *,
+    identifiable_trackable: cython.char,
+) -> Sequence[TraceSegment]:
+    """
+    Filter the segments points to the ones within the geometry.
+
+    Non-identifiable segments are merged into a single anonymous segment.
+    """
+    if not segments:
+        return ()
+
+    # extract points and check for intersections
+    segments_points = tuple(segment.points for segment in segments)
+    segments_parts_ = get_parts(segments_points, return_index=True)
+    segments_parts = segments_parts_[0]
+    segments_indices = segments_parts_[1]
+    tree = STRtree((geometry,))
+    intersect_indices = tree.query(segments_parts, predicate='intersects')[0]
+    if not intersect_indices.size:
+        return ()
+
+    # filter non-intersecting points
+    segments_parts = segments_parts[intersect_indices]
+    segments_indices = segments_indices[intersect_indices]
+    present_indices, split_indices = np.unique(segments_indices, return_index=True)
+    split_indices = split_indices[1:]
+
+    # filter segments with only the bounding box intersecting
+    all_segments = segments
+    if len(present_indices) < len(segments):
+        segments = [segments[i] for i in present_indices.tolist()]
+    new_parts = np.split(segments_parts, split_indices)
+    new_parts_flat = np.concatenate(new_parts)
+
+    if identifiable_trackable:
+        # reconstruct multipoints
+        split_indices_ex = np.empty(len(split_indices) + 2, dtype=split_indices.dtype)
+        split_indices_ex[0] = 0
+        split_indices_ex[1:-1] = split_indices
+        split_indices_ex[-1] = len(segments_parts)
+        new_parts_sizes = split_indices_ex[1:] - split_indices_ex[:-1]
+        new_parts_max_size: np.signedinteger = new_parts_sizes.max()
+        new_parts_fixed = np.empty((len(new_parts), new_parts_max_size), dtype=np.object_)
+        mask = np.arange(new_parts_max_size) < new_parts_sizes[:, None]
+        new_parts_fixed[mask] = new_parts_flat
+        new_points_list: Sequence[MultiPoint] = multipoints(new_parts_fixed)  # pyright: ignore[reportAssignmentType]
+
+        # assign filtered multipoints and return
+        for segment, points in zip(segments, new_points_list, strict=True):
+            segment.points = points
+
+        # filter extra attributes
+        data_flat = np.empty_like(segments_parts_[0], dtype=np.object_)
+        data_lens = np.unique_counts(segments_parts_[1]).counts
+        data_i_stop = data_lens.cumsum()
+        data_i_start = data_i_stop - data_lens
+        dirty: cython.char = False
+        for attr_name in ('capture_times', 'elevations'):
+            if dirty:
+                data_flat.fill(None)
+                dirty = False
+            for segment, i_start, i_stop in zip(all_segments, data_i_start, data_i_stop, strict=True):
+                if data := getattr(segment, attr_name):
+                    data_flat[i_start:i_stop] = data
+                    dirty = True
+            if dirty:
+                new_data = np.split(data_flat[intersect_indices], split_indices)
+                for segment, data in zip(segments, new_data, strict=True):
+                    setattr(segment, attr_name, data.tolist())
+
+        return segments
+    else:
+        # reconstruct dummy multipoint
+        new_points: MultiPoint = multipoints(new_parts_flat)  # pyright: ignore[reportAssignmentType]
+        return (
+            TraceSegment(
+                track_num=0,
+                segment_num=0,
+                points=new_points,
+                capture_times=None,
+                elevations=None,
+            ),
+        )
@@ -1,11 +1,13 @@
 from collections import defaultdict
 from collections.abc import Collection, Sequence
+from typing import Literal, overload
 
 from shapely import Point
 from sqlalchemy import func, null, select, text
 
 from app.db import db
 from app.lib.auth_context import auth_user
+from app.lib.exceptions_context import raise_for
 from app.lib.options_context import apply_options_context
 from app.lib.user_name_blacklist import is_user_name_blacklisted
 from app.limits import NEARBY_USERS_RADIUS_METERS
@@ -26,6 +28,30 @@ class UserQuery:
             stmt = apply_options_context(stmt)
             return await session.scalar(stmt)
 
+    @staticmethod
+    @overload
+    async def find_one_auth_user() -> User | None: ...
+
+    @staticmethod
+    @overload
+    async def find_one_auth_user(*, required: Literal[True]) -> User: ...
+
+    @staticmethod
+    async def find_one_auth_user(*, required: bool = False) -> User | None:
+        """
+        Find the authenticated user, with all the columns loaded.
+
+        The authenticated user is a cached snapshot without the credentials and personal data.
+        """
+        user = auth_user(required=True) if required else auth_user()
+        if user is None:
+            return None
+        user_id = user.id
+        user = await UserQuery.find_one_by_id(user_id)
+        if user is None:
+            raise_for.user_not_found(user_id)
+        return user
+
     @staticmethod
     async def find_one_by_display_name(display_name: DisplayNameType) -> User | None:
         """
@@ -107,7 +133,7 @@ class UserQuery:
         """
         Check if an email is available.
         """
-        user = auth_user()
+        user = await UserQuery.find_one_auth_user()
         # check if the email is unchanged
         if user is not None and user.email == email:
             return True
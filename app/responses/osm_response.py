@@ -1,4 +1,4 @@
-from collections.abc import Callable, Mapping, Sequence
+from collections.abc import Callable, Iterator, Mapping, Sequence
 from functools import wraps
 from typing import Any, NoReturn, override
 
@@ -6,6 +6,7 @@ import cython
 import orjson
 from fastapi import APIRouter, Response
 from fastapi.dependencies.utils import get_dependant
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRoute
 from starlette.routing import request_response
 
@@ -97,6 +98,41 @@ class OSMResponse(Response):
         else:
             raise NotImplementedError(f'Unsupported osm format style {style!r}')
 
+    @classmethod
+    def serialize_elements_stream(cls, content: Mapping, elements_stream: Iterator[bytes]) -> StreamingResponse:
+        """
+        Serialize the content followed by the pre-encoded elements stream.
+
+        Only the document envelope is encoded upfront, the elements are sent as they are encoded.
+        """
+        style = format_style()
+
+        if style == 'json':
+            # the envelope ends with the empty elements array: ...,"elements":[]}
+            envelope = orjson.dumps(
+                {**_json_attributes, **content, 'elements': ()},
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z,
+            )
+            head = envelope[:-2]
+            tail = b']}'
+            media_type = 'application/json; charset=utf-8'
+
+        elif style in {'xml', 'gpx'}:
+            attributes = _xml_attributes if style == 'xml' else _gpx_attributes
+            envelope = XMLToDict.unparse({cls.xml_root: {**attributes, **content}}, raw=True)
+            tail = f'</{cls.xml_root}>'.encode()
+            if envelope.endswith(tail):
+                head = envelope[: -len(tail)]
+            else:
+                # root element was serialized as self-closing
+                head = envelope[:-2] + b'>'
+            media_type = 'application/xml; charset=utf-8' if style == 'xml' else 'application/gpx+xml; charset=utf-8'
+
+        else:
+            raise NotImplementedError(f'Unsupported osm stream format style {style!r}')
+
+        return StreamingResponse(_wrap_stream(head, elements_stream, tail), media_type=media_type)
+
 
 class OSMChangeResponse(OSMResponse):
     xml_root = 'osmChange'
@@ -147,3 +183,9 @@ def _get_serializing_endpoint(endpoint: Callable, response_class: type[OSMRespon
         return response_class.serialize(content)
 
     return serializing_endpoint
+
+
+def _wrap_stream(head: bytes, stream: Iterator[bytes], tail: bytes) -> Iterator[bytes]:
+    yield head
+    yield from stream
+    yield tail
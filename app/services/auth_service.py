@@ -1,17 +1,14 @@
 import logging
 
-from sqlalchemy.orm import joinedload
-
 from app.config import TEST_ENV
 from app.lib.exceptions_context import raise_for
-from app.lib.options_context import options_context
 from app.middlewares.request_context_middleware import get_request
 from app.models.db.oauth2_token import OAuth2Token
 from app.models.db.user import User
 from app.models.scope import PUBLIC_SCOPES, Scope
 from app.models.types import DisplayNameType
-from app.queries.oauth2_token_query import OAuth2TokenQuery
 from app.queries.user_query import UserQuery
+from app.services.oauth2_token_cache_service import OAuth2TokenCacheService
 
 # default scopes when using session auth
 _session_auth_scopes: tuple[Scope, ...] = (*PUBLIC_SCOPES, Scope.web_user)
@@ -109,8 +106,7 @@ class AuthService:
             param = get_request().cookies.get('auth')
             if param is None:
                 return None
-        with options_context(joinedload(OAuth2Token.user)):
-            token = await OAuth2TokenQuery.find_one_authorized_by_token(param)
+        token = await OAuth2TokenCacheService.find_one_authorized_by_token(param)
         if token is None:
             return None
         if token.authorized_at is None:
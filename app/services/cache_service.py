@@ -1,18 +1,27 @@
+import asyncio
 import logging
-from collections.abc import Awaitable, Callable
+from asyncio import CancelledError, Future, TaskGroup, current_task, get_running_loop
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Sequence
 from datetime import timedelta
+from time import monotonic
 from typing import NamedTuple, NewType
 
+import cython
 from sizestr import sizestr
 from zstandard import ZstdCompressor, ZstdDecompressor
 
 from app.db import valkey
+from app.lib.buffered_random import buffered_randbytes
 from app.lib.crypto import hash_bytes
 from app.limits import (
     CACHE_COMPRESS_MIN_SIZE,
     CACHE_COMPRESS_ZSTD_LEVEL,
     CACHE_COMPRESS_ZSTD_THREADS,
     CACHE_DEFAULT_EXPIRE,
+    CACHE_LOCAL_EXPIRE,
+    CACHE_LOCAL_MAX_SIZE,
+    CACHE_LOCAL_MAX_VALUE_SIZE,
 )
 
 CacheContext = NewType('CacheContext', str)
@@ -24,12 +33,46 @@ _COMPRESS = ZstdCompressor(
 ).compress
 _DECOMPRESS = ZstdDecompressor().decompress
 
+# release the lock only if it is still held by us
+_UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# interval for checking the result of the lock holder, in seconds
+_LOCK_POLL_INTERVAL = 0.05
+
+# log the hit rate every N lookups
+_STATS_LOG_INTERVAL = 10_000
+
 
 class CacheEntry(NamedTuple):
     id: bytes
     value: bytes
 
 
+class CacheStats(NamedTuple):
+    local_hits: int
+    hits: int
+    misses: int
+    coalesced: int
+
+
+class _LocalEntry(NamedTuple):
+    expires_at: float
+    value: bytes
+
+
+_local: OrderedDict[str, _LocalEntry] = OrderedDict()
+_inflight: dict[str, Future[bytes]] = {}
+_local_hits: cython.longlong = 0
+_hits: cython.longlong = 0
+_misses: cython.longlong = 0
+_coalesced: cython.longlong = 0
+
+
 class CacheService:
     @staticmethod
     async def get(
@@ -39,44 +82,273 @@ class CacheService:
         *,
         hash_key: bool = False,
         ttl: timedelta = CACHE_DEFAULT_EXPIRE,
+        lock_lease: timedelta | None = None,
     ) -> CacheEntry:
         """
         Get a value from the cache.
 
         If the value is not in the cache, call the async factory to obtain it.
+        Concurrent misses of the same key in this process share a single factory call.
+        With lock_lease, the factory call is also shared across processes, for up to the lease duration.
+        Small values are additionally cached in-process.
         """
-        if hash_key:
-            cache_id = hash_bytes(key)
-        elif isinstance(key, str):
-            cache_id = key.encode()
-        else:
-            cache_id = key
-
+        cache_id = _get_cache_id(key, hash_key=hash_key)
         cache_key = f'{context}:{cache_id.hex()}'
 
+        value = _get_local(cache_key)
+        if value is None:
+            value = await _get_single_flight(cache_key, factory, ttl, lock_lease, check=True)
+            _set_local(cache_key, value, ttl)
+
+        return CacheEntry(id=cache_id, value=value)
+
+    @staticmethod
+    async def get_many(
+        items: Sequence[tuple[str | bytes, CacheContext, Callable[[], Awaitable[bytes]]]],
+        *,
+        hash_key: bool = False,
+        ttl: timedelta = CACHE_DEFAULT_EXPIRE,
+    ) -> list[CacheEntry]:
+        """
+        Get multiple values from the cache, given as (key, context, factory) items.
+
+        The values not cached in-process are fetched in a single round trip.
+        The remaining misses call their factories concurrently, with the same guarantees as get.
+        Returns the entries in the order of the items.
+        """
+        cache_ids = [_get_cache_id(key, hash_key=hash_key) for key, _, _ in items]
+        cache_keys = [f'{context}:{cache_id.hex()}' for cache_id, (_, context, _) in zip(cache_ids, items, strict=True)]
+        values = [_get_local(cache_key) for cache_key in cache_keys]
+
+        # deduplicate the keys, preserving the order
+        factories: dict[str, Callable[[], Awaitable[bytes]]] = {
+            cache_key: factory
+            for cache_key, value, (_, _, factory) in zip(cache_keys, values, items, strict=True)
+            if value is None
+        }
+        if factories:
+            async with valkey() as conn:
+                values_stored: list[bytes | None] = await conn.mget(factories)
+
+            resolved: dict[str, bytes] = {}
+            for cache_key, value_stored in zip(factories, values_stored, strict=True):
+                if value_stored is not None:
+                    _count(_STAT_HIT)
+                    resolved[cache_key] = _decode_value(value_stored)
+
+            async with TaskGroup() as tg:
+                tasks = {
+                    cache_key: tg.create_task(_get_single_flight(cache_key, factory, ttl, None, check=False))
+                    for cache_key, factory in factories.items()
+                    if cache_key not in resolved
+                }
+            for cache_key, task in tasks.items():
+                resolved[cache_key] = task.result()
+
+            for cache_key, value in resolved.items():
+                _set_local(cache_key, value, ttl)
+            values = [
+                value if value is not None else resolved[cache_key]
+                for cache_key, value in zip(cache_keys, values, strict=True)
+            ]
+
+        return [
+            CacheEntry(id=cache_id, value=value)  # pyright: ignore[reportArgumentType]
+            for cache_id, value in zip(cache_ids, values, strict=True)
+        ]
+
+    @staticmethod
+    def get_stats() -> CacheStats:
+        """
+        Get the cache statistics of this process.
+        """
+        return CacheStats(local_hits=_local_hits, hits=_hits, misses=_misses, coalesced=_coalesced)
+
+
+async def _get_single_flight(
+    cache_key: str,
+    factory: Callable[[], Awaitable[bytes]],
+    ttl: timedelta,
+    lock_lease: timedelta | None,
+    *,
+    check: cython.char,
+) -> bytes:
+    """
+    Get the value from Valkey or create it, sharing the lookup with the concurrent callers of the same key.
+    """
+    global _coalesced
+
+    # join the in-flight lookup of the same key
+    while (future := _inflight.get(cache_key)) is not None:
+        try:
+            value = await asyncio.shield(future)
+        except CancelledError:
+            # retry if the lookup was cancelled, not us
+            if not future.cancelled() or current_task().cancelling():  # pyright: ignore[reportOptionalMemberAccess]
+                raise
+            continue
+        _coalesced += 1
+        return value
+
+    future = get_running_loop().create_future()
+    _inflight[cache_key] = future
+    try:
+        value = await _get_or_create(cache_key, factory, ttl, lock_lease, check=check)
+    except CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # mark as retrieved, there may be no waiters
+        raise
+    else:
+        future.set_result(value)
+    finally:
+        del _inflight[cache_key]
+
+    return value
+
+
+async def _get_or_create(
+    cache_key: str,
+    factory: Callable[[], Awaitable[bytes]],
+    ttl: timedelta,
+    lock_lease: timedelta | None,
+    *,
+    check: cython.char,
+) -> bytes:
+    value_stored: bytes | None = None
+    if check:
         async with valkey() as conn:
-            value_stored: bytes | None = await conn.get(cache_key)
+            value_stored = await conn.get(cache_key)
+        if value_stored is not None:
+            _count(_STAT_HIT)
+            return _decode_value(value_stored)
 
+    lock_key: str | None = None
+    lock_token = b''
+    if lock_lease is not None:
+        lock_key = f'lock:{cache_key}'
+        lock_token = buffered_randbytes(16)
+        async with valkey() as conn:
+            acquired = await conn.set(lock_key, lock_token, px=lock_lease, nx=True)
+        if not acquired:
+            value_stored = await _wait_for_lock(cache_key, lock_key, lock_lease)
             if value_stored is not None:
-                # on cache hit, decompress the value if needed (first byte is compression marker)
-                if value_stored[0] == 0xFF:
-                    value = _DECOMPRESS(value_stored[1:], allow_extra_data=False)
-                else:
-                    value = value_stored[1:]
+                _count(_STAT_HIT)
+                return _decode_value(value_stored)
+            # the lock holder failed or timed out, compute the value ourselves
+            lock_key = None
 
-            else:
-                # on cache miss, call the factory to generate the value and cache it
-                value = await factory()
+    try:
+        # on cache miss, call the factory to generate the value and cache it
+        _count(_STAT_MISS)
+        value = await factory()
 
-                if not isinstance(value, bytes):  # pyright: ignore[reportUnnecessaryIsInstance]
-                    raise TypeError(f'Cache factory returned {type(value)!r}, expected bytes')
+        if not isinstance(value, bytes):  # pyright: ignore[reportUnnecessaryIsInstance]
+            raise TypeError(f'Cache factory returned {type(value)!r}, expected bytes')
 
-                if len(value) >= CACHE_COMPRESS_MIN_SIZE:
-                    logging.debug('Compressing cache %r value of size %s', cache_key, sizestr(len(value)))
-                    value_stored = b'\xff' + _COMPRESS(value)
-                else:
-                    value_stored = b'\x00' + value
+        if len(value) >= CACHE_COMPRESS_MIN_SIZE:
+            logging.debug('Compressing cache %r value of size %s', cache_key, sizestr(len(value)))
+            value_stored = b'\xff' + _COMPRESS(value)
+        else:
+            value_stored = b'\x00' + value
 
-                await conn.set(cache_key, value_stored, ex=ttl, nx=True)
+        async with valkey() as conn:
+            await conn.set(cache_key, value_stored, ex=ttl, nx=True)
 
-        return CacheEntry(id=cache_id, value=value)
+    finally:
+        if lock_key is not None:
+            async with valkey() as conn:
+                await conn.eval(_UNLOCK_SCRIPT, 1, lock_key, lock_token)
+
+    return value
+
+
+async def _wait_for_lock(cache_key: str, lock_key: str, lock_lease: timedelta) -> bytes | None:
+    """
+    Wait for the lock holder to cache the value.
+
+    Returns None if the lock was released without a value, or the lease has expired.
+    """
+    deadline = monotonic() + lock_lease.total_seconds()
+    while monotonic() < deadline:
+        await asyncio.sleep(_LOCK_POLL_INTERVAL)
+        async with valkey() as conn, conn.pipeline() as pipe:
+            pipe.get(cache_key)
+            pipe.exists(lock_key)
+            value_stored, locked = await pipe.execute()
+        if value_stored is not None:
+            return value_stored
+        if not locked:
+            return None
+    return None
+
+
+@cython.cfunc
+def _get_cache_id(key: str | bytes, *, hash_key: cython.char) -> bytes:
+    if hash_key:
+        return hash_bytes(key)
+    if isinstance(key, str):
+        return key.encode()
+    return key
+
+
+@cython.cfunc
+def _get_local(cache_key: str) -> bytes | None:
+    local = _local.get(cache_key)
+    if local is None:
+        return None
+    if local.expires_at <= monotonic():
+        del _local[cache_key]
+        return None
+    _local.move_to_end(cache_key)
+    _count(_STAT_LOCAL_HIT)
+    return local.value
+
+
+@cython.cfunc
+def _set_local(cache_key: str, value: bytes, ttl: timedelta) -> None:
+    # only small values are cached in-process
+    if len(value) > CACHE_LOCAL_MAX_VALUE_SIZE:
+        return
+    _local[cache_key] = _LocalEntry(
+        expires_at=monotonic() + min(ttl, CACHE_LOCAL_EXPIRE).total_seconds(),
+        value=value,
+    )
+    _local.move_to_end(cache_key)
+    while len(_local) > CACHE_LOCAL_MAX_SIZE:
+        _local.popitem(last=False)
+
+
+@cython.cfunc
+def _decode_value(value_stored: bytes) -> bytes:
+    # decompress the value if needed (first byte is compression marker)
+    if value_stored[0] == 0xFF:
+        return _DECOMPRESS(value_stored[1:], allow_extra_data=False)
+    return value_stored[1:]
+
+
+_STAT_LOCAL_HIT = 0
+_STAT_HIT = 1
+_STAT_MISS = 2
+
+
+@cython.cfunc
+def _count(stat: cython.int) -> None:
+    global _local_hits, _hits, _misses
+    if stat == _STAT_LOCAL_HIT:
+        _local_hits += 1
+    elif stat == _STAT_HIT:
+        _hits += 1
+    else:
+        _misses += 1
+    total = _local_hits + _hits + _misses
+    if total % _STATS_LOG_INTERVAL == 0:
+        logging.info(
+            'Cache hit rate is %.1f%% (%d lookups, %.1f%% in-process, %d coalesced)',
+            (_local_hits + _hits) / total * 100,
+            total,
+            _local_hits / total * 100,
+            _coalesced,
+        )
@@ -0,0 +1,437 @@
+import asyncio
+import logging
+from asyncio import CancelledError, Future, current_task, get_running_loop
+from collections import OrderedDict
+from collections.abc import Collection, Iterable, Sequence
+from copy import copy
+from time import monotonic
+from typing import NamedTuple
+
+import cython
+import numpy as np
+from numpy.typing import NDArray
+from shapely import MultiPolygon, Point, Polygon, box, lib
+
+from app.db import valkey
+from app.lib.exceptions_context import raise_for
+from app.lib.geo_utils import tile_bounds, tile_xy
+from app.limits import (
+    MAP_QUERY_LEGACY_NODES_LIMIT,
+    MAP_TILE_CACHE_EXPIRE,
+    MAP_TILE_CACHE_INVALIDATE_MAX_ELEMENTS,
+    MAP_TILE_CACHE_INVALIDATE_MAX_TILES,
+    MAP_TILE_CACHE_MAX_QUERY_TILES,
+    MAP_TILE_CACHE_MAX_TILES,
+    MAP_TILE_CACHE_ZOOM,
+)
+from app.models.db.element import Element
+from app.models.element import ElementId, ElementRef
+from app.queries.element_member_query import ElementMemberQuery
+from app.queries.element_query import ElementQuery
+
+# mark the tiles with the next invalidation counter value, the marks never decrease
+_INVALIDATE_SCRIPT = """
+local counter = redis.call('INCR', KEYS[1])
+for i = 2, #KEYS do
+    redis.call('SET', KEYS[i], counter, 'EX', ARGV[1])
+end
+"""
+
+# invalidation counter, incremented after each committed change
+# unlike sequence ids, its order matches the commit order of the changes
+_COUNTER_KEY = f'element_tile:{MAP_TILE_CACHE_ZOOM}:counter'
+
+# invalidation mark of all the tiles, for the changes too large to invalidate individually
+_GENERATION_KEY = f'element_tile:{MAP_TILE_CACHE_ZOOM}:generation'
+
+# log the hit rate every N tile lookups
+_STATS_LOG_INTERVAL = 1000
+
+
+class _TileEntry(NamedTuple):
+    at_counter: int
+    """Invalidation counter read before loading the tile."""
+    expires_at: float
+    nodes: list[Element]
+    """Nodes within the tile."""
+    nodes_coords: NDArray[np.float64]
+    elements: list[Element]
+    """Nodes within the tile and their related elements, with members resolved."""
+
+
+_tiles: OrderedDict[tuple[int, int], _TileEntry] = OrderedDict()
+_loading: dict[tuple[int, int], Future[_TileEntry]] = {}
+_hits: cython.longlong = 0
+_misses: cython.longlong = 0
+
+
+class ElementTileCacheService:
+    @staticmethod
+    async def find_many_by_geom(
+        geometry: Polygon | MultiPolygon,
+        *,
+        partial_ways: bool = False,
+        include_relations: bool = True,
+        nodes_limit: int | None,
+        legacy_nodes_limit: bool = False,
+    ) -> list[Element]:
+        """
+        Find elements within the given geometry, assembled from the cached map tiles.
+
+        Semantics match ElementQuery.find_many_by_geom, except that all members are resolved.
+        Large geometries bypass the cache.
+        """
+        polygons: Sequence[Polygon] = geometry.geoms if isinstance(geometry, MultiPolygon) else (geometry,)
+        polygons_tiles = [_cover_tiles(polygon.bounds) for polygon in polygons]
+        if sum(len(tiles) for tiles in polygons_tiles) > MAP_TILE_CACHE_MAX_QUERY_TILES:
+            elements = await ElementQuery.find_many_by_geom(
+                geometry,
+                partial_ways=partial_ways,
+                include_relations=include_relations,
+                nodes_limit=nodes_limit,
+                legacy_nodes_limit=legacy_nodes_limit,
+            )
+            await ElementMemberQuery.resolve_members(elements)
+            return elements
+
+        # collect the nodes within the geometry, deduplicated by id (tiles share edges)
+        nodes_map: dict[ElementId, Element] = {}
+        pool: list[Element] = []
+        for polygon, tiles in zip(polygons, polygons_tiles, strict=True):
+            # load each polygon separately, the tiles may be on both sides of the antimeridian
+            entries = await _get_tiles(tiles)
+            minx, miny, maxx, maxy = polygon.bounds
+            for tile in tiles:
+                entry = entries[tile]
+                pool.extend(entry.elements)
+                if not entry.nodes:
+                    continue
+                xs = entry.nodes_coords[:, 0]
+                ys = entry.nodes_coords[:, 1]
+                mask = (xs >= minx) & (xs <= maxx) & (ys >= miny) & (ys <= maxy)
+                for i in np.flatnonzero(mask).tolist():
+                    node = entry.nodes[i]
+                    nodes_map.setdefault(node.id, node)
+
+        if not nodes_map:
+            return []
+
+        nodes = list(nodes_map.values())
+        if legacy_nodes_limit:
+            if nodes_limit != MAP_QUERY_LEGACY_NODES_LIMIT:
+                raise ValueError('nodes_limit must be ==MAP_QUERY_NODES_LEGACY_LIMIT when legacy_nodes_limit is True')
+            if len(nodes) > MAP_QUERY_LEGACY_NODES_LIMIT:
+                raise_for.map_query_nodes_limit_exceeded()
+        elif nodes_limit is not None:
+            del nodes[nodes_limit:]
+
+        result = _select_related(nodes, pool, partial_ways=partial_ways, include_relations=include_relations)
+        return [_copy_element(element) for element in result]
+
+    @staticmethod
+    async def invalidate(element_refs: Collection[ElementRef], points: Collection[Point]) -> None:
+        """
+        Invalidate the cached map tiles containing the given points, and the tiles caching the given elements.
+
+        Tiles also cache the related elements of their nodes, so changed elements are invalidated
+        in the tiles of all nodes of their ways, parent ways, and relation members.
+        Must be called after the change is committed, the tiles loaded before will be refreshed on the next access.
+        Large changes invalidate all the tiles instead, keeping the invalidation cost bounded.
+        """
+        keys: list[str] | None = None
+        related_points = await _get_related_points(element_refs)
+        if related_points is not None:
+            points = [*points, *related_points]
+            if not points:
+                return
+            coords = lib.get_coordinates(np.asarray(points, np.object_), False, False)
+            tiles = np.unique(tile_xy(coords, MAP_TILE_CACHE_ZOOM), axis=0).tolist()
+            if len(tiles) <= MAP_TILE_CACHE_INVALIDATE_MAX_TILES:
+                keys = [_tile_key(x, y) for x, y in tiles]
+
+        if keys is None:
+            logging.info('Invalidating all element map tiles')
+            keys = [_GENERATION_KEY]
+        else:
+            logging.debug('Invalidating %d element map tiles', len(keys))
+        async with valkey() as conn:
+            await conn.eval(
+                _INVALIDATE_SCRIPT,
+                len(keys) + 1,
+                _COUNTER_KEY,
+                *keys,
+                int(MAP_TILE_CACHE_EXPIRE.total_seconds()),
+            )
+
+    @staticmethod
+    def get_stats() -> tuple[int, int]:
+        """
+        Get the tile cache statistics of this process.
+
+        Returns a tuple of (hits, misses).
+        """
+        return _hits, _misses
+
+
+async def _get_tiles(tiles: Sequence[tuple[int, int]]) -> dict[tuple[int, int], _TileEntry]:
+    """
+    Get the tile entries, loading the missing, expired, and invalidated tiles.
+    """
+    global _hits, _misses
+
+    async with valkey() as conn:
+        marks: list[bytes | None] = await conn.mget(
+            [*(_tile_key(x, y) for x, y in tiles), _GENERATION_KEY, _COUNTER_KEY]
+        )
+
+    counter = marks.pop()
+    max_counter = int(counter) if counter is not None else 0
+    generation = marks.pop()
+    min_counter = int(generation) if generation is not None else 0
+    now = monotonic()
+    result: dict[tuple[int, int], _TileEntry] = {}
+    missing: dict[tuple[int, int], int] = {}
+    for tile, mark in zip(tiles, marks, strict=True):
+        tile_min_counter = max(min_counter, int(mark)) if mark is not None else min_counter
+        entry = _tiles.get(tile)
+        if (
+            entry is not None
+            and entry.expires_at > now
+            and tile_min_counter <= entry.at_counter <= max_counter  # counter may be lost and restarted
+        ):
+            _tiles.move_to_end(tile)
+            result[tile] = entry
+        else:
+            missing[tile] = tile_min_counter
+
+    hits: cython.Py_ssize_t = len(result)
+    misses: cython.Py_ssize_t = len(missing)
+    if (_hits + _misses) // _STATS_LOG_INTERVAL != (_hits + _misses + hits + misses) // _STATS_LOG_INTERVAL:
+        total = _hits + _misses + hits + misses
+        logging.info('Element tile cache hit rate is %.1f%% (%d lookups)', (_hits + hits) / total * 100, total)
+    _hits += hits
+    _misses += misses
+
+    if missing:
+        result.update(await _load_tiles_single_flight(missing))
+    return result
+
+
+async def _load_tiles_single_flight(tiles: dict[tuple[int, int], int]) -> dict[tuple[int, int], _TileEntry]:
+    """
+    Load the tiles, sharing the loads with the concurrent callers of the same tiles.
+
+    The tiles are given with the minimum invalidation counter their entries must be up to date with.
+    """
+    result: dict[tuple[int, int], _TileEntry] = {}
+    joined: dict[tuple[int, int], Future[_TileEntry]] = {}
+    owned: list[tuple[int, int]] = []
+    for tile in tiles:
+        future = _loading.get(tile)
+        if future is not None:
+            joined[tile] = future
+        else:
+            owned.append(tile)
+
+    if owned:
+        loop = get_running_loop()
+        futures = {tile: loop.create_future() for tile in owned}
+        _loading.update(futures)
+        try:
+            entries = await _load_tiles(owned)
+        except CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except BaseException as e:
+            for future in futures.values():
+                future.set_exception(e)
+                future.exception()  # mark as retrieved, there may be no waiters
+            raise
+        else:
+            for tile, future in futures.items():
+                future.set_result(entries[tile])
+            result.update(entries)
+        finally:
+            for tile in owned:
+                del _loading[tile]
+
+    # reload the joined tiles if the shared load was cancelled or started before the invalidation
+    reload: list[tuple[int, int]] = []
+    for tile, future in joined.items():
+        try:
+            entry = await asyncio.shield(future)
+        except CancelledError:
+            if not future.cancelled() or current_task().cancelling():  # pyright: ignore[reportOptionalMemberAccess]
+                raise
+            reload.append(tile)
+            continue
+        if entry.at_counter < tiles[tile]:
+            reload.append(tile)
+        else:
+            result[tile] = entry
+    if reload:
+        result.update(await _load_tiles(reload))
+
+    return result
+
+
+async def _load_tiles(tiles: Sequence[tuple[int, int]]) -> dict[tuple[int, int], _TileEntry]:
+    """
+    Load the tiles from the database with a single query over their bounding box.
+    """
+    # the changes invalidated up to this counter are committed and visible to the query below
+    async with valkey() as conn:
+        counter: bytes | None = await conn.get(_COUNTER_KEY)
+    at_counter = int(counter) if counter is not None else 0
+    tiles_bounds = [tile_bounds(x, y, MAP_TILE_CACHE_ZOOM) for x, y in tiles]
+    bounds = np.array(tiles_bounds, np.float64)
+    geometry = box(bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max())
+
+    pool = await ElementQuery.find_many_by_geom(geometry, nodes_limit=None)
+    await ElementMemberQuery.resolve_members(pool)
+
+    pool_nodes = [element for element in pool if element.type == 'node' and element.point is not None]
+    pool_coords = (
+        lib.get_coordinates(np.asarray([node.point for node in pool_nodes], np.object_), False, False)
+        if pool_nodes
+        else np.empty((0, 2), np.float64)
+    )
+    pool_tiles = tile_xy(pool_coords, MAP_TILE_CACHE_ZOOM)
+
+    expires_at = monotonic() + MAP_TILE_CACHE_EXPIRE.total_seconds()
+    result: dict[tuple[int, int], _TileEntry] = {}
+    for x, y in tiles:
+        indices = np.flatnonzero((pool_tiles[:, 0] == x) & (pool_tiles[:, 1] == y)).tolist()
+        nodes = [pool_nodes[i] for i in indices]
+        entry = _TileEntry(
+            at_counter=at_counter,
+            expires_at=expires_at,
+            nodes=nodes,
+            nodes_coords=pool_coords[indices],
+            elements=_select_related(nodes, pool, partial_ways=False, include_relations=True),
+        )
+        result[x, y] = _tiles[x, y] = entry
+        _tiles.move_to_end((x, y))
+
+    while len(_tiles) > MAP_TILE_CACHE_MAX_TILES:
+        _tiles.popitem(last=False)
+
+    return result
+
+
+async def _get_related_points(element_refs: Collection[ElementRef]) -> list[Point] | None:
+    """
+    Get the current points of the nodes whose tiles may cache the given elements.
+
+    Previous points of the changed elements must be provided separately.
+    Returns None if there are more than MAP_TILE_CACHE_INVALIDATE_MAX_ELEMENTS related elements.
+    """
+    limit = MAP_TILE_CACHE_INVALIDATE_MAX_ELEMENTS
+    if len(element_refs) > limit:
+        return None
+
+    node_refs = [ref for ref in element_refs if ref.type == 'node']
+    way_refs = {ref for ref in element_refs if ref.type == 'way'}
+    relation_refs = [ref for ref in element_refs if ref.type == 'relation']
+
+    # changed nodes are cached along with the other nodes of their ways
+    if node_refs:
+        parents_map = await ElementQuery.get_parents_refs_by_refs(node_refs, limit=limit + 1)
+        if sum(len(parents) for parents in parents_map.values()) > limit:
+            return None
+        way_refs.update(ref for parents in parents_map.values() for ref in parents if ref.type == 'way')
+
+    # changed relations are cached in the tiles of their members
+    refs: set[ElementRef] = {*node_refs, *way_refs}
+    if relation_refs:
+        relations = await ElementQuery.get_by_refs(relation_refs, limit=None)
+        await ElementMemberQuery.resolve_members(relations)
+        refs.update(
+            ElementRef(member.type, member.id)
+            for relation in relations
+            for member in relation.members  # pyright: ignore[reportOptionalIterable]
+            if member.type != 'relation'
+        )
+    if len(refs) > limit:
+        return None
+
+    elements = await ElementQuery.get_by_refs(refs, recurse_ways=True, limit=limit + 1)
+    if len(elements) > limit:
+        return None
+    return [element.point for element in elements if element.point is not None]
+
+
+@cython.cfunc
+def _cover_tiles(bounds: tuple[float, float, float, float]) -> list[tuple[int, int]]:
+    """
+    Get the tiles covering the given bounds.
+    """
+    minx, miny, maxx, maxy = bounds
+    (x1, y1), (x2, y2) = tile_xy(np.array(((minx, maxy), (maxx, miny)), np.float64), MAP_TILE_CACHE_ZOOM).tolist()
+    return [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+
+
+@cython.cfunc
+def _select_related(
+    nodes: Sequence[Element],
+    pool: Iterable[Element],
+    *,
+    partial_ways: cython.char,
+    include_relations: cython.char,
+) -> list[Element]:
+    """
+    Select the nodes and their related elements from the pool, like ElementQuery.find_many_by_geom.
+
+    The pool elements must have their members resolved. The newest version of each element is selected.
+    """
+    pool_map: dict[tuple[str, ElementId], Element] = {}
+    for element in pool:
+        key = (element.type, element.id)
+        current = pool_map.get(key)
+        if current is None or current.version < element.version:
+            pool_map[key] = element
+
+    node_ids = {node.id for node in nodes}
+    ways = [
+        element
+        for (type, _), element in pool_map.items()
+        if type == 'way' and any(member.id in node_ids for member in element.members)  # pyright: ignore[reportOptionalIterable]
+    ]
+    result: list[Element] = [*nodes, *ways]
+
+    if not partial_ways:
+        ways_node_ids = {member.id for way in ways for member in way.members}  # pyright: ignore[reportOptionalIterable]
+        ways_node_ids.difference_update(node_ids)
+        result.extend(
+            node
+            for node_id in ways_node_ids  #
+            if (node := pool_map.get(('node', node_id))) is not None
+        )
+
+    if include_relations:
+        ways_ids = {way.id for way in ways}
+        result.extend(
+            element
+            for (type, _), element in pool_map.items()
+            if type == 'relation'
+            and any(
+                (member.type == 'node' and member.id in node_ids) or (member.type == 'way' and member.id in ways_ids)
+                for member in element.members  # pyright: ignore[reportOptionalIterable]
+            )
+        )
+
+    return result
+
+
+@cython.cfunc
+def _copy_element(element: Element) -> Element:
+    """
+    Copy the cached element, so that the callers can safely modify it.
+    """
+    return copy(element)
+
+
+@cython.cfunc
+def _tile_key(x: int, y: int) -> str:
+    return f'element_tile:{MAP_TILE_CACHE_ZOOM}:{x}:{y}'
@@ -1,11 +1,17 @@
-from sqlalchemy import func, select
+from itertools import groupby
 
-from app.db import db_commit
+from sqlalchemy import func, null, select, update
+
+from app.db import db, db_commit
+from app.lib.trace_preview import encode_trace_preview
+from app.lib.trace_segment_codec import TraceSegmentCodec
 from app.models.db import *  # noqa: F403
 from app.models.db.changeset import Changeset
 from app.models.db.element import Element
 from app.models.db.note import Note
 from app.models.db.note_comment import NoteComment
+from app.models.db.trace_ import Trace
+from app.models.db.trace_segment import TraceSegment
 from app.models.db.user import User
 
 
@@ -22,7 +28,92 @@ class MigrationService:
             await session.execute(stmt)
             stmt = select(func.setval('element_sequence_id_seq', func.max(Element.sequence_id)))
             await session.execute(stmt)
+            for type in ('node', 'way', 'relation'):
+                stmt = select(func.setval(f'element_{type}_id_seq', func.max(Element.id))).where(Element.type == type)
+                await session.execute(stmt)
             stmt = select(func.setval('note_id_seq', func.max(Note.id)))
             await session.execute(stmt)
             stmt = select(func.setval('note_comment_id_seq', func.max(NoteComment.id)))
             await session.execute(stmt)
+
+    @staticmethod
+    async def backfill_trace_previews(*, batch_size: int = 100) -> int:
+        """
+        Encode the preview lines of the imported traces that are missing them.
+
+        Returns the number of updated traces.
+        """
+        num_updated = 0
+        after_id = 0
+
+        while True:
+            async with db() as session:
+                stmt = (
+                    select(Trace.id)
+                    .where(
+                        Trace.id > after_id,
+                        Trace.status == 'imported',
+                        Trace.preview_line == null(),
+                    )
+                    .order_by(Trace.id)
+                    .limit(batch_size)
+                )
+                trace_ids = (await session.scalars(stmt)).all()
+                if not trace_ids:
+                    return num_updated
+
+                stmt = (
+                    select(TraceSegment)
+                    .where(TraceSegment.trace_id.in_(trace_ids))
+                    .order_by(
+                        TraceSegment.trace_id.asc(),
+                        TraceSegment.track_num.asc(),
+                        TraceSegment.segment_num.asc(),
+                    )
+                )
+                segments = (await session.scalars(stmt)).all()
+
+            values = [
+                {'id': trace_id, 'preview_line': encode_trace_preview(trace_segments)}
+                for trace_id, trace_segments in groupby(segments, key=lambda s: s.trace_id)
+            ]
+            if values:
+                async with db_commit() as session:
+                    await session.execute(update(Trace), values)
+
+            num_updated += len(values)
+            after_id = trace_ids[-1]
+
+    @staticmethod
+    async def migrate_trace_segments(*, batch_size: int = 1000) -> int:
+        """
+        Convert the trace segments stored in the legacy format to the compact format.
+
+        Returns the number of converted segments.
+        """
+        num_converted = 0
+
+        while True:
+            async with db() as session:
+                stmt = select(TraceSegment).where(TraceSegment.data == null()).limit(batch_size)
+                segments = (await session.scalars(stmt)).all()
+            if not segments:
+                return num_converted
+
+            values = [
+                {
+                    'trace_id': segment.trace_id,
+                    'track_num': segment.track_num,
+                    'segment_num': segment.segment_num,
+                    'bounds': TraceSegmentCodec.bounds(segment.points),
+                    'data': TraceSegmentCodec.encode(segment.points, segment.capture_times, segment.elevations),
+                    'legacy_points': None,
+                    'legacy_capture_times': None,
+                    'legacy_elevations': None,
+                }
+                for segment in segments
+            ]
+            async with db_commit() as session:
+                await session.execute(update(TraceSegment), values)
+
+            num_converted += len(values)
@@ -23,6 +23,7 @@ from app.models.db.oauth2_token import OAuth2Token
 from app.models.scope import Scope
 from app.models.types import Uri
 from app.services.image_service import ImageService
+from app.services.oauth2_token_cache_service import OAuth2TokenCacheService
 from app.utils import splitlines_trim
 from app.validators.url import UriValidator
 
@@ -119,7 +120,13 @@ class OAuth2ApplicationService:
 
             if revoke_all_authorizations:
                 await session.commit()
-                await session.execute(delete(OAuth2Token).where(OAuth2Token.application_id == app_id))
+                stmt = delete(OAuth2Token).where(OAuth2Token.application_id == app_id).returning(OAuth2Token.user_id)
+                revoked_user_ids = set((await session.scalars(stmt)).all())
+            else:
+                revoked_user_ids = ()
+
+        # invalidate after the commit
+        await OAuth2TokenCacheService.invalidate_users(revoked_user_ids)
 
     @staticmethod
     async def update_avatar(app_id: int, avatar_file: UploadFile) -> str:
@@ -185,8 +192,12 @@ class OAuth2ApplicationService:
         Delete an OAuth2 application.
         """
         async with db_commit() as session:
+            # tokens are deleted by the cascade
+            stmt = select(OAuth2Token.user_id).where(OAuth2Token.application_id == app_id).distinct()
+            revoked_user_ids = (await session.scalars(stmt)).all()
             stmt = delete(OAuth2Application).where(
                 OAuth2Application.id == app_id,
                 OAuth2Application.user_id == auth_user(required=True).id,
             )
             await session.execute(stmt)
+        await OAuth2TokenCacheService.invalidate_users(revoked_user_ids)
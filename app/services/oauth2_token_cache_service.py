@@ -0,0 +1,280 @@
+import logging
+from collections import OrderedDict
+from collections.abc import Collection
+from datetime import datetime
+from functools import cache
+from ipaddress import IPv4Address, IPv6Address, ip_address
+from time import monotonic
+from typing import Any, NamedTuple
+
+import cython
+import orjson
+from shapely import Point
+from sqlalchemy import ARRAY, Enum, LargeBinary, inspect
+from sqlalchemy.dialects.postgresql import INET, TIMESTAMP
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.types import TypeEngine
+
+from app.db import valkey
+from app.lib.crypto import hash_bytes
+from app.lib.options_context import options_context
+from app.limits import (
+    OAUTH_TOKEN_CACHE_EXPIRE,
+    OAUTH_TOKEN_CACHE_LOCAL_EXPIRE,
+    OAUTH_TOKEN_CACHE_LOCAL_MAX_SIZE,
+)
+from app.models.db.oauth2_token import OAuth2Token
+from app.models.db.user import User
+from app.models.geometry import PointType
+from app.queries.oauth2_token_query import OAuth2TokenQuery
+
+# return the cached token data if not invalidated since, otherwise return the current time
+_GET_SCRIPT = """
+local entry = redis.call('HMGET', KEYS[1], 'user_id', 'cached_at', 'data')
+if entry[1] then
+    local invalidated_at = redis.call('GET', 'oauth2_token_user:' .. entry[1])
+    if not invalidated_at or tonumber(invalidated_at) < tonumber(entry[2]) then
+        return entry[3]
+    end
+end
+local time = redis.call('TIME')
+return time[1] .. string.rep('0', 6 - #time[2]) .. time[2]
+"""
+
+# invalidate all the users' tokens cached until now
+_INVALIDATE_SCRIPT = """
+local time = redis.call('TIME')
+local now = time[1] .. string.rep('0', 6 - #time[2]) .. time[2]
+for _, key in ipairs(KEYS) do
+    redis.call('SET', key, now, 'EX', ARGV[1])
+end
+"""
+
+# log the hit rate every N lookups
+_STATS_LOG_INTERVAL = 10_000
+
+# user columns needed by the authorization and the request context,
+# credentials and personal data are never cached and must be loaded from the database
+_USER_COLUMNS = (
+    'id',
+    'created_at',
+    'display_name',
+    'status',
+    'language',
+    'activity_tracking',
+    'crash_reporting',
+    'roles',
+    'editor',
+    'avatar_type',
+    'avatar_id',
+    'background_id',
+    'home_point',
+)
+
+
+class _LocalEntry(NamedTuple):
+    expires_at: float
+    user_id: int
+    token_values: dict[str, Any]
+    user_values: dict[str, Any]
+    is_test_user: bool
+
+
+_local: OrderedDict[bytes, _LocalEntry] = OrderedDict()
+_hits: cython.longlong = 0
+_misses: cython.longlong = 0
+
+
+class OAuth2TokenCacheService:
+    @staticmethod
+    async def find_one_authorized_by_token(access_token: str) -> OAuth2Token | None:
+        """
+        Find an authorized OAuth2 token by token string, with the user loaded.
+
+        The token and user snapshot is cached in-process and in Valkey, so that a cache hit performs no database queries.
+        The user snapshot only includes the columns needed by the authorization and the request context.
+        """
+        token_hashed = hash_bytes(access_token)
+        now = monotonic()
+        local = _local.get(token_hashed)
+        if local is not None and local.expires_at > now:
+            _local.move_to_end(token_hashed)
+            _count(hit=True)
+            return _build_token(local.token_values, local.user_values, local.is_test_user)
+
+        cache_key = _token_key(token_hashed)
+        async with valkey() as conn:
+            cached: bytes = await conn.eval(_GET_SCRIPT, 1, cache_key)
+
+        if cached[:1] == b'{':
+            _count(hit=True)
+            data = orjson.loads(cached)
+            token_values = _decode_values(_get_columns(OAuth2Token), data['token'])
+            user_values = _decode_values(_get_columns(User, _USER_COLUMNS), data['user'])
+            is_test_user = data['is_test_user']
+        else:
+            # the snapshot time is taken before the query, invalidations after it discard the entry
+            _count(hit=False)
+            cached_at = int(cached)
+            with options_context(
+                joinedload(OAuth2Token.user).load_only(
+                    *(getattr(User, key) for key in _USER_COLUMNS),
+                    User.email,  # for the is_test_user check
+                )
+            ):
+                token = await OAuth2TokenQuery.find_one_authorized_by_token(access_token)
+            if token is None:
+                return None
+
+            token_values = {key: getattr(token, key) for key in _get_columns(OAuth2Token)}
+            user_values = {key: getattr(token.user, key) for key in _USER_COLUMNS}
+            is_test_user = token.user.is_test_user
+            data = orjson.dumps(
+                {
+                    'token': _encode_values(token_values),
+                    'user': _encode_values(user_values),
+                    'is_test_user': is_test_user,
+                }
+            )
+            async with valkey() as conn, conn.pipeline() as pipe:
+                pipe.hset(cache_key, mapping={'user_id': token.user_id, 'cached_at': cached_at, 'data': data})
+                pipe.expire(cache_key, OAUTH_TOKEN_CACHE_EXPIRE)
+                await pipe.execute()
+
+        _local[token_hashed] = _LocalEntry(
+            expires_at=now + OAUTH_TOKEN_CACHE_LOCAL_EXPIRE.total_seconds(),
+            user_id=token_values['user_id'],
+            token_values=token_values,
+            user_values=user_values,
+            is_test_user=is_test_user,
+        )
+        _local.move_to_end(token_hashed)
+        while len(_local) > OAUTH_TOKEN_CACHE_LOCAL_MAX_SIZE:
+            _local.popitem(last=False)
+
+        return _build_token(token_values, user_values, is_test_user)
+
+    @staticmethod
+    async def invalidate_user(user_id: int) -> None:
+        """
+        Invalidate the cached tokens of the given user.
+
+        Must be called after the user or tokens changes are committed.
+        """
+        await OAuth2TokenCacheService.invalidate_users((user_id,))
+
+    @staticmethod
+    async def invalidate_users(user_ids: Collection[int]) -> None:
+        """
+        Invalidate the cached tokens of the given users.
+
+        Must be called after the users or tokens changes are committed.
+        """
+        if not user_ids:
+            return
+        user_ids_set = set(user_ids)
+        for token_hashed in [k for k, entry in _local.items() if entry.user_id in user_ids_set]:
+            del _local[token_hashed]
+        logging.debug('Invalidating cached OAuth2 tokens for %d users', len(user_ids_set))
+        async with valkey() as conn:
+            await conn.eval(
+                _INVALIDATE_SCRIPT,
+                len(user_ids_set),
+                *(f'oauth2_token_user:{user_id}' for user_id in user_ids_set),
+                int(OAUTH_TOKEN_CACHE_EXPIRE.total_seconds()),
+            )
+
+    @staticmethod
+    def get_stats() -> tuple[int, int]:
+        """
+        Get the token cache statistics of this process.
+
+        Returns a tuple of (hits, misses).
+        """
+        return _hits, _misses
+
+
+@cython.cfunc
+def _count(*, hit: cython.char) -> None:
+    global _hits, _misses
+    total = _hits + _misses + 1
+    if hit:
+        _hits += 1
+    else:
+        _misses += 1
+    if total % _STATS_LOG_INTERVAL == 0:
+        logging.info('OAuth2 token cache hit rate is %.1f%% (%d lookups)', _hits / total * 100, total)
+
+
+@cython.cfunc
+def _token_key(token_hashed: bytes) -> str:
+    return f'oauth2_token:{token_hashed.hex()}'
+
+
+@cython.cfunc
+def _build_token(token_values: dict[str, Any], user_values: dict[str, Any], is_test_user: bool) -> OAuth2Token:
+    """
+    Build detached token and user instances, as if they were loaded from the database.
+    """
+    user = _build_instance(User, user_values)
+    user.cached_is_test_user = is_test_user
+    token = _build_instance(OAuth2Token, token_values)
+    set_committed_value(token, 'user', user)
+    return token
+
+
+@cython.cfunc
+def _build_instance(cls: type, values: dict[str, Any]):
+    instance = inspect(cls).class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(instance, key, value)
+    make_transient_to_detached(instance)
+    return instance
+
+
+@cython.cfunc
+def _encode_values(values: dict[str, Any]) -> dict[str, Any]:
+    return {key: _encode_value(value) for key, value in values.items()}
+
+
+@cython.cfunc
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, IPv4Address | IPv6Address):
+        return str(value)
+    if isinstance(value, Point):
+        return (value.x, value.y)
+    return value
+
+
+@cython.cfunc
+def _decode_values(columns: dict[str, TypeEngine], data: dict[str, Any]) -> dict[str, Any]:
+    return {key: _decode_value(type_, data[key]) for key, type_ in columns.items()}
+
+
+@cython.cfunc
+def _decode_value(type_: TypeEngine, value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(type_, ARRAY):
+        return tuple(_decode_value(type_.item_type, item) for item in value)
+    if isinstance(type_, Enum):
+        enum_class = type_.enum_class
+        return enum_class(value) if enum_class is not None else value
+    if isinstance(type_, TIMESTAMP):
+        return datetime.fromisoformat(value)
+    if isinstance(type_, LargeBinary):
+        return bytes.fromhex(value)
+    if isinstance(type_, INET):
+        return ip_address(value)
+    if isinstance(type_, PointType):
+        return Point(value)
+    return value
+
+
+@cache
+def _get_columns(cls: type, keys: tuple[str, ...] | None = None) -> dict[str, TypeEngine]:
+    # computed lazily, the mappers must be configured first
+    return {attr.key: attr.columns[0].type for attr in inspect(cls).column_attrs if keys is None or attr.key in keys}
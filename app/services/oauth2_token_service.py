@@ -24,6 +24,7 @@ from app.models.scope import Scope
 from app.models.types import Uri
 from app.queries.oauth2_application_query import OAuth2ApplicationQuery
 from app.queries.oauth2_token_query import OAuth2TokenQuery
+from app.services.oauth2_token_cache_service import OAuth2TokenCacheService
 from app.services.system_app_service import SYSTEM_APP_CLIENT_ID_MAP
 
 # TODO: limit number of access tokens per user+app
@@ -227,6 +228,7 @@ class OAuth2TokenService:
         Reset the personal access token and return the new secret.
         """
         app_id = SYSTEM_APP_CLIENT_ID_MAP['SystemApp.pat']
+        user_id = auth_user(required=True).id
         access_token = buffered_rand_urlsafe(32)
         access_token_hashed = hash_bytes(access_token)
         async with db_commit() as session:
@@ -234,7 +236,7 @@ class OAuth2TokenService:
                 update(OAuth2Token)
                 .where(
                     OAuth2Token.id == pat_id,
-                    OAuth2Token.user_id == auth_user(required=True).id,
+                    OAuth2Token.user_id == user_id,
                     OAuth2Token.application_id == app_id,
                 )
                 .values(
@@ -247,6 +249,7 @@ class OAuth2TokenService:
                 .inline()
             )
             await session.execute(stmt)
+        await OAuth2TokenCacheService.invalidate_user(user_id)
         return SecretStr(access_token)
 
     @staticmethod
@@ -254,12 +257,14 @@ class OAuth2TokenService:
         """
         Revoke the given token by id.
         """
+        user_id = auth_user(required=True).id
         async with db_commit() as session:
             stmt = delete(OAuth2Token).where(
-                OAuth2Token.user_id == auth_user(required=True).id,
+                OAuth2Token.user_id == user_id,
                 OAuth2Token.id == token_id,
             )
             await session.execute(stmt)
+        await OAuth2TokenCacheService.invalidate_user(user_id)
         logging.debug('Revoked OAuth2 token %d', token_id)
 
     @staticmethod
@@ -269,8 +274,14 @@ class OAuth2TokenService:
         """
         access_token_hashed = hash_bytes(access_token.get_secret_value())
         async with db_commit() as session:
-            stmt = delete(OAuth2Token).where(OAuth2Token.token_hashed == access_token_hashed)
-            await session.execute(stmt)
+            stmt = (
+                delete(OAuth2Token)
+                .where(OAuth2Token.token_hashed == access_token_hashed)
+                .returning(OAuth2Token.user_id)
+            )
+            user_id = await session.scalar(stmt)
+        if user_id is not None:
+            await OAuth2TokenCacheService.invalidate_user(user_id)
         logging.debug('Revoked OAuth2 access token')
 
     @staticmethod
@@ -294,6 +305,7 @@ class OAuth2TokenService:
                 OAuth2Token.id.notin_(skip_ids),
             )
             await session.execute(stmt)
+        await OAuth2TokenCacheService.invalidate_user(user_id)
         logging.debug('Revoked OAuth2 app tokens %d for user %d', app_id, user_id)
 
     @staticmethod
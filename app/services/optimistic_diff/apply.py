@@ -2,28 +2,74 @@ import logging
 from asyncio import Lock, TaskGroup
 from collections.abc import Collection, Mapping
 from datetime import datetime
+from itertools import chain
 
 import cython
+import orjson
 from sqlalchemy import and_, null, or_, select, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import DeclarativeBase, aliased
+from sqlalchemy.orm import aliased
 
 from app.db import db_commit
 from app.exceptions.optimistic_diff_error import OptimisticDiffError
 from app.lib.date_utils import utcnow
 from app.models.db.changeset import Changeset
-from app.models.db.changeset_bounds import ChangesetBounds
 from app.models.db.element import Element
 from app.models.db.element_member import ElementMember
 from app.models.element import ElementId, ElementRef, ElementType, VersionedElementRef
+from app.models.geometry import PointType
 from app.queries.changeset_query import ChangesetQuery
 from app.queries.element_query import ElementQuery
+from app.services.element_tile_cache_service import ElementTileCacheService
 from app.services.optimistic_diff.prepare import ElementStateEntry, OptimisticDiffPrepare
 
-# allow reads but prevent writes
-_lock_tables: tuple[type[DeclarativeBase], ...] = (Changeset, ChangesetBounds, Element, ElementMember)
-_lock_tables_names = (f'"{t.__tablename__}"' for t in _lock_tables)
-_lock_tables_sql = text(f'LOCK TABLE {",".join(_lock_tables_names)} IN EXCLUSIVE MODE')
+# lock namespaces are stored in the high bits of the advisory lock key
+_lock_namespace_changeset = 0
+_lock_namespace_element: dict[ElementType, int] = {'node': 1, 'way': 2, 'relation': 3}
+_lock_namespace_shift = 56
+
+# advisory locks are acquired in the array order, keep it sorted to avoid deadlocks
+_lock_refs_sql = text('SELECT pg_advisory_xact_lock(k) FROM unnest(CAST(:keys AS bigint[])) AS k')
+
+# allocate the ids from the sequences alone, concurrent diffs are not serialized
+# the values may interleave with other diffs, and may commit out of the sequence order
+_allocate_ids_sql = text("""
+SELECT
+    ARRAY(SELECT nextval('element_sequence_id_seq') FROM generate_series(1, :sequence_count) ORDER BY 1),
+    ARRAY(SELECT nextval('element_node_id_seq') FROM generate_series(1, :node_count) ORDER BY 1),
+    ARRAY(SELECT nextval('element_way_id_seq') FROM generate_series(1, :way_count) ORDER BY 1),
+    ARRAY(SELECT nextval('element_relation_id_seq') FROM generate_series(1, :relation_count) ORDER BY 1)
+""")
+
+# bulk insert prepared rows in a single statement, bypassing the ORM unit of work
+_insert_elements_sql = text("""
+INSERT INTO element (sequence_id, changeset_id, type, id, version, visible, tags, point, next_sequence_id, created_at)
+SELECT sequence_id, changeset_id, type::element_type, id, version, visible, tags::jsonb,
+    ST_GeomFromWKB(point, 4326), next_sequence_id, CAST(:created_at AS timestamptz)
+FROM unnest(
+    CAST(:sequence_id AS bigint[]),
+    CAST(:changeset_id AS bigint[]),
+    CAST(:type AS text[]),
+    CAST(:id AS bigint[]),
+    CAST(:version AS bigint[]),
+    CAST(:visible AS boolean[]),
+    CAST(:tags AS text[]),
+    CAST(:point AS bytea[]),
+    CAST(:next_sequence_id AS bigint[])
+) AS t(sequence_id, changeset_id, type, id, version, visible, tags, point, next_sequence_id)
+""")
+_insert_members_sql = text("""
+INSERT INTO element_member (sequence_id, "order", type, id, role)
+SELECT sequence_id, "order", type::element_type, id, role
+FROM unnest(
+    CAST(:sequence_id AS bigint[]),
+    CAST(:order AS smallint[]),
+    CAST(:type AS text[]),
+    CAST(:id AS bigint[]),
+    CAST(:role AS text[])
+) AS t(sequence_id, "order", type, id, role)
+""")
+_point_processor = PointType().bind_processor(None)  # pyright: ignore[reportArgumentType]
 
 # session.add() during .flush() is not supported
 _flush_lock = Lock()
@@ -40,25 +86,40 @@ class OptimisticDiffApply:
         if not prepare.apply_elements:
             return {}
 
-        async with db_commit() as session, TaskGroup() as tg:
-            # obtain exclusive lock on the tables
-            await session.execute(_lock_tables_sql)
+        async with db_commit() as session:
+            # obtain locks on the touched changeset and elements, unrelated diffs are not blocked
+            await session.execute(_lock_refs_sql, {'keys': _get_lock_keys(prepare)})
+
+            async with TaskGroup() as tg:
+                # check if the element_state is valid
+                tg.create_task(_check_elements_latest(prepare.element_state))
+
+                # check if the elements have no new references
+                if prepare.reference_check_element_refs:
+                    tg.create_task(
+                        _check_elements_unreferenced(
+                            prepare.reference_check_element_refs,
+                            prepare.element_state.keys(),
+                        )
+                    )
 
-            # check if the element_state is valid
-            tg.create_task(_check_elements_latest(prepare.element_state))
+                # check if the new members are still visible
+                if prepare.member_check_element_refs:
+                    tg.create_task(_check_members_visible(prepare.member_check_element_refs))
 
-            # check if the elements have no new references
-            if prepare.reference_check_element_refs:
-                tg.create_task(
-                    _check_elements_unreferenced(
-                        prepare.reference_check_element_refs,
-                        prepare.at_sequence_id,
-                    )
-                )
+                now = utcnow()
+                tg.create_task(_update_changeset(prepare.changeset, now, session))  # pyright: ignore[reportArgumentType]
 
-            now = utcnow()
-            tg.create_task(_update_changeset(prepare.changeset, now, session))  # pyright: ignore[reportArgumentType]
-            tg.create_task(_update_elements(prepare.apply_elements, now, session))
+            await _update_elements(prepare.apply_elements, now, session)
+
+        try:
+            await ElementTileCacheService.invalidate(
+                {ElementRef(element.type, element.id) for element, _ in prepare.apply_elements},
+                prepare.bbox_points,
+            )
+        except Exception:
+            # the diff is already committed, stale tiles expire on their own
+            logging.warning('Failed to invalidate the element tile cache', exc_info=True)
 
         assigned_ref_map: dict[ElementRef, list[Element]] = {}
         for element, element_ref in prepare.apply_elements:
@@ -68,6 +129,24 @@ class OptimisticDiffApply:
         return assigned_ref_map
 
 
+def _get_lock_keys(prepare: OptimisticDiffPrepare) -> list[int]:
+    """
+    Get the sorted advisory lock keys for the changeset and elements touched by the diff.
+
+    Newly created elements are not locked, as they are not visible to other diffs.
+    """
+    changeset = prepare.changeset
+    if changeset is None:
+        raise AssertionError('Changeset must be set')
+
+    keys: set[int] = {(_lock_namespace_changeset << _lock_namespace_shift) | changeset.id}
+    for element_ref in chain((ref for _, ref in prepare.apply_elements), prepare.member_check_element_refs):
+        element_id = element_ref.id
+        if element_id > 0:
+            keys.add((_lock_namespace_element[element_ref.type] << _lock_namespace_shift) | element_id)
+    return sorted(keys)
+
+
 async def _check_elements_latest(element_state: dict[ElementRef, ElementStateEntry]) -> None:
     """
     Check if the elements are the current version.
@@ -83,14 +162,28 @@ async def _check_elements_latest(element_state: dict[ElementRef, ElementStateEnt
         raise OptimisticDiffError('Element is outdated')
 
 
-async def _check_elements_unreferenced(element_refs: Collection[ElementRef], after_sequence_id: int) -> None:
+async def _check_elements_unreferenced(
+    element_refs: Collection[ElementRef],
+    exclude_parent_refs: Collection[ElementRef],
+) -> None:
     """
     Check if the elements are currently unreferenced.
 
     Raises OptimisticDiffError if they are.
     """
-    if not await ElementQuery.check_is_unreferenced(element_refs, after_sequence_id):
-        raise OptimisticDiffError(f'Element is referenced after {after_sequence_id}')
+    if not await ElementQuery.check_is_unreferenced(element_refs, exclude_parent_refs):
+        raise OptimisticDiffError('Element is referenced by a concurrent diff')
+
+
+async def _check_members_visible(member_refs: Collection[ElementRef]) -> None:
+    """
+    Check if the members are currently visible.
+
+    Raises OptimisticDiffError if they are not.
+    """
+    visible_refs = await ElementQuery.filter_visible_refs(member_refs)
+    if len(visible_refs) != len(member_refs):
+        raise OptimisticDiffError('Member is deleted by a concurrent diff')
 
 
 async def _update_changeset(changeset: Changeset, now: datetime, session: AsyncSession) -> None:
@@ -119,19 +212,23 @@ async def _update_elements(
     """
     Update the element table by creating new revisions.
     """
-    async with TaskGroup() as tg:
-        current_sequence_task = tg.create_task(ElementQuery.get_current_sequence_id())
-        current_id_task = tg.create_task(ElementQuery.get_current_ids())
-
-    current_sequence_id = current_sequence_task.result()
-    current_id_map = current_id_task.result()
+    new_type_refs: dict[ElementType, set[ElementRef]] = {'node': set(), 'way': set(), 'relation': set()}
+    for _, element_ref in elements:
+        if element_ref.id < 0:
+            new_type_refs[element_ref.type].add(element_ref)
+
+    sequence_ids, new_ids_map = await _allocate_ids(
+        len(elements),
+        {type: len(refs) for type, refs in new_type_refs.items()},
+        session,
+    )
     update_type_ids: dict[ElementType, list[ElementId]] = {'node': [], 'way': [], 'relation': []}
     insert_members: list[ElementMember] = []
     prev_map: dict[ElementRef, Element] = {}
     assigned_id_map: dict[ElementRef, ElementId] = {}
 
     # process elements
-    for sequence_id, (element, element_ref) in enumerate(elements, current_sequence_id + 1):
+    for sequence_id, (element, element_ref) in zip(sequence_ids, elements, strict=True):
         # assign sequence_id
         element.sequence_id = sequence_id
         element.created_at = now
@@ -148,8 +245,7 @@ async def _update_elements(
         if element.id < 0:
             assigned_id = assigned_id_map.get(element_ref)
             if assigned_id is None:
-                assigned_id = ElementId(current_id_map[element.type] + 1)
-                assigned_id_map[element_ref] = current_id_map[element.type] = assigned_id
+                assigned_id = assigned_id_map[element_ref] = new_ids_map[element.type].pop()
             element.id = assigned_id
 
     # process members
@@ -171,11 +267,84 @@ async def _update_elements(
                 member_ref = ElementRef(member.type, member.id)
                 member.id = assigned_id_map[member_ref]
 
-    await _update_elements_db(current_sequence_id, update_type_ids, insert_elements, insert_members, session)
+    await _update_elements_db(sequence_ids[0], update_type_ids, insert_elements, insert_members, session)
+
+
+async def _allocate_ids(
+    sequence_count: int,
+    type_counts: Mapping[ElementType, int],
+    session: AsyncSession,
+) -> tuple[list[int], dict[ElementType, list[ElementId]]]:
+    """
+    Allocate the sequence ids and the new element ids (per type) in a single round trip.
+
+    The values are ascending, but not necessarily contiguous.
+    Element ids are returned in the descending order, to be popped from the end.
+    """
+    row = (
+        await session.execute(
+            _allocate_ids_sql,
+            {
+                'sequence_count': sequence_count,
+                'node_count': type_counts['node'],
+                'way_count': type_counts['way'],
+                'relation_count': type_counts['relation'],
+            },
+        )
+    ).one()
+    sequence_ids, *type_ids = row
+    new_ids_map: dict[ElementType, list[ElementId]] = {
+        type: ids[::-1] for type, ids in zip(('node', 'way', 'relation'), type_ids, strict=True)
+    }
+    return sequence_ids, new_ids_map
+
+
+async def _insert_elements_db(
+    insert_elements: Collection[Element],
+    insert_members: Collection[ElementMember],
+    session: AsyncSession,
+) -> None:
+    """
+    Insert the prepared element and member rows using array parameters, one statement per table.
+    """
+    if not insert_elements:
+        return
+
+    created_at = next(iter(insert_elements)).created_at
+    point_processor = _point_processor
+    await session.execute(
+        _insert_elements_sql,
+        {
+            'created_at': created_at,
+            'sequence_id': [element.sequence_id for element in insert_elements],
+            'changeset_id': [element.changeset_id for element in insert_elements],
+            'type': [element.type for element in insert_elements],
+            'id': [element.id for element in insert_elements],
+            'version': [element.version for element in insert_elements],
+            'visible': [element.visible for element in insert_elements],
+            'tags': [orjson.dumps(element.tags).decode() for element in insert_elements],
+            'point': [point_processor(element.point) for element in insert_elements],
+            'next_sequence_id': [element.next_sequence_id for element in insert_elements],
+        },
+    )
+
+    if not insert_members:
+        return
+
+    await session.execute(
+        _insert_members_sql,
+        {
+            'sequence_id': [member.sequence_id for member in insert_members],
+            'order': [member.order for member in insert_members],
+            'type': [member.type for member in insert_members],
+            'id': [member.id for member in insert_members],
+            'role': [member.role for member in insert_members],
+        },
+    )
 
 
 async def _update_elements_db(
-    current_sequence_id: int,
+    min_sequence_id: int,
     update_type_ids: Mapping[ElementType, Collection[ElementId]],
     insert_elements: Collection[Element],
     insert_members: Collection[ElementMember],
@@ -183,12 +352,11 @@ async def _update_elements_db(
 ) -> None:
     """
     Update the element table by creating new revisions - push prepared data to the database.
+
+    The previous versions precede min_sequence_id, as their elements are locked until the commit.
     """
     logging.info('Inserting %d elements and %d members', len(insert_elements), len(insert_members))
-    async with _flush_lock:
-        session.add_all(insert_elements)
-        session.add_all(insert_members)
-        await session.flush()
+    await _insert_elements_db(insert_elements, insert_members, session)
 
     where_ors = tuple(
         and_(
@@ -205,7 +373,7 @@ async def _update_elements_db(
     stmt = (
         update(Element)
         .where(
-            Element.sequence_id <= current_sequence_id,
+            Element.sequence_id < min_sequence_id,
             Element.next_sequence_id == null(),
             or_(*where_ors),
         )
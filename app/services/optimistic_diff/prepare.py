@@ -72,7 +72,12 @@ class OptimisticDiffPrepare:
 
     reference_check_element_refs: set[ElementRef]
     """
-    Local reference check state, set of element refs that need to be checked for references after last_sequence_id.
+    Local reference check state, set of element refs that need to be checked for references during apply.
+    """
+
+    member_check_element_refs: set[ElementRef]
+    """
+    Remote member check state, set of newly referenced element refs that need to be visible during apply.
     """
 
     _reference_override: defaultdict[tuple[ElementRef, bool], set[ElementRef]]
@@ -87,9 +92,9 @@ class OptimisticDiffPrepare:
     Local changeset state.
     """
 
-    _bbox_points: list[Point]
+    bbox_points: list[Point]
     """
-    Changeset bounding box collection of points.
+    Changeset bounding box collection of points, also used to invalidate the element tile cache.
     """
 
     _bbox_refs: set[ElementRef]
@@ -105,9 +110,10 @@ class OptimisticDiffPrepare:
         self._elements_parents_refs = {}
         self._elements_check_members_remote = []
         self.reference_check_element_refs = set()
+        self.member_check_element_refs = set()
         self._reference_override = defaultdict(set)
         self.changeset = None
-        self._bbox_points = []
+        self.bbox_points = []
         self._bbox_refs = set()
 
     async def prepare(self) -> None:
@@ -337,6 +343,8 @@ class OptimisticDiffPrepare:
         if not remote_refs:
             return
 
+        # remember the remote members, they must still be visible during apply
+        self.member_check_element_refs = remote_refs
         visible_refs = await ElementQuery.filter_visible_refs(remote_refs, at_sequence_id=self.at_sequence_id)
         hidden_refs = remote_refs.difference(visible_refs)
         hidden_ref = next(iter(hidden_refs), None)
@@ -365,7 +373,7 @@ class OptimisticDiffPrepare:
         """
         Push bbox info for a node.
         """
-        bbox_points = self._bbox_points
+        bbox_points = self.bbox_points
         element_point = element.point
         if element_point is not None:
             bbox_points.append(element_point)
@@ -388,7 +396,7 @@ class OptimisticDiffPrepare:
         node_refs: set[ElementRef] = {ElementRef('node', member.id) for member in chain(next_members, prev_members)}
 
         element_state = self.element_state
-        bbox_points = self._bbox_points
+        bbox_points = self.bbox_points
         bbox_refs = self._bbox_refs
         for node_ref in node_refs:
             entry = element_state.get(node_ref)
@@ -423,7 +431,7 @@ class OptimisticDiffPrepare:
 
         diff_refs = (prev_refs | next_refs) if full_diff else (changed_refs)
         element_state = self.element_state
-        bbox_points = self._bbox_points
+        bbox_points = self.bbox_points
         bbox_refs = self._bbox_refs
         for member_ref in diff_refs:
             member_type = member_ref.type
@@ -495,7 +503,7 @@ class OptimisticDiffPrepare:
         """
         Update changeset bounds using the collected bbox info.
         """
-        bbox_points = self._bbox_points
+        bbox_points = self.bbox_points
         bbox_refs = self._bbox_refs
 
         if bbox_refs:
@@ -18,6 +18,7 @@ from app.models.db.user import User, UserRole, UserStatus
 from app.models.scope import PUBLIC_SCOPES, Scope
 from app.models.types import DisplayNameType, EmailType, LocaleCode, Uri
 from app.queries.user_query import UserQuery
+from app.services.oauth2_token_cache_service import OAuth2TokenCacheService
 
 
 class TestService:
@@ -111,6 +112,7 @@ class TestService:
             if not user.is_test_user:
                 raise AssertionError('Test service must only create test users')
 
+        await OAuth2TokenCacheService.invalidate_user(user.id)
         logging.info('Upserted test user %r', name)
 
     @staticmethod
@@ -1,23 +1,55 @@
+import asyncio
 import logging
+from asyncio import Event, Lock, TaskGroup, get_running_loop
+from contextlib import asynccontextmanager, suppress
+from datetime import timedelta
+from io import BytesIO
+from time import perf_counter
+from typing import NamedTuple
 
 import cython
 import numpy as np
 from fastapi import UploadFile
+from lxml.etree import XMLSyntaxError
 from shapely import lib
+from sqlalchemy import delete, null, or_, select, update
 
-from app.db import db_commit
+from app.db import db, db_commit
+from app.exceptions.api_error import APIError
+from app.exceptions06 import Exceptions06
 from app.format.gpx import FormatGPX
 from app.lib.auth_context import auth_user
 from app.lib.date_utils import utcnow
-from app.lib.exceptions_context import raise_for
+from app.lib.exceptions_context import exceptions_context, raise_for
+from app.lib.retry import retry
+from app.lib.testmethod import testmethod
 from app.lib.trace_file import TraceFile
-from app.lib.xmltodict import XMLToDict
-from app.limits import TRACE_FILE_UPLOAD_MAX_SIZE
+from app.lib.trace_preview import encode_trace_preview
+from app.limits import (
+    TRACE_FILE_UPLOAD_MAX_SIZE,
+    TRACE_PROCESSING_LEASE,
+    TRACE_PROCESSING_MAX_ATTEMPTS,
+    TRACE_PROCESSING_POLL_INTERVAL,
+    TRACE_PROCESSING_PROGRESS_INTERVAL,
+    TRACE_PROCESSING_RETRY_EXPONENT,
+)
 from app.models.db.trace_ import Trace, TraceVisibility
+from app.models.db.trace_job import TraceJob
 from app.models.db.trace_segment import TraceSegment
+from app.models.types import StorageKey
 from app.models.validating.trace_ import TraceValidating
 from app.storage import TRACES_STORAGE
 
+_PROCESS_REQUEST_EVENT = Event()
+_process_lock = Lock()
+
+
+class TraceRecompressReport(NamedTuple):
+    num_files: int
+    input_size: int
+    output_size: int
+    elapsed: float  # in seconds
+
 
 class TraceService:
     @staticmethod
@@ -31,57 +63,42 @@ class TraceService:
         """
         Process upload of a trace file.
 
+        The trace is created in the pending state, and its file is processed in the background.
         Returns the created trace object.
         """
         file_size = file.size
         if file_size is None or file_size > TRACE_FILE_UPLOAD_MAX_SIZE:
             raise_for.input_too_big(file_size or -1)
 
-        file_bytes = await file.read()
-        segments: list[TraceSegment] = []
-
-        # process multiple files in the archive
-        try:
-            for gpx_bytes in TraceFile.extract(file_bytes):
-                tracks = XMLToDict.parse(gpx_bytes).get('gpx', {}).get('trk', [])
-                track_num_start = (segments[-1].track_num + 1) if segments else 0
-                segments.extend(FormatGPX.decode_tracks(tracks, track_num_start=track_num_start))
-        except Exception as e:
-            raise_for.bad_trace_file(str(e))
-
-        size = lib.count_coordinates(np.asarray(tuple(segment.points for segment in segments), dtype=np.object_))
-        logging.debug('Organized %d points into %d segments', size, len(segments))
-        if size < 2:
-            raise_for.bad_trace_file('not enough points')
-
         trace = Trace(
             **TraceValidating(
                 user_id=auth_user(required=True).id,
                 name=_get_file_name(file),
                 description=description,
                 visibility=visibility,
-                size=size,
+                size=0,
             ).__dict__
         )
         trace.tag_string = tags
-        compressed_file, compressed_suffix = TraceFile.compress(file_bytes)
+
+        await file.seek(0)
+        loop = get_running_loop()
+        compressed_file, compressed_suffix = await loop.run_in_executor(None, TraceFile.compress, file.file)
         trace.file_id = await TRACES_STORAGE.save(compressed_file, compressed_suffix)
 
         try:
             async with db_commit() as session:
                 session.add(trace)
                 await session.flush()
-
-                trace_id = trace.id
-                for segment in segments:
-                    segment.trace_id = trace_id
-                session.add_all(segments)
+                session.add(TraceJob(trace_id=trace.id))
 
         except Exception:
             # clean up trace file on error
             await TRACES_STORAGE.delete(trace.file_id)
             raise
 
+        logging.debug('Scheduled trace %d processing', trace.id)
+        _PROCESS_REQUEST_EVENT.set()
         return trace
 
     @staticmethod
@@ -124,6 +141,312 @@ class TraceService:
 
             await session.delete(trace)
 
+    @staticmethod
+    async def recompress_files(*, batch_size: int = 100) -> TraceRecompressReport:
+        """
+        Recompress the stored trace files at the archival compression level.
+
+        Uploads are compressed quickly, this is meant to run periodically outside of the web workers.
+        Each file is replaced by a new one, and the old file is deleted once the trace references the new one.
+        """
+        loop = get_running_loop()
+        num_files = 0
+        input_size = 0
+        output_size = 0
+        after_id = 0
+        ts = perf_counter()
+
+        while True:
+            async with db() as session:
+                stmt = select(Trace.id, Trace.file_id).where(Trace.id > after_id).order_by(Trace.id).limit(batch_size)
+                rows = (await session.execute(stmt)).all()
+            if not rows:
+                break
+
+            for trace_id, file_id in rows:
+                if TraceFile.is_recompressed(file_id):
+                    continue
+
+                try:
+                    buffer = await TRACES_STORAGE.load(file_id)
+                    with exceptions_context(Exceptions06()):
+                        compressed, suffix = await loop.run_in_executor(None, TraceFile.recompress, buffer, file_id)
+                except Exception:
+                    logging.warning('Failed to recompress trace %d file %r', trace_id, file_id, exc_info=True)
+                    continue
+
+                new_file_id = await TRACES_STORAGE.save(compressed, suffix)
+                async with db_commit() as session:
+                    # skip traces deleted or changed in the meantime
+                    stmt = (
+                        update(Trace)
+                        .where(Trace.id == trace_id, Trace.file_id == file_id)
+                        .values({Trace.file_id: new_file_id})
+                        .inline()
+                    )
+                    updated = (await session.execute(stmt)).rowcount
+
+                if not updated:
+                    await TRACES_STORAGE.delete(new_file_id)
+                    continue
+
+                await TRACES_STORAGE.delete(file_id)
+                num_files += 1
+                input_size += len(buffer)
+                output_size += len(compressed)
+                logging.debug('Recompressed trace %d file from %d to %d bytes', trace_id, len(buffer), len(compressed))
+
+            after_id = rows[-1][0]
+
+        return TraceRecompressReport(num_files, input_size, output_size, perf_counter() - ts)
+
+    @staticmethod
+    @asynccontextmanager
+    async def context():
+        """
+        Context manager for processing the uploaded traces.
+        """
+        async with TaskGroup() as tg:
+            task = tg.create_task(_process_task())
+            yield
+            task.cancel()  # avoid "Task was destroyed" warning during tests
+
+    @staticmethod
+    @testmethod
+    async def force_process():
+        """
+        Process the pending traces immediately, and wait for it to finish.
+
+        This method is only available during testing, and is limited to the current process.
+        """
+        async with _process_lock:
+            await _process_jobs()
+
+
+@retry(None)
+async def _process_task() -> None:
+    poll_interval = TRACE_PROCESSING_POLL_INTERVAL.total_seconds()
+
+    while True:
+        async with _process_lock:
+            await _process_jobs()
+
+        # wake up early on uploads to this process, otherwise poll for uploads to other processes
+        with suppress(TimeoutError):
+            await asyncio.wait_for(_PROCESS_REQUEST_EVENT.wait(), poll_interval)
+        _PROCESS_REQUEST_EVENT.clear()
+
+
+async def _process_jobs() -> None:
+    """
+    Process the available trace jobs until there are none left.
+    """
+    while (job := await _claim_job()) is not None:
+        await _process_job(*job)
+
+
+async def _claim_job() -> tuple[int, int] | None:
+    """
+    Claim the next available trace job by leasing it for processing.
+
+    Returns a tuple of (trace_id, processing_counter) or None if there are no available jobs.
+    """
+    async with db_commit() as session:
+        now = utcnow()
+        subq = (
+            select(TraceJob.trace_id)
+            .where(
+                TraceJob.error == null(),
+                or_(
+                    TraceJob.processing_at == null(),
+                    TraceJob.processing_at <= now,
+                ),
+            )
+            .order_by(TraceJob.processing_counter, TraceJob.trace_id)
+            .with_for_update(skip_locked=True)
+            .limit(1)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(TraceJob)
+            .where(TraceJob.trace_id == subq)
+            .values(
+                {
+                    TraceJob.processing_counter: TraceJob.processing_counter + 1,
+                    TraceJob.processing_at: now + TRACE_PROCESSING_LEASE,
+                }
+            )
+            .returning(TraceJob.trace_id, TraceJob.processing_counter)
+        )
+        row = (await session.execute(stmt)).one_or_none()
+
+    return tuple(row) if row is not None else None  # pyright: ignore[reportReturnType]
+
+
+async def _process_job(trace_id: int, processing_counter: int) -> None:
+    """
+    Process the trace file and insert its segments.
+
+    Invalid files fail the job, other errors requeue it with a backoff.
+    """
+    if processing_counter > TRACE_PROCESSING_MAX_ATTEMPTS:
+        await _fail_job(trace_id, processing_counter, 'Too many processing attempts')
+        return
+
+    async with db() as session:
+        file_id: StorageKey | None = await session.scalar(select(Trace.file_id).where(Trace.id == trace_id))
+    if file_id is None:
+        return
+
+    logging.debug('Processing trace %d (attempt %d)', trace_id, processing_counter)
+    try:
+        buffer = await TRACES_STORAGE.load(file_id)
+    except Exception:
+        logging.warning('Failed to load trace %d file', trace_id, exc_info=True)
+        await _requeue_job(trace_id, processing_counter)
+        return
+
+    file = BytesIO(buffer)
+    progress_task = asyncio.create_task(_report_progress(trace_id, processing_counter, file, len(buffer)))
+    try:
+        loop = get_running_loop()
+        segments, preview_line = await loop.run_in_executor(None, _decode_segments, file, file_id)
+    except APIError as e:
+        await _fail_job(trace_id, processing_counter, e.detail)
+        return
+    except (XMLSyntaxError, ValueError) as e:
+        logging.debug('Failed to parse trace %d file: %s', trace_id, e)
+        await _fail_job(trace_id, processing_counter, 'Failed to parse trace file')
+        return
+    except Exception:
+        logging.warning('Failed to process trace %d', trace_id, exc_info=True)
+        await _requeue_job(trace_id, processing_counter)
+        return
+    finally:
+        progress_task.cancel()
+
+    size = lib.count_coordinates(np.asarray(tuple(segment.points for segment in segments), dtype=np.object_))
+    logging.debug('Organized %d points into %d segments', size, len(segments))
+    if size < 2:
+        await _fail_job(trace_id, processing_counter, 'not enough points')
+        return
+
+    try:
+        async with db_commit() as session:
+            # finish the job, unless the lease was lost in the meantime
+            stmt = (
+                delete(TraceJob)
+                .where(
+                    TraceJob.trace_id == trace_id,
+                    TraceJob.processing_counter == processing_counter,
+                )
+                .returning(TraceJob.trace_id)
+            )
+            if (await session.execute(stmt)).scalar_one_or_none() is None:
+                logging.info('Discarding trace %d processing result, the lease was lost', trace_id)
+                return
+
+            for segment in segments:
+                segment.trace_id = trace_id
+            session.add_all(segments)
+
+            stmt = (
+                update(Trace)
+                .where(Trace.id == trace_id)
+                .values({Trace.size: size, Trace.preview_line: preview_line, Trace.status: 'imported'})
+                .inline()
+            )
+            await session.execute(stmt)
+
+    except Exception:
+        logging.warning('Failed to insert trace %d segments', trace_id, exc_info=True)
+        await _requeue_job(trace_id, processing_counter)
+        return
+
+    logging.info('Processed trace %d with %d points', trace_id, size)
+
+
+def _decode_segments(file: BytesIO, file_id: StorageKey) -> tuple[list[TraceSegment], str]:
+    """
+    Decode the trace file segments and encode their data and preview. Runs in a worker thread.
+    """
+    segments: list[TraceSegment] = []
+    with exceptions_context(Exceptions06()):
+        # process multiple files in the archive
+        for gpx_file in TraceFile.extract(TraceFile.open_decompressed(file, file_id)):
+            track_num_start = (segments[-1].track_num + 1) if segments else 0
+            segments.extend(FormatGPX.decode_tracks(gpx_file, track_num_start=track_num_start))
+    for segment in segments:
+        segment.encode_data()
+    return segments, encode_trace_preview(segments)
+
+
+async def _report_progress(trace_id: int, processing_counter: int, file: BytesIO, file_size: int) -> None:
+    """
+    Periodically report the processing progress, extending the lease.
+    """
+    interval = TRACE_PROCESSING_PROGRESS_INTERVAL.total_seconds()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with db_commit() as session:
+                stmt = (
+                    update(TraceJob)
+                    .where(
+                        TraceJob.trace_id == trace_id,
+                        TraceJob.processing_counter == processing_counter,
+                    )
+                    .values(
+                        {
+                            TraceJob.progress: file.tell() / file_size,
+                            TraceJob.processing_at: utcnow() + TRACE_PROCESSING_LEASE,
+                        }
+                    )
+                    .inline()
+                )
+                await session.execute(stmt)
+        except Exception:
+            logging.warning('Failed to report trace %d processing progress', trace_id, exc_info=True)
+
+
+async def _requeue_job(trace_id: int, processing_counter: int) -> None:
+    """
+    Release the trace job lease, and retry after a backoff.
+    """
+    processing_at = utcnow() + timedelta(minutes=processing_counter**TRACE_PROCESSING_RETRY_EXPONENT)
+    logging.info('Requeuing trace %d processing at %s', trace_id, processing_at)
+    async with db_commit() as session:
+        stmt = (
+            update(TraceJob)
+            .where(
+                TraceJob.trace_id == trace_id,
+                TraceJob.processing_counter == processing_counter,
+            )
+            .values({TraceJob.processing_at: processing_at})
+            .inline()
+        )
+        await session.execute(stmt)
+
+
+async def _fail_job(trace_id: int, processing_counter: int, error: str) -> None:
+    """
+    Permanently fail the trace job, keeping the error for the user.
+    """
+    logging.info('Failed to process trace %d: %s', trace_id, error)
+    async with db_commit() as session:
+        stmt = (
+            update(TraceJob)
+            .where(
+                TraceJob.trace_id == trace_id,
+                TraceJob.processing_counter == processing_counter,
+            )
+            .values({TraceJob.error: error, TraceJob.processing_at: None})
+            .inline()
+        )
+        if (await session.execute(stmt)).rowcount:
+            stmt = update(Trace).where(Trace.id == trace_id).values({Trace.status: 'failed'}).inline()
+            await session.execute(stmt)
+
 
 @cython.cfunc
 def _get_file_name(file: UploadFile) -> str:
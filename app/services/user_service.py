@@ -21,6 +21,7 @@ from app.models.types import DisplayNameType, EmailType, LocaleCode, PasswordTyp
 from app.queries.user_query import UserQuery
 from app.queries.user_token_query import UserTokenQuery
 from app.services.image_service import ImageService
+from app.services.oauth2_token_cache_service import OAuth2TokenCacheService
 from app.services.oauth2_token_service import OAuth2TokenService
 from app.services.system_app_service import SystemAppService
 from app.services.user_token_email_change_service import UserTokenEmailChangeService
@@ -55,7 +56,7 @@ class UserService:
             logging.debug('User not found %r', display_name_or_email)
             StandardFeedback.raise_error(None, t('users.auth_failure.invalid_credentials'))
 
-        verification = PasswordHash.verify(
+        verification = await PasswordHash.verify_async(
             password_pb=user.password_pb,
             password=password,
             is_test_user=user.is_test_user,
@@ -79,7 +80,7 @@ class UserService:
         """
         Update user's profile description.
         """
-        current_user = auth_user(required=True)
+        current_user = await UserQuery.find_one_auth_user(required=True)
         if current_user.description == description:
             return
         async with db_commit() as session:
@@ -95,6 +96,7 @@ class UserService:
                 .inline()
             )
             await session.execute(stmt)
+        await OAuth2TokenCacheService.invalidate_user(current_user.id)
 
     @staticmethod
     async def update_avatar(avatar_type: AvatarType, avatar_file: UploadFile) -> str:
@@ -112,6 +114,7 @@ class UserService:
             old_avatar_id = user.avatar_id
             user.avatar_type = avatar_type
             user.avatar_id = avatar_id
+        await OAuth2TokenCacheService.invalidate_user(user.id)
 
         # cleanup old avatar
         if old_avatar_id is not None:
@@ -134,6 +137,7 @@ class UserService:
             user = await session.get_one(User, auth_user(required=True).id, with_for_update=True)
             old_background_id = user.background_id
             user.background_id = background_id
+        await OAuth2TokenCacheService.invalidate_user(user.id)
 
         # cleanup old background
         if old_background_id is not None:
@@ -175,6 +179,7 @@ class UserService:
                 .inline()
             )
             await session.execute(stmt)
+        await OAuth2TokenCacheService.invalidate_user(user.id)
 
     @staticmethod
     async def update_editor(
@@ -183,10 +188,11 @@ class UserService:
         """
         Update default editor
         """
+        user_id = auth_user(required=True).id
         async with db_commit() as session:
             stmt = (
                 update(User)
-                .where(User.id == auth_user(required=True).id)
+                .where(User.id == user_id)
                 .values(
                     {
                         User.editor: editor,
@@ -195,6 +201,7 @@ class UserService:
                 .inline()
             )
             await session.execute(stmt)
+        await OAuth2TokenCacheService.invalidate_user(user_id)
 
     @staticmethod
     async def update_email(
@@ -207,13 +214,13 @@ class UserService:
 
         Sends a confirmation email for the email change.
         """
-        user = auth_user(required=True)
+        user = await UserQuery.find_one_auth_user(required=True)
         if user.email == new_email:
             StandardFeedback.raise_error('email', t('validation.new_email_is_current'))
         if user.is_test_user and FREEZE_TEST_USER:
             StandardFeedback.raise_error('email', 'Changing test user email is disabled')
 
-        verification = PasswordHash.verify(
+        verification = await PasswordHash.verify_async(
             password_pb=user.password_pb,
             password=password,
             is_test_user=user.is_test_user,
@@ -241,8 +248,8 @@ class UserService:
         """
         Update user password.
         """
-        user = auth_user(required=True)
-        verification = PasswordHash.verify(
+        user = await UserQuery.find_one_auth_user(required=True)
+        verification = await PasswordHash.verify_async(
             password_pb=user.password_pb,
             password=old_password,
             is_test_user=user.is_test_user,
@@ -253,7 +260,7 @@ class UserService:
             StandardFeedback.raise_error('password_schema', verification.schema_needed)
         # ignore verification.rehash_needed, we are changing the password anyway
 
-        new_password_pb = PasswordHash.hash(new_password)
+        new_password_pb = await PasswordHash.hash_async(new_password)
         if new_password_pb is None:
             raise AssertionError('Provided password schemas cannot be used during update_password')
 
@@ -269,6 +276,7 @@ class UserService:
                 )
                 .inline()
             )
+        await OAuth2TokenCacheService.invalidate_user(user.id)
         logging.debug('Changed password for user %r', user.id)
 
     @staticmethod
@@ -287,7 +295,7 @@ class UserService:
         user_token = await UserTokenQuery.find_one_by_token_struct(UserTokenResetPassword, token_struct)
         if user_token is None:
             raise_for.bad_user_token_struct()
-        new_password_pb = PasswordHash.hash(new_password)
+        new_password_pb = await PasswordHash.hash_async(new_password)
         if new_password_pb is None:
             raise AssertionError('Provided password schemas cannot be used during reset_password')
 
@@ -315,6 +323,7 @@ class UserService:
                 )
                 .inline()
             )
+        await OAuth2TokenCacheService.invalidate_user(user_token.user_id)
         logging.debug('Reset password for user %r', user_token.user_id)
 
     # TODO: UI
@@ -323,10 +332,11 @@ class UserService:
         """
         Request a scheduled deletion of the user.
         """
+        user_id = auth_user(required=True).id
         async with db_commit() as session:
             stmt = (
                 update(User)
-                .where(User.id == auth_user(required=True).id)
+                .where(User.id == user_id)
                 .values(
                     {
                         User.scheduled_delete_at: func.statement_timestamp() + USER_SCHEDULED_DELETE_DELAY,
@@ -335,16 +345,18 @@ class UserService:
                 .inline()
             )
             await session.execute(stmt)
+        await OAuth2TokenCacheService.invalidate_user(user_id)
 
     @staticmethod
     async def abort_scheduled_delete() -> None:
         """
         Abort a scheduled deletion of the user.
         """
+        user_id = auth_user(required=True).id
         async with db_commit() as session:
             stmt = (
                 update(User)
-                .where(User.id == auth_user(required=True).id)
+                .where(User.id == user_id)
                 .values(
                     {
                         User.scheduled_delete_at: None,
@@ -352,6 +364,7 @@ class UserService:
                 )
             )
             await session.execute(stmt)
+        await OAuth2TokenCacheService.invalidate_user(user_id)
 
     @staticmethod
     async def delete_old_pending_users():
@@ -360,15 +373,22 @@ class UserService:
         """
         logging.debug('Deleting old pending users')
         async with db_commit() as session:
-            stmt = delete(User).where(
-                User.status == UserStatus.pending_activation,
-                User.created_at < func.statement_timestamp() - USER_PENDING_EXPIRE,
+            stmt = (
+                delete(User)
+                .where(
+                    User.status == UserStatus.pending_activation,
+                    User.created_at < func.statement_timestamp() - USER_PENDING_EXPIRE,
+                )
+                .returning(User.id)
             )
-            await session.execute(stmt)
+            deleted_user_ids = (await session.scalars(stmt)).all()
+
+        # invalidate after the commit
+        await OAuth2TokenCacheService.invalidate_users(deleted_user_ids)
 
 
 async def _rehash_user_password(user: User, password: PasswordType) -> None:
-    new_password_pb = PasswordHash.hash(password)
+    new_password_pb = await PasswordHash.hash_async(password)
     if new_password_pb is None:
         return
 
@@ -380,4 +400,5 @@ async def _rehash_user_password(user: User, password: PasswordType) -> None:
             .inline()
         )
         await session.execute(stmt)
+    await OAuth2TokenCacheService.invalidate_user(user.id)
     logging.debug('Rehashed password for user %d', user.id)
@@ -37,7 +37,7 @@ class UserSignupService:
         if not await validate_email_deliverability(email):
             StandardFeedback.raise_error('email', t('validation.invalid_email_address'))
 
-        password_pb = PasswordHash.hash(password)
+        password_pb = await PasswordHash.hash_async(password)
         if password_pb is None:
             raise AssertionError('Provided password schemas cannot be used during signup')
 
@@ -14,8 +14,10 @@ from app.models.db.mail import MailSource
 from app.models.db.user import User, UserStatus
 from app.models.db.user_token_account_confirm import UserTokenAccountConfirm
 from app.models.proto.server_pb2 import UserTokenStruct
+from app.queries.user_query import UserQuery
 from app.queries.user_token_query import UserTokenQuery
 from app.services.email_service import EmailService
+from app.services.oauth2_token_cache_service import OAuth2TokenCacheService
 
 
 class UserTokenAccountConfirmService:
@@ -60,13 +62,14 @@ class UserTokenAccountConfirmService:
                 .values({User.status: UserStatus.active})
                 .inline()
             )
+        await OAuth2TokenCacheService.invalidate_user(token.user_id)
 
 
 async def _create_token() -> UserTokenStruct:
     """
     Create a new user account confirmation token.
     """
-    user = auth_user(required=True)
+    user = await UserQuery.find_one_auth_user(required=True)
     user_email_hashed = hash_bytes(user.email)
     token_bytes = buffered_randbytes(32)
     token_hashed = hash_bytes(token_bytes)
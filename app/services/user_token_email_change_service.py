@@ -15,8 +15,10 @@ from app.models.db.user import User
 from app.models.db.user_token_email_change import UserTokenEmailChange
 from app.models.proto.server_pb2 import UserTokenStruct
 from app.models.types import EmailType
+from app.queries.user_query import UserQuery
 from app.queries.user_token_query import UserTokenQuery
 from app.services.email_service import EmailService
+from app.services.oauth2_token_cache_service import OAuth2TokenCacheService
 
 
 class UserTokenEmailChangeService:
@@ -63,13 +65,14 @@ class UserTokenEmailChangeService:
                 .values({User.email: token.new_email})
                 .inline()
             )
+        await OAuth2TokenCacheService.invalidate_user(token.user_id)
 
 
 async def _create_token(new_email: EmailType) -> UserTokenStruct:
     """
     Create a new user email change token.
     """
-    user = auth_user(required=True)
+    user = await UserQuery.find_one_auth_user(required=True)
     user_email_hashed = hash_bytes(user.email)
     token_bytes = buffered_randbytes(32)
     token_hashed = hash_bytes(token_bytes)
@@ -0,0 +1,13 @@
+import asyncio
+
+from app.services.migration_service import MigrationService
+
+
+async def main() -> None:
+    print('Backfilling trace previews')
+    num_updated = await MigrationService.backfill_trace_previews()
+    print(f'Updated {num_updated} traces')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,21 @@
+import asyncio
+
+from sizestr import sizestr
+
+from app.services.trace_service import TraceService
+
+
+async def main() -> None:
+    print('Recompressing trace files')
+    report = await TraceService.recompress_files()
+    saved = report.input_size - report.output_size
+    print(
+        f'Recompressed {report.num_files} files'
+        f' from {sizestr(report.input_size)} to {sizestr(report.output_size)}'
+        f' (saved {sizestr(saved)}, {saved / (report.input_size or 1):.1%})'
+    )
+    print(f'Throughput: {sizestr(report.input_size / (report.elapsed or 1))}/s over {report.elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,13 @@
+import asyncio
+
+from app.services.migration_service import MigrationService
+
+
+async def main() -> None:
+    print('Converting trace segments to the compact format')
+    num_converted = await MigrationService.migrate_trace_segments()
+    print(f'Converted {num_converted} segments')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
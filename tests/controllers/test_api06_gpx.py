@@ -4,6 +4,7 @@ from math import isclose
 from httpx import AsyncClient
 
 from app.lib.xmltodict import XMLToDict
+from app.services.trace_service import TraceService
 
 
 async def test_gpx_crud(client: AsyncClient, gpx: dict):
@@ -23,6 +24,7 @@ async def test_gpx_crud(client: AsyncClient, gpx: dict):
     )
     assert r.is_success, r.text
     trace_id = int(r.text)
+    await TraceService.force_process()
 
     # read trace
     r = await client.get(f'/api/0.6/gpx/{trace_id}/details')
@@ -99,6 +101,24 @@ async def test_gpx_data(client: AsyncClient, gpx: dict):
     assert r.headers['Content-Disposition'] == f'attachment; filename="{trace_id}"'
     assert 'Content-Type' not in r.headers
 
+    # read trace raw data as stored
+    r = await client.get(f'/api/0.6/gpx/{trace_id}/data', headers={'Accept-Encoding': 'zstd'})
+    assert r.is_success, r.text
+    assert r.headers['Content-Encoding'] == 'zstd'
+    assert r.content == file
+
+    # read trace raw data without compression support
+    r = await client.get(f'/api/0.6/gpx/{trace_id}/data', headers={'Accept-Encoding': 'identity'})
+    assert r.is_success, r.text
+    assert 'Content-Encoding' not in r.headers
+    assert r.content == file
+
+    # read trace raw data with compression explicitly refused
+    r = await client.get(f'/api/0.6/gpx/{trace_id}/data', headers={'Accept-Encoding': 'gzip, zstd;q=0'})
+    assert r.is_success, r.text
+    assert 'Content-Encoding' not in r.headers
+    assert r.content == file
+
     # read trace gpx data
     r = await client.get(f'/api/0.6/gpx/{trace_id}/data.gpx')
     assert r.is_success, r.text
@@ -126,6 +146,7 @@ async def test_gpx_files(client: AsyncClient, gpx: dict):
     )
     assert r.is_success, r.text
     trace_id = int(r.text)
+    await TraceService.force_process()
 
     # read gpx files
     r = await client.get('/api/0.6/user/gpx_files')
@@ -160,6 +181,7 @@ async def test_trackpoints(client: AsyncClient, gpx: dict):
     )
     assert r.is_success, r.text
     trace_id = int(r.text)
+    await TraceService.force_process()
 
     # read trackpoints
     r = await client.get(
@@ -209,3 +231,105 @@ async def test_trackpoints(client: AsyncClient, gpx: dict):
     assert trkpt['@lat'] == 51.8583922
     assert datetime.fromisoformat(trkpt['time']) == datetime(2023, 7, 3, 10, 36, 21, tzinfo=UTC)
     assert isclose(float(trkpt['ele']), 190.8, abs_tol=0.01)
+
+
+async def test_trackpoints_anonymous_large(client: AsyncClient):
+    client.headers['Authorization'] = 'User user1'
+    num_points = 70_000
+    trkpts = ''.join(
+        f'<trkpt lon="{31.5 + (i % 1000) / 100_000}" lat="{11.5 + (i // 1000) / 100_000}"/>' for i in range(num_points)
+    )
+
+    # create gpx
+    r = await client.post(
+        '/api/0.6/gpx/create',
+        data={
+            'visibility': 'private',
+            'description': 'test_trackpoints_anonymous_large',
+        },
+        files={
+            'file': ('test_trackpoints_anonymous_large.gpx', f'<gpx><trk><trkseg>{trkpts}</trkseg></trk></gpx>'),
+        },
+    )
+    assert r.is_success, r.text
+    await TraceService.force_process()
+
+    # read trackpoints, merged into a single anonymous segment
+    r = await client.get('/api/0.6/trackpoints', params={'bbox': '31.49,11.49,31.52,11.52'})
+    assert r.is_success, r.text
+    assert r.content.count(b'<trkpt ') >= num_points
+
+
+async def test_gpx_failed(client: AsyncClient):
+    client.headers['Authorization'] = 'User user1'
+
+    # create gpx
+    r = await client.post(
+        '/api/0.6/gpx/create',
+        data={
+            'visibility': 'private',
+            'description': 'test_gpx_failed',
+        },
+        files={
+            'file': ('test_gpx_failed.gpx', b'<?xml version="1.0"?><gpx version="1.1"></gpx>'),
+        },
+    )
+    assert r.is_success, r.text
+    trace_id = int(r.text)
+    await TraceService.force_process()
+
+    # read trace
+    r = await client.get(f'/api/0.6/gpx/{trace_id}/details')
+    assert r.is_success, r.text
+    gpx_file = XMLToDict.parse(r.content)['osm']['gpx_file'][0]
+
+    assert gpx_file['@pending'] is False
+    assert '@lon' not in gpx_file
+    assert '@lat' not in gpx_file
+
+    # read processing status
+    r = await client.get(f'/api/web/traces/{trace_id}/status')
+    assert r.is_success, r.text
+    status = r.json()
+
+    assert status['status'] == 'failed'
+    assert status['error'] == 'not enough points'
+
+
+async def test_gpx_failed_parse(client: AsyncClient):
+    client.headers['Authorization'] = 'User user1'
+
+    # create gpx
+    r = await client.post(
+        '/api/0.6/gpx/create',
+        data={
+            'visibility': 'private',
+            'description': 'test_gpx_failed_parse',
+        },
+        files={
+            'file': ('test_gpx_failed_parse.gpx', b'<gpx><trk><trkseg><trkpt lon="x" lat="1"/></trkseg></trk></gpx>'),
+        },
+    )
+    assert r.is_success, r.text
+    trace_id = int(r.text)
+    await TraceService.force_process()
+
+    # read processing status, without the internal exception details
+    r = await client.get(f'/api/web/traces/{trace_id}/status')
+    assert r.is_success, r.text
+    status = r.json()
+
+    assert status['status'] == 'failed'
+    assert status['error'] == 'Failed to parse trace file'
+
+
+async def test_trackpoints_cursor(client: AsyncClient):
+    r = await client.get('/api/0.6/trackpoints', params={'bbox': '20.8726,51.8583,20.8728,51.8585'})
+    assert r.is_success, r.text
+    assert 'Link' not in r.headers
+
+    r = await client.get(
+        '/api/0.6/trackpoints',
+        params={'bbox': '20.8726,51.8583,20.8728,51.8585', 'cursor': 'invalid.cursor'},
+    )
+    assert r.status_code == 400, r.text
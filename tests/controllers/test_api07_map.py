@@ -0,0 +1,38 @@
+from httpx import AsyncClient
+
+from app.lib.xmltodict import XMLToDict
+
+
+async def test_map_read(client: AsyncClient, changeset_id: int):
+    # create node
+    r = await client.put(
+        '/api/0.6/node/create',
+        content=XMLToDict.unparse(
+            {
+                'osm': {
+                    'node': {
+                        '@changeset': changeset_id,
+                        '@lon': 3.2345678,
+                        '@lat': 4.3456789,
+                    }
+                }
+            }
+        ),
+    )
+    assert r.is_success, r.text
+    node_id = int(r.text)
+
+    # read map
+    r = await client.get('/api/0.7/map?bbox=3.234,4.345,3.235,4.346')
+    assert r.is_success, r.text
+
+    data = r.json()
+    assert data['cursor'] is None
+    node = next(element for element in data['elements'] if element['type'] == 'node' and element['id'] == node_id)
+    assert node['lon'] == 3.2345678
+    assert node['lat'] == 4.3456789
+
+
+async def test_map_read_bad_cursor(client: AsyncClient):
+    r = await client.get('/api/0.7/map?bbox=3.234,4.345,3.235,4.346&cursor=invalid.cursor')
+    assert r.status_code == 400, r.text
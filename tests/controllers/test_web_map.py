@@ -0,0 +1,41 @@
+import numpy as np
+from httpx import AsyncClient
+
+from app.lib.geo_utils import tile_xy
+from app.lib.xmltodict import XMLToDict
+
+
+async def test_map_tile(client: AsyncClient, changeset_id: int):
+    # create node
+    r = await client.put(
+        '/api/0.6/node/create',
+        content=XMLToDict.unparse(
+            {
+                'osm': {
+                    'node': {
+                        '@changeset': changeset_id,
+                        '@lon': 5.2345678,
+                        '@lat': 6.3456789,
+                        'tag': [{'@k': 'amenity', '@v': 'bench'}],
+                    }
+                }
+            }
+        ),
+    )
+    assert r.is_success, r.text
+
+    # read tile
+    ((x, y),) = tile_xy(np.array(((5.2345678, 6.3456789),), np.float64), 16).tolist()
+    r = await client.get(f'/api/web/map/tile/16/{x}/{y}')
+    assert r.is_success, r.text
+    assert r.headers['Content-Type'] == 'application/vnd.mapbox-vector-tile'
+    assert 'max-age' in r.headers['Cache-Control']
+    assert b'nodes' in r.content
+
+
+async def test_map_tile_invalid(client: AsyncClient):
+    r = await client.get('/api/web/map/tile/3/0/0')
+    assert r.status_code == 422, r.text
+
+    r = await client.get(f'/api/web/map/tile/16/{1 << 16}/0')
+    assert r.status_code == 404, r.text
@@ -0,0 +1,230 @@
+import logging
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import UTC, datetime
+from time import perf_counter
+
+import orjson
+import pytest
+from shapely import Point
+
+from app.exceptions.api_error import APIError
+from app.exceptions06 import Exceptions06
+from app.format import Format06
+from app.lib.exceptions_context import exceptions_context
+from app.lib.format_style_context import FormatStyle, _context
+from app.lib.xmltodict import XMLToDict
+from app.limits import ELEMENT_TAGS_LIMIT, ELEMENT_WAY_MEMBERS_LIMIT
+from app.models.db.element import Element
+from app.models.db.element_member import ElementMember
+from app.models.element import ElementId
+
+
+@contextmanager
+def _format_style(style: FormatStyle) -> Iterator[None]:
+    token = _context.set(style)
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def _make_elements(nodes: int) -> list[Element]:
+    created_at = datetime(2024, 1, 2, 3, 4, 5, 678, UTC)
+    elements: list[Element] = [
+        Element(
+            changeset_id=1,
+            type='node',
+            id=ElementId(i),
+            version=1,
+            visible=True,
+            tags={'amenity': 'bench', 'note': '"quoted" & <escaped>\n'} if i % 10 == 0 else {},
+            point=Point(i / nodes, -i / nodes),
+            members=[],
+        )
+        for i in range(1, nodes + 1)
+    ]
+    elements.append(
+        Element(
+            changeset_id=1,
+            type='way',
+            id=ElementId(1),
+            version=2,
+            visible=True,
+            tags={'highway': 'residential'},
+            point=None,
+            members=[
+                ElementMember(order=i, type='node', id=ElementId(i + 1), role='') for i in range(min(nodes, 2000))
+            ],
+        )
+    )
+    elements.append(
+        Element(
+            changeset_id=1,
+            type='relation',
+            id=ElementId(1),
+            version=1,
+            visible=True,
+            tags={},
+            point=None,
+            members=[ElementMember(order=0, type='way', id=ElementId(1), role='outer')],
+        )
+    )
+    for element in elements:
+        element.created_at = created_at
+    elements[0].user_id = 1
+    elements[0].user_display_name = 'user "1"'
+    return elements
+
+
+def _encode_tree_xml(elements: list[Element]) -> bytes:
+    return XMLToDict.unparse({'osm': Format06.encode_elements(elements)}, raw=True)
+
+
+def _encode_stream_xml(elements: list[Element]) -> bytes:
+    return b''.join(
+        (
+            XMLToDict.unparse({'osm': {}}, raw=True).removesuffix(b'<osm/>'),
+            b'<osm>',
+            *Format06.encode_elements_stream(elements),
+            b'</osm>',
+        )
+    )
+
+
+@pytest.mark.parametrize('nodes', [1, 10, 2500])
+def test_encode_elements_stream_xml(nodes):
+    elements = _make_elements(nodes)
+    with _format_style('xml'):
+        assert _encode_stream_xml(elements) == _encode_tree_xml(elements)
+
+
+@pytest.mark.parametrize('nodes', [1, 10, 2500])
+def test_encode_elements_stream_json(nodes):
+    elements = _make_elements(nodes)
+    with _format_style('json'):
+        expected = orjson.dumps(Format06.encode_elements(elements), option=orjson.OPT_UTC_Z)
+        actual = b''.join((b'{"elements":[', *Format06.encode_elements_stream(elements), b']}'))
+    assert actual == expected
+
+
+@pytest.mark.extended
+@pytest.mark.parametrize('nodes', [10_000, 50_000])
+def test_encode_elements_stream_benchmark(nodes):
+    elements = _make_elements(nodes)
+    with _format_style('xml'):
+        for name, encode in (('tree', _encode_tree_xml), ('stream', _encode_stream_xml)):
+            tracemalloc.start()
+            ts = perf_counter()
+            encode(elements)
+            tt = perf_counter() - ts
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            logging.info(
+                'Encoded %d nodes with %s encoder in %.3fs (peak %.1f MB)', nodes, name, tt, peak / 1024 / 1024
+            )
+
+
+def test_decode_osmchange():
+    elements = Format06.decode_osmchange(
+        b'<osmChange version="0.6">'
+        b'<create>'
+        b'<node id="-1" lat="1" lon="2"><tag k="amenity" v="bench"/></node>'
+        b'<way id="-1"><nd ref="-1"/><nd ref="3"/></way>'
+        b'</create>'
+        b'<modify><relation id="4" version="2"><member type="way" ref="-1" role="outer"/></relation></modify>'
+        b'<delete if-unused="true"><node id="5" version="3"/></delete>'
+        b'</osmChange>',
+        changeset_id=1,
+    )
+    node, way, relation, deleted = elements
+
+    assert node.type == 'node'
+    assert node.id == -1
+    assert node.version == 1
+    assert node.tags == {'amenity': 'bench'}
+    assert node.point == Point(2, 1)
+    assert node.delete_if_unused is None
+
+    assert way.type == 'way'
+    assert [(member.type, member.id) for member in way.members] == [('node', -1), ('node', 3)]
+
+    assert relation.version == 3
+    assert relation.visible
+    assert [(member.type, member.id, member.role) for member in relation.members] == [('way', -1, 'outer')]
+
+    assert deleted.version == 4
+    assert not deleted.visible
+    assert deleted.delete_if_unused
+
+
+def test_decode_osmchange_if_unused_only_delete():
+    (element,) = Format06.decode_osmchange(
+        b'<osmChange><modify if-unused="true"><node id="1" version="1" lat="0" lon="0"/></modify></osmChange>',
+        changeset_id=1,
+    )
+    assert element.visible
+    assert element.delete_if_unused is None
+
+
+def test_decode_osmchange_namespaced():
+    (element,) = Format06.decode_osmchange(
+        b'<osc:osmChange xmlns:osc="http://openstreetmap.org/osmChange">'
+        b'<osc:create><osc:node id="-1" lat="0" lon="0"><osc:tag k="a" v="b"/></osc:node></osc:create>'
+        b'</osc:osmChange>',
+        changeset_id=1,
+    )
+    assert element.type == 'node'
+    assert element.tags == {'a': 'b'}
+
+
+def test_decode_osmchange_empty():
+    assert Format06.decode_osmchange(b'<osmChange version="0.6"/>', changeset_id=1) == []
+    with pytest.raises(ValueError):
+        Format06.decode_osmchange(b'<osmChange/>', changeset_id=1)
+    with pytest.raises(ValueError):
+        Format06.decode_osmchange(b'<osm/>', changeset_id=1)
+
+
+@pytest.mark.parametrize(
+    'xml',
+    [
+        # too many tags
+        b'<osmChange><create><node id="-1" lat="0" lon="0">'
+        + b''.join(b'<tag k="%d" v=""/>' % i for i in range(ELEMENT_TAGS_LIMIT + 1))
+        + b'</node></create></osmChange>',
+        # duplicate tags
+        b'<osmChange><create><node id="-1" lat="0" lon="0"><tag k="a" v="1"/><tag k="a" v="2"/></node></create></osmChange>',
+        # too many members
+        b'<osmChange><create><way id="-1">'
+        + b'<nd ref="1"/>' * (ELEMENT_WAY_MEMBERS_LIMIT + 1)
+        + b'</way></create></osmChange>',
+        # invalid ids
+        b'<osmChange><create><node id="abc" lat="0" lon="0"/></create></osmChange>',
+        b'<osmChange><create><way id="-1"><nd ref="abc"/></way></create></osmChange>',
+        # unsupported element type
+        b'<osmChange><create><area id="-1"/></create></osmChange>',
+        # delete without version
+        b'<osmChange><delete><node id="1"/></delete></osmChange>',
+    ],
+)
+def test_decode_osmchange_invalid(xml):
+    with pytest.raises(ValueError):
+        Format06.decode_osmchange(xml, changeset_id=1)
+
+
+@pytest.mark.parametrize(
+    'xml',
+    [
+        # unsupported action
+        b'<osmChange><upsert><node id="-1" lat="0" lon="0"/></upsert></osmChange>',
+        # create with positive id
+        b'<osmChange><create><node id="1" lat="0" lon="0"/></create></osmChange>',
+        # update without version
+        b'<osmChange><modify><node id="1" lat="0" lon="0"/></modify></osmChange>',
+    ],
+)
+def test_decode_osmchange_invalid_diff(xml):
+    with exceptions_context(Exceptions06()), pytest.raises(APIError):
+        Format06.decode_osmchange(xml, changeset_id=1)
@@ -0,0 +1,158 @@
+import logging
+import tracemalloc
+from datetime import UTC, datetime
+from io import BytesIO
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pytest
+from shapely import multipoints
+
+from app.format.gpx import FormatGPX
+from app.lib.trace_segment_codec import TraceSegmentCodec
+from app.lib.xmltodict import XMLToDict
+from app.models.db.trace_ import Trace
+from app.models.db.trace_segment import TraceSegment
+
+
+def test_decode_tracks():
+    with Path('tests/data/8473730.gpx').open('rb') as f:
+        segments = list(FormatGPX.decode_tracks(f, track_num_start=3))
+
+    assert [(s.track_num, s.segment_num, len(s.points.geoms)) for s in segments] == [
+        (3, 0, 90),
+        (3, 1, 99),
+        (3, 2, 99),
+        (3, 3, 99),
+        (3, 4, 49),
+    ]
+    first = segments[0]
+    assert first.points.geoms[0].x == 20.8726996
+    assert first.points.geoms[0].y == 51.8583922
+    assert first.capture_times[0].isoformat() == '2023-07-03T10:36:21+00:00'  # pyright: ignore[reportOptionalSubscript]
+    assert first.elevations[:2] == [190.8, 190.7]  # pyright: ignore[reportOptionalSubscript]
+
+
+def test_decode_tracks_numbering():
+    trkpts = ''.join(f'<trkpt lon="{i / 100_000}" lat="0"><ele>{i}</ele></trkpt>' for i in range(250))
+    file = BytesIO(
+        f'<gpx><trk><trkseg>{trkpts}</trkseg><trkseg/></trk><trk/><trk><trkseg>{trkpts[:100]}</trkseg></trk></gpx>'.encode()
+    )
+    segments = list(FormatGPX.decode_tracks(file))
+
+    assert [(s.track_num, s.segment_num, len(s.points.geoms)) for s in segments] == [
+        (0, 0, 99),
+        (0, 1, 99),
+        (0, 2, 52),
+        (3, 0, 2),
+    ]
+    assert segments[0].capture_times is None
+    assert segments[2].elevations[-1] == 249  # pyright: ignore[reportOptionalSubscript]
+
+
+def test_decode_tracks_naive_time():
+    file = BytesIO(
+        b'<gpx><trk><trkseg>'
+        b'<trkpt lon="1" lat="2"><time>2023-07-03T10:36:21</time></trkpt>'
+        b'<trkpt lon="1" lat="2"><time>2023-07-03T10:36:22Z</time></trkpt>'
+        b'</trkseg></trk></gpx>'
+    )
+    segments = list(FormatGPX.decode_tracks(file))
+
+    # naive times are assumed to be UTC
+    assert segments[0].capture_times == [
+        datetime(2023, 7, 3, 10, 36, 21, tzinfo=UTC),
+        datetime(2023, 7, 3, 10, 36, 22, tzinfo=UTC),
+    ]
+    _, capture_times, _ = TraceSegmentCodec.decode(
+        TraceSegmentCodec.encode(segments[0].points, segments[0].capture_times, segments[0].elevations)
+    )
+    assert capture_times.tolist() == [1688380581000, 1688380582000]  # pyright: ignore[reportOptionalMemberAccess]
+
+
+def test_decode_tracks_split_area():
+    trkpts = ''.join(f'<trkpt lon="{i / 50}" lat="0"/>' for i in range(5))
+    segments = list(FormatGPX.decode_tracks(BytesIO(f'<gpx><trk><trkseg>{trkpts}</trkseg></trk></gpx>'.encode())))
+
+    assert [len(s.points.geoms) for s in segments] == [1, 1, 1, 1, 1]
+    assert segments[0].elevations is None
+
+
+def _make_segments() -> tuple[list[TraceSegment], list[TraceSegment]]:
+    with Path('tests/data/8473730.gpx').open('rb') as f:
+        segments = list(FormatGPX.decode_tracks(f))
+    trace = Trace(
+        user_id=1,
+        name='name & <escaped>',
+        description='',
+        visibility='identifiable',
+        size=len(segments),
+        tags=[],
+    )
+    trace.id = 1
+    for segment in segments[:3]:
+        segment.trace_id = trace.id
+        segment.trace = trace
+    # partially missing attributes and fractional seconds
+    segments[1].capture_times[0] = None  # pyright: ignore[reportOptionalSubscript]
+    segments[1].capture_times[1] = datetime(2023, 7, 3, 10, 36, 21, 500, UTC)  # pyright: ignore[reportOptionalSubscript]
+    segments[1].elevations[1] = None  # pyright: ignore[reportOptionalSubscript]
+    segments[4].capture_times = None
+    segments[4].elevations = None
+    return segments[:3], segments[3:]
+
+
+def _encode_tree(segments_groups) -> bytes:
+    return XMLToDict.unparse({'gpx': FormatGPX.encode_track(segments_groups)}, raw=True)
+
+
+def _encode_stream(segments_groups) -> bytes:
+    return b''.join(
+        (
+            XMLToDict.unparse({'gpx': {}}, raw=True).removesuffix(b'<gpx/>'),
+            b'<gpx>',
+            *FormatGPX.encode_track_stream(segments_groups),
+            b'</gpx>',
+        )
+    )
+
+
+def test_encode_track_stream():
+    segments_groups = _make_segments()
+    assert _encode_stream(segments_groups) == _encode_tree(segments_groups)
+
+
+def test_encode_track_stream_empty():
+    assert not list(FormatGPX.encode_track_stream(((), ())))
+
+
+@pytest.mark.extended
+@pytest.mark.parametrize('num_segments', [100, 1000])
+def test_encode_track_stream_benchmark(num_segments):
+    rng = np.random.default_rng(42)
+    start = datetime(2024, 1, 1, tzinfo=UTC).timestamp()
+    segments = [
+        TraceSegment(
+            track_num=i,
+            segment_num=0,
+            points=multipoints(rng.uniform(-90, 90, (100, 2)).round(7)),  # pyright: ignore[reportArgumentType]
+            capture_times=[datetime.fromtimestamp(start + i * 100 + j, UTC) for j in range(100)],
+            elevations=rng.uniform(0, 1000, 100).round(1).tolist(),
+        )
+        for i in range(num_segments)
+    ]
+    for name, encode in (('tree', _encode_tree), ('stream', _encode_stream)):
+        tracemalloc.start()
+        ts = perf_counter()
+        encode((segments,))
+        tt = perf_counter() - ts
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logging.info(
+            'Encoded %d trackpoints with %s encoder in %.3fs (peak %.1f MB)',
+            num_segments * 100,
+            name,
+            tt,
+            peak / 1024 / 1024,
+        )
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 
 from app.lib.image import Image
@@ -9,3 +11,10 @@ async def test_gravatar_load():
     key = 'testing@testing.invalid'
     data = await GRAVATAR_STORAGE.load(key)
     assert data == Image.default_avatar
+
+
+@pytest.mark.extended
+async def test_gravatar_load_concurrent():
+    key = 'testing-concurrent@testing.invalid'
+    results = await asyncio.gather(*(GRAVATAR_STORAGE.load(key) for _ in range(5)))
+    assert all(data == Image.default_avatar for data in results)
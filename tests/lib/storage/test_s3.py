@@ -0,0 +1,39 @@
+from contextlib import suppress
+from os import urandom
+
+import aioboto3
+import pytest
+import pytest_asyncio
+
+from app.config import S3_ENDPOINT_URL
+from app.lib.storage.s3 import S3Storage
+from app.limits import S3_MULTIPART_THRESHOLD
+
+
+@pytest_asyncio.fixture(scope='module')  # pyright: ignore[reportUntypedFunctionDecorator]
+async def s3_storage():
+    # run against an S3-compatible server, e.g. MinIO with S3_ENDPOINT_URL=http://127.0.0.1:9000
+    async with aioboto3.Session().client('s3', endpoint_url=S3_ENDPOINT_URL) as s3:
+        with suppress(s3.exceptions.BucketAlreadyOwnedByYou):
+            await s3.create_bucket(Bucket='test')
+
+    async with S3Storage.context():
+        yield S3Storage('test')
+
+
+@pytest.mark.extended
+@pytest.mark.parametrize('size', [100, S3_MULTIPART_THRESHOLD + 1])
+async def test_s3_storage(s3_storage: S3Storage, size):
+    data = urandom(size)
+    key = await s3_storage.save(data, '.bin')
+    assert await s3_storage.load(key) == data
+    assert await s3_storage.load_range(key, 10, 20) == data[10:20]
+    await s3_storage.delete(key)
+
+
+@pytest.mark.extended
+async def test_s3_storage_range_uncached(s3_storage: S3Storage):
+    data = urandom(100)
+    key = await s3_storage.save(data, '.bin')
+    assert await s3_storage.load_range(key, 10, 20) == data[10:20]
+    await s3_storage.delete(key)
@@ -1,4 +1,7 @@
 from datetime import timedelta
+from pathlib import Path
+
+import pytest
 
 from app.lib.file_cache import FileCache
 
@@ -7,7 +10,7 @@ async def test_file_cache():
     cache = FileCache('test')
     await cache.set('key', b'value', ttl=None)
     assert await cache.get('key') == b'value'
-    cache.delete('key')
+    await cache.delete('key')
     assert await cache.get('key') is None
 
 
@@ -15,3 +18,50 @@ async def test_file_cache_expire():
     cache = FileCache('test')
     await cache.set('key', b'value', ttl=timedelta(seconds=-2))
     assert await cache.get('key') is None
+
+
+def _disk_size(cache_dir: Path) -> int:
+    return sum(path.stat().st_size for path in cache_dir.glob('*/??/??/*'))
+
+
+async def test_file_cache_cleanup(tmp_path: Path):
+    cache = FileCache('test', cache_dir=tmp_path)
+    await cache.set('expired', b'value', ttl=timedelta(seconds=-2))
+    expired_size = _disk_size(tmp_path)
+    await cache.set('short', b'value', ttl=timedelta(hours=1))
+    await cache.set('long', b'value', ttl=timedelta(days=1))
+    await cache.set('forever', b'value', ttl=None)
+    await cache.set('forever', b'value', ttl=None)
+    assert FileCache.get_total_size(cache_dir=tmp_path) == _disk_size(tmp_path)
+
+    # expired entries go first, then the ones closest to expiration
+    await FileCache.cleanup(cache_dir=tmp_path, max_size=_disk_size(tmp_path) - expired_size - 1)
+    assert FileCache.get_total_size(cache_dir=tmp_path) == _disk_size(tmp_path)
+    assert await cache.get('expired') is None
+    assert await cache.get('short') is None
+    assert await cache.get('long') == b'value'
+    assert await cache.get('forever') == b'value'
+
+    await cache.delete('long')
+    assert FileCache.get_total_size(cache_dir=tmp_path) == _disk_size(tmp_path)
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_file_cache_stream(tmp_path: Path):
+    cache = FileCache('test', cache_dir=tmp_path)
+    await cache.set_stream('key', _chunks(b'val', b'ue'), 5, ttl=timedelta(hours=1))
+    assert await cache.get('key') == b'value'
+
+    file = await cache.open('key')
+    assert file is not None
+    with file:
+        assert file.read() == b'value'
+
+    with pytest.raises(ValueError):
+        await cache.set_stream('invalid', _chunks(b'value'), 10, ttl=None)
+    assert await cache.open('invalid') is None
+    assert FileCache.get_total_size(cache_dir=tmp_path) == _disk_size(tmp_path)
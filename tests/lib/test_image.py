@@ -1,4 +1,14 @@
+import asyncio
+import logging
+from math import sqrt
+from time import perf_counter
+
+import cv2
+import numpy as np
+import pytest
+
 from app.lib.image import AvatarType, Image
+from app.limits import AVATAR_MAX_FILE_SIZE, AVATAR_MAX_MEGAPIXELS, AVATAR_MAX_RATIO, BACKGROUND_MAX_FILE_SIZE
 from app.models.types import StorageKey
 
 
@@ -7,3 +17,60 @@ def test_get_avatar_url():
     assert Image.get_avatar_url(AvatarType.default, app=True) == '/static/img/app.webp'
     assert Image.get_avatar_url(AvatarType.gravatar, 123) == '/api/web/gravatar/123'
     assert Image.get_avatar_url(AvatarType.custom, StorageKey('123')) == '/api/web/avatar/123'
+
+
+def _make_image(width: int, height: int) -> bytes:
+    # gradient with noise, so that the quality affects the file size
+    rng = np.random.default_rng(42)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    img = np.empty((height, width, 3), np.uint8)
+    img[..., 0] = (x + y) / 2
+    img[..., 1] = x
+    img[..., 2] = y
+    img += rng.integers(0, 32, (height, width, 3), np.uint8)
+    _, buffer = cv2.imencode('.jpg', img, (cv2.IMWRITE_JPEG_QUALITY, 90))
+    return buffer.tobytes()
+
+
+async def test_normalize_avatar():
+    data = await Image.normalize_avatar(_make_image(1200, 800))
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    assert data[8:12] == b'WEBP'
+    assert len(data) <= AVATAR_MAX_FILE_SIZE
+    assert img.shape[0] * img.shape[1] <= AVATAR_MAX_MEGAPIXELS
+    assert img.shape[1] / img.shape[0] <= AVATAR_MAX_RATIO
+
+
+@pytest.mark.extended
+@pytest.mark.parametrize('megapixels', [20, 50, 200])
+async def test_normalize_background_benchmark(megapixels):
+    width = int(sqrt(megapixels * 1_000_000 * 4 / 3))
+    data = _make_image(width, width * 3 // 4)
+
+    # measure the event loop lag during the normalization
+    max_lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal max_lag
+        while not done:
+            ts = perf_counter()
+            await asyncio.sleep(0.001)
+            max_lag = max(max_lag, perf_counter() - ts - 0.001)
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    ts = perf_counter()
+    result = await Image.normalize_background(data)
+    tt = perf_counter() - ts
+    done = True
+    await ticker_task
+
+    assert len(result) <= BACKGROUND_MAX_FILE_SIZE
+    logging.info(
+        'Normalized %dMP background in %.2fs (max event loop lag %.1fms)',
+        megapixels,
+        tt,
+        max_lag * 1000,
+    )
@@ -88,3 +88,18 @@ def test_password_hash_legacy_md5():
         password=password,
         is_test_user=False,
     ).success
+
+
+async def test_password_hash_v1_async():
+    password = TransmitUserPassword(v1=b'a' * 64)
+    password = PasswordType(SecretStr(b64encode(password.SerializeToString()).decode()))
+    async with PasswordHash.context():
+        password_pb = await PasswordHash.hash_async(password)
+        assert password_pb is not None
+        verified = await PasswordHash.verify_async(
+            password_pb=password_pb,
+            password=password,
+            is_test_user=False,
+        )
+    assert verified.success
+    assert PasswordHash.get_pool_stats()[0] == 0
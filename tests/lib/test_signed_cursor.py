@@ -0,0 +1,34 @@
+from datetime import timedelta
+from time import time
+
+import pytest
+
+from app.lib.signed_cursor import decode_signed_cursor, encode_signed_cursor
+from app.models.proto.server_pb2 import MapCursor
+
+
+def test_signed_cursor_roundtrip():
+    cursor = MapCursor(timestamp=int(time()), at_sequence_id=123, after_node_id=456, min_lon=1.5, max_lat=2.5)
+    decoded = decode_signed_cursor(encode_signed_cursor(cursor), MapCursor, expire=timedelta(minutes=1))
+    assert decoded == cursor
+
+
+@pytest.mark.parametrize(
+    'modify',
+    [
+        lambda s: s.replace('.', ''),
+        lambda s: s[::-1],
+        lambda s: 'A' + s[1:] if s[0] != 'A' else 'B' + s[1:],
+        lambda s: s.split('.')[0] + '.' + encode_signed_cursor(MapCursor(timestamp=1)).split('.')[1],
+    ],
+)
+def test_signed_cursor_tampered(modify):
+    cursor = encode_signed_cursor(MapCursor(timestamp=int(time()), at_sequence_id=123))
+    with pytest.raises(Exception):
+        decode_signed_cursor(modify(cursor), MapCursor, expire=timedelta(minutes=1))
+
+
+def test_signed_cursor_expired():
+    cursor = encode_signed_cursor(MapCursor(timestamp=int(time()) - 120, at_sequence_id=123))
+    with pytest.raises(Exception):
+        decode_signed_cursor(cursor, MapCursor, expire=timedelta(minutes=1))
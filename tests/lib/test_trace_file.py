@@ -1,8 +1,94 @@
+import bz2
+import gzip
+import tarfile
+import zipfile
+from collections.abc import Callable
+from io import BytesIO
+
+import pytest
+from zstandard import ZstdCompressor
+
+from app.exceptions06 import Exceptions06
+from app.lib.exceptions_context import exceptions_context
 from app.lib.trace_file import TraceFile
 
+_GPX_1 = b'<?xml version="1.0"?><gpx version="1.1"><trk><name>1</name></trk></gpx>'
+_GPX_2 = b'<?xml version="1.0"?><gpx version="1.1"><trk><name>2</name></trk></gpx>'
+
 
 def test_trace_file_compression():
     compressed, suffix = TraceFile.compress(b'hello')
     file_id = 'test' + suffix
     assert TraceFile.decompress_if_needed(compressed, file_id) == b'hello'
     assert TraceFile.decompress_if_needed(compressed, '') != b'hello'
+
+
+def test_trace_file_compression_stream():
+    compressed, suffix = TraceFile.compress(BytesIO(b'hello'))
+    assert TraceFile.decompress_if_needed(compressed, 'test' + suffix) == b'hello'
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_trace_file_recompress(compress):
+    data = _GPX_1 * 100
+    buffer, suffix = TraceFile.compress(data) if compress else (data, '.gpx')
+    file_id = 'test' + suffix
+    assert not TraceFile.is_recompressed(file_id)
+
+    recompressed, recompressed_suffix = TraceFile.recompress(buffer, file_id)
+    recompressed_file_id = 'test' + recompressed_suffix
+    assert TraceFile.is_recompressed(recompressed_file_id)
+    assert TraceFile.content_encoding(recompressed_file_id) == 'zstd'
+    assert TraceFile.decompress_if_needed(recompressed, recompressed_file_id) == data
+    assert len(recompressed) <= len(buffer)
+
+
+def _zip(files: list[bytes]) -> bytes:
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for i, file in enumerate(files):
+            archive.writestr(f'{i}.gpx', file)
+    return buffer.getvalue()
+
+
+def _tar(files: list[bytes]) -> bytes:
+    buffer = BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:') as archive:
+        for i, file in enumerate(files):
+            info = tarfile.TarInfo(f'{i}.gpx')
+            info.size = len(file)
+            archive.addfile(info, BytesIO(file))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    ('pack', 'expected'),
+    [
+        (lambda: _GPX_1, [_GPX_1]),
+        (lambda: gzip.compress(_GPX_1), [_GPX_1]),
+        (lambda: bz2.compress(_GPX_1), [_GPX_1]),
+        (lambda: ZstdCompressor().compress(_GPX_1), [_GPX_1]),
+        (lambda: _zip([_GPX_1, _GPX_2]), [_GPX_1, _GPX_2]),
+        (lambda: _tar([_GPX_1, _GPX_2]), [_GPX_1, _GPX_2]),
+        (lambda: gzip.compress(_tar([_GPX_1, _GPX_2])), [_GPX_1, _GPX_2]),
+        (lambda: bz2.compress(_zip([_GPX_1, _GPX_2])), [_GPX_1, _GPX_2]),
+    ],
+)
+def test_trace_file_extract(pack: Callable[[], bytes], expected: list[bytes]):
+    files = [file.read() for file in TraceFile.extract(BytesIO(pack()))]
+    assert files == expected
+
+
+def test_trace_file_extract_too_big():
+    buffer = gzip.compress(_GPX_1[:-6] + b' ' * (81 * 1024 * 1024) + b'</gpx>')
+    with exceptions_context(Exceptions06()), pytest.raises(Exception):  # noqa: PT012
+        for file in TraceFile.extract(BytesIO(buffer)):
+            while file.read(1024 * 1024):
+                pass
+
+
+def test_trace_file_extract_corrupted():
+    buffer = gzip.compress(_GPX_1 * 100)
+    with exceptions_context(Exceptions06()), pytest.raises(Exception):  # noqa: PT012
+        for file in TraceFile.extract(BytesIO(buffer[:-100])):
+            file.read()
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from polyline_rs import decode_lonlat
+from shapely import MultiPoint
+
+from app.lib.trace_preview import encode_trace_preview
+from app.limits import TRACE_PREVIEW_MAX_POINTS, TRACE_PREVIEW_RESOLUTION
+from app.models.db.trace_segment import TraceSegment
+
+
+def _segment(coords) -> TraceSegment:
+    return TraceSegment(
+        track_num=0,
+        segment_num=0,
+        points=MultiPoint(coords),
+        capture_times=None,
+        elevations=None,
+    )
+
+
+@pytest.mark.parametrize('size', [2, TRACE_PREVIEW_MAX_POINTS, 1000])
+def test_encode_trace_preview(size):
+    coords = np.column_stack((np.linspace(10, 11, size), np.linspace(50, 51, size)))
+    half = size // 2
+    result = decode_lonlat(encode_trace_preview((_segment(coords[:half]), _segment(coords[half:]))), 0)
+    assert len(result) == min(size, TRACE_PREVIEW_MAX_POINTS)
+    # the taller side spans the whole resolution
+    assert result[0][1] == TRACE_PREVIEW_RESOLUTION
+    assert result[-1][1] == 0
+    assert result[0][0] < result[-1][0]
+
+
+def test_encode_trace_preview_not_enough_points():
+    assert encode_trace_preview((_segment([(10, 50)]),)) == ''
@@ -0,0 +1,133 @@
+import logging
+import struct
+from datetime import UTC, datetime, timedelta
+from time import perf_counter
+
+import numpy as np
+import pytest
+from shapely import MultiPoint, from_wkb, lib, multipoints, to_wkb
+
+from app.lib.trace_segment_codec import TraceSegmentCodec
+
+
+def _random_segment(rng: np.random.Generator, size: int):
+    coords = np.array((21.0, 52.0)) + np.cumsum(rng.normal(0, 1e-4, (size, 2)), axis=0)
+    points: MultiPoint = multipoints(coords.round(7))  # pyright: ignore[reportAssignmentType]
+    start = datetime(2024, 1, 1, tzinfo=UTC)
+    seconds = np.cumsum(rng.integers(1, 5, size)).tolist()
+    capture_times: list[datetime | None] = [start + timedelta(seconds=s) for s in seconds]
+    elevations: list[float | None] = (100 + np.cumsum(rng.normal(0, 1, size))).round(1).tolist()
+    return points, capture_times, elevations
+
+
+def test_trace_segment_codec():
+    points, capture_times, elevations = _random_segment(np.random.default_rng(42), 100)
+    data = TraceSegmentCodec.encode(points, capture_times, elevations)
+    result_points, result_capture_times, result_elevations = TraceSegmentCodec.decode_objects(data)
+
+    assert result_points.equals(points)
+    assert result_capture_times == capture_times
+    assert result_elevations is not None
+    assert np.allclose(result_elevations, elevations)  # pyright: ignore[reportArgumentType]
+
+
+@pytest.mark.parametrize(
+    ('capture_times', 'elevations'),
+    [
+        (None, None),
+        ([None, datetime(2024, 1, 1, 12, 0, 0, 123000, UTC), None], [None, None, 190.8]),
+        ([None, None, None], [None, None, None]),
+        # large gaps fall back to seconds and meters
+        (
+            [datetime(1990, 1, 1, tzinfo=UTC), datetime(2024, 1, 1, tzinfo=UTC), None],
+            [-400.0, 8848.0, None],
+        ),
+    ],
+)
+def test_trace_segment_codec_missing(capture_times, elevations):
+    points: MultiPoint = multipoints([(-180, -90), (179.9999999, 89.9999999), (0, 0)])  # pyright: ignore[reportAssignmentType]
+    data = TraceSegmentCodec.encode(points, capture_times, elevations)
+    result_points, result_capture_times, result_elevations = TraceSegmentCodec.decode_objects(data)
+
+    assert result_points.equals(points)
+    if capture_times is None or all(t is None for t in capture_times):
+        assert result_capture_times is None
+    else:
+        assert result_capture_times == capture_times
+    if elevations is None or all(e is None for e in elevations):
+        assert result_elevations is None
+    else:
+        assert result_elevations == elevations
+
+
+def test_trace_segment_codec_large():
+    points, capture_times, elevations = _random_segment(np.random.default_rng(42), 70_000)
+    data = TraceSegmentCodec.encode(points, capture_times, elevations)
+    result_points, result_capture_times, _ = TraceSegmentCodec.decode_objects(data)
+
+    assert result_points.equals(points)
+    assert result_capture_times == capture_times
+
+
+def test_trace_segment_codec_version_1():
+    points: MultiPoint = multipoints([(1, 2), (3, 4)])  # pyright: ignore[reportAssignmentType]
+    data = TraceSegmentCodec.encode(points, None, [1.5, 2.5])
+
+    # version 1 stored the number of points as uint16
+    data_v1 = struct.pack('<BBH', 1, data[1], 2) + data[6:]
+    result_points, _, result_elevations = TraceSegmentCodec.decode_objects(data_v1)
+    assert result_points.equals(points)
+    assert result_elevations == [1.5, 2.5]
+    assert np.array_equal(TraceSegmentCodec.decode_coords(data_v1), [(1, 2), (3, 4)])
+
+
+def test_trace_segment_codec_bounds():
+    points: MultiPoint = multipoints([(1, 2), (1, 2)])  # pyright: ignore[reportAssignmentType]
+    bounds = TraceSegmentCodec.bounds(points)
+    assert bounds.is_valid
+    assert bounds.area > 0
+    assert bounds.intersects(points)
+
+
+@pytest.mark.extended
+def test_trace_segment_codec_comparison():
+    rng = np.random.default_rng(42)
+    segments = [_random_segment(rng, 100) for _ in range(1000)]
+
+    # legacy: WKB geometry and postgres arrays (24 bytes header, 4 bytes length + value per item)
+    legacy_size = sum(
+        len(to_wkb(points)) + (24 + 12 * len(times)) + (24 + 8 * len(times)) for points, times, _ in segments
+    )
+    legacy_wkbs = [to_wkb(points) for points, _, _ in segments]
+
+    datas = [TraceSegmentCodec.encode(*segment) for segment in segments]
+    compact_size = sum(len(data) for data in datas)
+
+    ts = perf_counter()
+    for wkb in legacy_wkbs:
+        lib.get_coordinates(np.asarray(from_wkb(wkb), dtype=np.object_), False, False)
+    legacy_time = perf_counter() - ts
+
+    ts = perf_counter()
+    for data in datas:
+        TraceSegmentCodec.decode(data)
+    compact_time = perf_counter() - ts
+
+    ts = perf_counter()
+    for data in datas:
+        TraceSegmentCodec.decode_objects(data)
+    compact_objects_time = perf_counter() - ts
+
+    logging.info(
+        'Trace segments payload: legacy %d bytes, compact %d bytes (%.1fx smaller)',
+        legacy_size,
+        compact_size,
+        legacy_size / compact_size,
+    )
+    logging.info(
+        'Trace segments decoding: legacy coordinates %.3fs, compact all columns %.3fs (%.3fs as objects)',
+        legacy_time,
+        compact_time,
+        compact_objects_time,
+    )
+    assert compact_size * 2 < legacy_size
@@ -0,0 +1,103 @@
+import logging
+from time import perf_counter
+
+import pytest
+from shapely import Point, box
+
+from app.models.db.element import Element
+from app.models.db.element_member import ElementMember
+from app.models.element import ElementId
+from app.queries.element_query import ElementQuery
+from app.services.optimistic_diff import OptimisticDiff
+
+
+async def _create_grid(changeset_id: int, origin: Point, nodes: int) -> None:
+    """
+    Create a grid of nodes, every row of 100 nodes connected with a way and every 10 ways in a relation.
+    """
+    for offset in range(0, nodes, 1000):
+        batch = min(1000, nodes - offset)
+        elements: list[Element] = [
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=ElementId(-i - 1),
+                version=1,
+                visible=True,
+                tags={},
+                point=Point(origin.x + (offset + i) % 100 * 1e-5, origin.y + (offset + i) // 100 * 1e-5),
+                members=[],
+            )
+            for i in range(batch)
+        ]
+        ways_count = (batch + 99) // 100
+        elements.extend(
+            Element(
+                changeset_id=changeset_id,
+                type='way',
+                id=ElementId(-w - 1),
+                version=1,
+                visible=True,
+                tags={'highway': 'residential'},
+                point=None,
+                members=[
+                    ElementMember(order=i, type='node', id=ElementId(-(w * 100 + i) - 1), role='')
+                    for i in range(min(100, batch - w * 100))
+                ],
+            )
+            for w in range(ways_count)
+        )
+        elements.append(
+            Element(
+                changeset_id=changeset_id,
+                type='relation',
+                id=ElementId(-1),
+                version=1,
+                visible=True,
+                tags={'type': 'route'},
+                point=None,
+                members=[ElementMember(order=w, type='way', id=ElementId(-w - 1), role='') for w in range(ways_count)],
+            )
+        )
+        await OptimisticDiff.run(elements)
+
+
+def _refs(elements: list[Element]) -> set[tuple[str, int, int]]:
+    return {(element.type, element.id, element.version) for element in elements}
+
+
+@pytest.mark.parametrize(
+    ('partial_ways', 'include_relations'),
+    [(False, True), (True, False)],
+)
+async def test_find_many_by_geom_single_query(changeset_id: int, partial_ways, include_relations):
+    origin = Point(7.1 + partial_ways, 8.1)
+    await _create_grid(changeset_id, origin, 300)
+
+    # cut through the ways, so that the ways' nodes extend outside the geometry
+    geometry = box(origin.x, origin.y, origin.x + 50e-5, origin.y + 300e-5)
+    kwargs = {'partial_ways': partial_ways, 'include_relations': include_relations, 'nodes_limit': None}
+    expected = await ElementQuery.find_many_by_geom(geometry, **kwargs)
+    actual = await ElementQuery.find_many_by_geom(geometry, single_query=True, **kwargs)
+    assert _refs(actual) == _refs(expected)
+    assert len(actual) == len(expected)
+
+
+@pytest.mark.extended
+async def test_find_many_by_geom_single_query_benchmark(changeset_id: int):
+    for i, nodes in enumerate((1_000, 10_000, 50_000)):
+        origin = Point(7.5 + i * 0.1, 8.5)
+        await _create_grid(changeset_id, origin, nodes)
+        geometry = box(origin.x, origin.y, origin.x + 100e-5, origin.y + (nodes // 100) * 1e-5)
+
+        for single_query in (False, True):
+            ts = perf_counter()
+            elements = await ElementQuery.find_many_by_geom(geometry, nodes_limit=None, single_query=single_query)
+            tt = perf_counter() - ts
+            logging.info(
+                'find_many_by_geom(single_query=%s) of %d nodes returned %d elements in %.3fs',
+                single_query,
+                nodes,
+                len(elements),
+                tt,
+            )
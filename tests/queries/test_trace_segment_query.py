@@ -0,0 +1,46 @@
+from httpx import AsyncClient
+
+from app.lib.geo_utils import parse_bbox
+from app.lib.xmltodict import XMLToDict
+from app.queries.trace_segment_query import TraceSegmentPosition, TraceSegmentQuery
+from app.services.trace_service import TraceService
+
+
+async def test_find_many_by_geometry_page(client: AsyncClient, gpx: dict):
+    client.headers['Authorization'] = 'User user1'
+
+    # create gpx
+    r = await client.post(
+        '/api/0.6/gpx/create',
+        data={
+            'visibility': 'identifiable',
+            'description': 'test_find_many_by_geometry_page',
+        },
+        files={
+            'file': ('test_find_many_by_geometry_page.gpx', XMLToDict.unparse(gpx, raw=True)),
+        },
+    )
+    assert r.is_success, r.text
+    await TraceService.force_process()
+
+    geometry = parse_bbox('20.86,51.85,20.89,51.87')
+    segments = await TraceSegmentQuery.find_many_by_geometry(geometry, identifiable_trackable=True, limit=None)
+    expected = [(s.trace_id, s.track_num, s.segment_num) for s in segments]
+    assert len(expected) > 1
+
+    # paginate one segment at a time
+    positions: list[TraceSegmentPosition] = []
+    after: TraceSegmentPosition | None = None
+    while True:
+        page, after = await TraceSegmentQuery.find_many_by_geometry_page(
+            geometry,
+            identifiable_trackable=True,
+            after=after,
+            limit=1,
+        )
+        positions.extend((s.trace_id, s.track_num, s.segment_num) for s in page)
+        if after is None:
+            break
+        assert after == positions[-1]
+
+    assert positions == expected
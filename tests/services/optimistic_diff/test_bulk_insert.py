@@ -0,0 +1,74 @@
+import logging
+from time import perf_counter
+
+import pytest
+from shapely import Point
+from sqlalchemy import func, select
+
+from app.db import db
+from app.lib.date_utils import utcnow
+from app.models.db.element import Element
+from app.models.db.element_member import ElementMember
+from app.models.element import ElementId
+from app.services.optimistic_diff.apply import _insert_elements_db
+
+# far away from the real sequence ids, rows are rolled back after each measurement
+_SEQUENCE_ID_OFFSET = 1 << 50
+
+
+def _make_rows(changeset_id: int, size: int) -> tuple[list[Element], list[ElementMember]]:
+    now = utcnow()
+    elements: list[Element] = []
+    members: list[ElementMember] = []
+    for i in range(size):
+        sequence_id = _SEQUENCE_ID_OFFSET + i
+        is_way = i % 10 == 9
+        element = Element(
+            changeset_id=changeset_id,
+            type='way' if is_way else 'node',
+            id=ElementId(_SEQUENCE_ID_OFFSET + i),
+            version=1,
+            visible=True,
+            tags={'highway': 'residential'} if is_way else {},
+            point=None if is_way else Point(i / size, 0),
+            members=[],
+        )
+        element.sequence_id = sequence_id
+        element.created_at = now
+        elements.append(element)
+        if is_way:
+            for order in range(20):
+                member = ElementMember(order=order, type='node', id=ElementId(_SEQUENCE_ID_OFFSET + i - 9), role='')
+                member.sequence_id = sequence_id
+                members.append(member)
+    return elements, members
+
+
+@pytest.mark.extended
+@pytest.mark.parametrize('size', [1_000, 10_000, 50_000])
+async def test_bulk_insert_benchmark(changeset_id: int, size: int):
+    elements, members = _make_rows(changeset_id, size)
+    async with db() as session:
+        ts = perf_counter()
+        session.add_all(elements)
+        session.add_all(members)
+        await session.flush()
+        orm_time = perf_counter() - ts
+
+    elements, members = _make_rows(changeset_id, size)
+    async with db() as session:
+        ts = perf_counter()
+        await _insert_elements_db(elements, members, session)
+        bulk_time = perf_counter() - ts
+
+        stmt = select(func.count()).select_from(Element).where(Element.sequence_id >= _SEQUENCE_ID_OFFSET)
+        assert await session.scalar(stmt) == size
+
+    logging.info(
+        'Inserted %d elements and %d members: ORM flush %.3fs, bulk insert %.3fs (%.1fx)',
+        size,
+        len(members),
+        orm_time,
+        bulk_time,
+        orm_time / bulk_time,
+    )
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from asyncio import TaskGroup
+from time import perf_counter
+
+import pytest
+from shapely import Point
+
+from app.models.db.element import Element
+from app.models.db.element_member import ElementMember
+from app.models.element import ElementId, ElementRef
+from app.queries.element_query import ElementQuery
+from app.services.changeset_service import ChangesetService
+from app.services.optimistic_diff import OptimisticDiff
+
+
+def _make_way_diff(changeset_id: int, nodes: int) -> tuple[Element, ...]:
+    return (
+        *(
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=ElementId(-i),
+                version=1,
+                visible=True,
+                tags={},
+                point=Point(i / 1000, 0),
+                members=[],
+            )
+            for i in range(1, nodes + 1)
+        ),
+        Element(
+            changeset_id=changeset_id,
+            type='way',
+            id=ElementId(-1),
+            version=1,
+            visible=True,
+            tags={'highway': 'residential'},
+            point=None,
+            members=[ElementMember(order=i, type='node', id=ElementId(-i - 1), role='') for i in range(nodes)],
+        ),
+    )
+
+
+async def test_concurrent_disjoint_uploads(changeset_id: int):
+    changeset_ids = (changeset_id, await ChangesetService.create({}))
+
+    async with TaskGroup() as tg:
+        tasks = tuple(tg.create_task(OptimisticDiff.run(_make_way_diff(cid, 10))) for cid in changeset_ids)
+
+    node_ids: set[ElementId] = set()
+    way_ids: set[ElementId] = set()
+    for task in tasks:
+        assigned_ref_map = task.result()
+        node_ids.update(assigned_ref_map[ElementRef('node', ElementId(-i))][0].id for i in range(1, 11))
+        way_ids.add(assigned_ref_map[ElementRef('way', ElementId(-1))][0].id)
+
+    # ids must be unique across the concurrent diffs
+    assert len(node_ids) == 20
+    assert len(way_ids) == 2
+
+    elements = await ElementQuery.get_by_refs(
+        [ElementRef('way', way_id) for way_id in way_ids],
+        recurse_ways=True,
+        limit=None,
+    )
+    assert len(elements) == 22
+
+
+@pytest.mark.parametrize('attempt', range(5))
+async def test_concurrent_delete_and_reference(changeset_id: int, attempt):
+    assigned_ref_map = await OptimisticDiff.run(_make_way_diff(changeset_id, 1)[:1])
+    node_id = assigned_ref_map[ElementRef('node', ElementId(-1))][0].id
+    node_ref = ElementRef('node', node_id)
+    other_changeset_id = await ChangesetService.create({})
+
+    delete_diff = (
+        Element(
+            changeset_id=changeset_id,
+            type='node',
+            id=node_id,
+            version=2,
+            visible=False,
+            tags={},
+            point=None,
+            members=[],
+        ),
+    )
+    reference_diff = (
+        Element(
+            changeset_id=other_changeset_id,
+            type='way',
+            id=ElementId(-1),
+            version=1,
+            visible=True,
+            tags={'highway': 'residential'},
+            point=None,
+            members=[ElementMember(order=0, type='node', id=node_id, role='')],
+        ),
+    )
+
+    # exactly one of the conflicting diffs must succeed
+    results = await asyncio.gather(
+        OptimisticDiff.run(delete_diff),
+        OptimisticDiff.run(reference_diff),
+        return_exceptions=True,
+    )
+    delete_result, reference_result = results
+    assert sum(isinstance(result, BaseException) for result in results) == 1
+
+    node = (await ElementQuery.get_by_refs((node_ref,), limit=1))[0]
+    parents = (await ElementQuery.get_parents_refs_by_refs((node_ref,), limit=None)).get(node_ref, [])
+
+    # no orphan references may be left behind
+    if not isinstance(delete_result, BaseException):
+        assert not node.visible
+        assert not parents
+    else:
+        assert not isinstance(reference_result, BaseException)
+        way_id = reference_result[ElementRef('way', ElementId(-1))][0].id
+        assert node.visible
+        assert parents == [ElementRef('way', way_id)]
+
+
+@pytest.mark.extended
+async def test_concurrent_uploads_throughput(changeset_id: int):
+    uploaders_counts = (1, 4)
+    uploads_per_uploader = 10
+    changeset_ids = [changeset_id]
+    changeset_ids.extend([await ChangesetService.create({}) for _ in range(max(uploaders_counts) - 1)])
+
+    async def uploader(cid: int) -> None:
+        for _ in range(uploads_per_uploader):
+            await OptimisticDiff.run(_make_way_diff(cid, 50))
+
+    throughputs: list[float] = []
+    for uploaders in uploaders_counts:
+        ts = perf_counter()
+        async with TaskGroup() as tg:
+            for cid in changeset_ids[:uploaders]:
+                tg.create_task(uploader(cid))
+        tt = perf_counter() - ts
+
+        throughput = uploaders * uploads_per_uploader / tt
+        logging.info('OptimisticDiff throughput with %d uploaders: %.1f uploads/s', uploaders, throughput)
+        throughputs.append(throughput)
+
+    # uploads of disjoint elements must not be serialized
+    assert throughputs[1] > throughputs[0] * 1.5
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import timedelta
+
+from app.db import valkey
+from app.lib.buffered_random import buffered_rand_urlsafe
+from app.services.cache_service import CacheContext, CacheService
+
+_context = CacheContext('Test')
+
+
+async def test_cache_get_coalesce():
+    key = buffered_rand_urlsafe(16)
+    calls = 0
+
+    async def factory() -> bytes:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        return b'value'
+
+    stats = CacheService.get_stats()
+    entries = await asyncio.gather(*(CacheService.get(key, _context, factory) for _ in range(5)))
+    assert calls == 1
+    assert all(entry.value == b'value' for entry in entries)
+    assert CacheService.get_stats().coalesced == stats.coalesced + 4
+
+    # small values are served from the in-process cache
+    entry = await CacheService.get(key, _context, factory)
+    assert entry.value == b'value'
+    assert calls == 1
+    assert CacheService.get_stats().local_hits == stats.local_hits + 1
+
+
+async def test_cache_get_lock_lease():
+    key = buffered_rand_urlsafe(16)
+    cache_key = f'{_context}:{key.encode().hex()}'
+
+    async def factory() -> bytes:
+        raise AssertionError('Factory must not be called while the lock is held')
+
+    # simulate another process computing the value
+    async with valkey() as conn:
+        await conn.set(f'lock:{cache_key}', b'other', px=timedelta(seconds=5))
+    task = asyncio.create_task(CacheService.get(key, _context, factory, lock_lease=timedelta(seconds=5)))
+    await asyncio.sleep(0.2)
+    assert not task.done()
+    async with valkey() as conn:
+        await conn.set(cache_key, b'\x00value')
+        await conn.delete(f'lock:{cache_key}')
+
+    entry = await task
+    assert entry.value == b'value'
+
+
+async def test_cache_get_factory_error():
+    key = buffered_rand_urlsafe(16)
+
+    async def factory() -> bytes:
+        await asyncio.sleep(0.05)
+        raise ValueError('failed')
+
+    results = await asyncio.gather(
+        *(CacheService.get(key, _context, factory) for _ in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+async def test_cache_get_many():
+    keys = [buffered_rand_urlsafe(16) for _ in range(3)]
+    calls: list[str] = []
+
+    def make_factory(key: str):
+        async def factory() -> bytes:
+            calls.append(key)
+            return key.encode()
+
+        return factory
+
+    # cache the first key
+    await CacheService.get(keys[0], _context, make_factory(keys[0]))
+    async with valkey() as conn:
+        assert await conn.exists(f'{_context}:{keys[0].encode().hex()}')
+    calls.clear()
+
+    items = [(key, _context, make_factory(key)) for key in (*keys, keys[1])]
+    entries = await CacheService.get_many(items)
+    assert [entry.value for entry in entries] == [key.encode() for key in (*keys, keys[1])]
+    assert sorted(calls) == sorted(keys[1:])
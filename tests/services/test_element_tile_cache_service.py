@@ -0,0 +1,227 @@
+from shapely import Point, box
+
+from app.limits import MAP_TILE_CACHE_INVALIDATE_MAX_ELEMENTS
+from app.models.db.element import Element
+from app.models.db.element_member import ElementMember
+from app.models.element import ElementId, ElementRef, ElementType
+from app.services.element_tile_cache_service import ElementTileCacheService
+from app.services.optimistic_diff import OptimisticDiff
+
+
+async def test_element_tile_cache_invalidate(changeset_id: int):
+    geometry = box(5.1234, 6.2345, 5.1236, 6.2347)
+
+    # create node
+    assigned_ref_map = await OptimisticDiff.run(
+        [
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=ElementId(-1),
+                version=1,
+                visible=True,
+                tags={},
+                point=Point(5.1235, 6.2346),
+                members=[],
+            )
+        ]
+    )
+    node = assigned_ref_map[ElementRef('node', ElementId(-1))][0]
+
+    elements = await ElementTileCacheService.find_many_by_geom(geometry, nodes_limit=None)
+    assert any(element.id == node.id for element in elements)
+
+    # repeated query is served from the cache
+    hits, _ = ElementTileCacheService.get_stats()
+    elements = await ElementTileCacheService.find_many_by_geom(geometry, nodes_limit=None)
+    assert any(element.id == node.id for element in elements)
+    assert ElementTileCacheService.get_stats()[0] > hits
+
+    # move node out of the geometry
+    await OptimisticDiff.run(
+        [
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=node.id,
+                version=2,
+                visible=True,
+                tags={},
+                point=Point(5.2235, 6.2346),
+                members=[],
+            )
+        ]
+    )
+
+    elements = await ElementTileCacheService.find_many_by_geom(geometry, nodes_limit=None)
+    assert not any(element.id == node.id for element in elements)
+
+
+def _find(elements: list[Element], type: ElementType, id: ElementId) -> Element:
+    return next(element for element in elements if element.type == type and element.id == id)
+
+
+async def test_element_tile_cache_invalidate_way_node(changeset_id: int):
+    # the way nodes are in different tiles, the query only covers the first one
+    geometry = box(7.1000, 8.1000, 7.1002, 8.1002)
+
+    assigned_ref_map = await OptimisticDiff.run(
+        [
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=ElementId(-1),
+                version=1,
+                visible=True,
+                tags={},
+                point=Point(7.1001, 8.1001),
+                members=[],
+            ),
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=ElementId(-2),
+                version=1,
+                visible=True,
+                tags={},
+                point=Point(7.1201, 8.1001),
+                members=[],
+            ),
+            Element(
+                changeset_id=changeset_id,
+                type='way',
+                id=ElementId(-1),
+                version=1,
+                visible=True,
+                tags={},
+                point=None,
+                members=[
+                    ElementMember(order=0, type='node', id=ElementId(-1), role=''),
+                    ElementMember(order=1, type='node', id=ElementId(-2), role=''),
+                ],
+            ),
+        ]
+    )
+    node_id = assigned_ref_map[ElementRef('node', ElementId(-2))][0].id
+
+    elements = await ElementTileCacheService.find_many_by_geom(geometry, nodes_limit=None)
+    assert _find(elements, 'node', node_id).version == 1
+
+    # move the other node within its own tile
+    await OptimisticDiff.run(
+        [
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=node_id,
+                version=2,
+                visible=True,
+                tags={},
+                point=Point(7.1203, 8.1003),
+                members=[],
+            )
+        ]
+    )
+
+    elements = await ElementTileCacheService.find_many_by_geom(geometry, nodes_limit=None)
+    node = _find(elements, 'node', node_id)
+    assert node.version == 2
+    assert node.point == Point(7.1203, 8.1003)
+
+
+async def test_element_tile_cache_invalidate_relation(changeset_id: int):
+    geometry = box(7.1000, 9.1000, 7.1002, 9.1002)
+
+    assigned_ref_map = await OptimisticDiff.run(
+        [
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=ElementId(-1),
+                version=1,
+                visible=True,
+                tags={},
+                point=Point(7.1001, 9.1001),
+                members=[],
+            ),
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=ElementId(-2),
+                version=1,
+                visible=True,
+                tags={},
+                point=Point(7.1401, 9.1001),
+                members=[],
+            ),
+            Element(
+                changeset_id=changeset_id,
+                type='relation',
+                id=ElementId(-1),
+                version=1,
+                visible=True,
+                tags={'type': 'route'},
+                point=None,
+                members=[ElementMember(order=0, type='node', id=ElementId(-1), role='')],
+            ),
+        ]
+    )
+    node_id = assigned_ref_map[ElementRef('node', ElementId(-1))][0].id
+    other_node_id = assigned_ref_map[ElementRef('node', ElementId(-2))][0].id
+    relation_id = assigned_ref_map[ElementRef('relation', ElementId(-1))][0].id
+
+    elements = await ElementTileCacheService.find_many_by_geom(geometry, nodes_limit=None)
+    assert _find(elements, 'relation', relation_id).version == 1
+
+    # add a member in another tile, without changing the tags
+    await OptimisticDiff.run(
+        [
+            Element(
+                changeset_id=changeset_id,
+                type='relation',
+                id=relation_id,
+                version=2,
+                visible=True,
+                tags={'type': 'route'},
+                point=None,
+                members=[
+                    ElementMember(order=0, type='node', id=node_id, role=''),
+                    ElementMember(order=1, type='node', id=other_node_id, role=''),
+                ],
+            )
+        ]
+    )
+
+    elements = await ElementTileCacheService.find_many_by_geom(geometry, nodes_limit=None)
+    relation = _find(elements, 'relation', relation_id)
+    assert relation.version == 2
+    assert [member.id for member in relation.members] == [node_id, other_node_id]  # pyright: ignore[reportOptionalIterable]
+
+
+async def test_element_tile_cache_invalidate_all(changeset_id: int):
+    geometry = box(7.1000, 10.1000, 7.1002, 10.1002)
+
+    await OptimisticDiff.run(
+        [
+            Element(
+                changeset_id=changeset_id,
+                type='node',
+                id=ElementId(-1),
+                version=1,
+                visible=True,
+                tags={},
+                point=Point(7.1001, 10.1001),
+                members=[],
+            )
+        ]
+    )
+    await ElementTileCacheService.find_many_by_geom(geometry, nodes_limit=None)
+
+    # too many changed elements invalidate all the tiles
+    _, misses = ElementTileCacheService.get_stats()
+    await ElementTileCacheService.invalidate(
+        [ElementRef('node', ElementId(i)) for i in range(1, MAP_TILE_CACHE_INVALIDATE_MAX_ELEMENTS + 2)],
+        (),
+    )
+    await ElementTileCacheService.find_many_by_geom(geometry, nodes_limit=None)
+    assert ElementTileCacheService.get_stats()[1] > misses
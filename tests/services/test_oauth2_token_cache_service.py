@@ -0,0 +1,61 @@
+from httpx import AsyncClient
+from sqlalchemy import update
+
+from app.db import db_commit
+from app.models.db.user import User
+from app.models.types import DisplayNameType
+from app.queries.user_query import UserQuery
+from app.services.oauth2_token_cache_service import OAuth2TokenCacheService
+from app.services.oauth2_token_service import OAuth2TokenService
+from app.services.system_app_service import SystemAppService
+
+
+async def test_find_one_authorized_by_token(client: AsyncClient):
+    user = await UserQuery.find_one_by_display_name(DisplayNameType('user1'))
+    assert user is not None
+    access_token = (await SystemAppService.create_access_token('SystemApp.web', user_id=user.id)).get_secret_value()
+
+    token = await OAuth2TokenCacheService.find_one_authorized_by_token(access_token)
+    assert token is not None
+    hits, _ = OAuth2TokenCacheService.get_stats()
+
+    # cache hit must return an equal snapshot
+    cached = await OAuth2TokenCacheService.find_one_authorized_by_token(access_token)
+    assert cached is not None
+    assert OAuth2TokenCacheService.get_stats()[0] == hits + 1
+    assert cached is not token
+    assert cached.id == token.id
+    assert cached.scopes == token.scopes
+    assert cached.authorized_at == token.authorized_at
+    assert cached.user is not token.user
+    for key in ('id', 'display_name', 'status', 'roles', 'created_at'):
+        assert getattr(cached.user, key) == getattr(token.user, key), key
+    assert cached.user.is_test_user == user.is_test_user
+
+    # credentials and personal data are never cached
+    for key in ('email', 'password_pb', 'created_ip', 'description'):
+        assert key not in cached.user.__dict__, key
+
+
+async def test_find_one_authorized_by_token_invalidate(client: AsyncClient):
+    user = await UserQuery.find_one_by_display_name(DisplayNameType('user1'))
+    assert user is not None
+    access_token = await SystemAppService.create_access_token('SystemApp.web', user_id=user.id)
+
+    token = await OAuth2TokenCacheService.find_one_authorized_by_token(access_token.get_secret_value())
+    assert token is not None
+    crash_reporting = token.user.crash_reporting
+
+    # user updates are visible after the invalidation
+    async with db_commit() as session:
+        stmt = update(User).where(User.id == user.id).values({User.crash_reporting: not crash_reporting})
+        await session.execute(stmt)
+    await OAuth2TokenCacheService.invalidate_user(user.id)
+
+    token = await OAuth2TokenCacheService.find_one_authorized_by_token(access_token.get_secret_value())
+    assert token is not None
+    assert token.user.crash_reporting == (not crash_reporting)
+
+    # revoked tokens are not found
+    await OAuth2TokenService.revoke_by_access_token(access_token)
+    assert await OAuth2TokenCacheService.find_one_authorized_by_token(access_token.get_secret_value()) is None